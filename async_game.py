@@ -0,0 +1,66 @@
+import asyncio
+
+from game import Game, RingError
+from network import BootstrapError
+from protocol import Actions
+
+# Handlers that may block on input()
+BLOCKING_ACTIONS = {Actions.ASK_BET, Actions.ASK_CARD}
+
+
+class AsyncGame(Game):
+    local_queue: asyncio.Queue = None
+
+    async def receive_decoded_message(self):
+        network_message = await self.network.receive_message()
+        return self.decode_message(network_message)
+
+    # Traffic for other players is forwarded as soon as it arrives, even while
+    # a local handler is waiting on the player
+    async def route(self):
+        while True:
+            decoded_message = await self.receive_decoded_message()
+
+            if self.is_addressed(decoded_message):
+                self.local_queue.put_nowait(decoded_message)
+            else:
+                self.forward_message(decoded_message)
+
+    async def dispatch(self):
+        while True:
+            decoded_message = await self.local_queue.get()
+
+            if decoded_message["action"] in BLOCKING_ACTIONS:
+                running = await asyncio.to_thread(self.handle_message, decoded_message)
+            else:
+                running = self.handle_message(decoded_message)
+
+            if not running:
+                return
+
+    # The barrier runs on the blocking socket before the loop takes it over
+    async def start(self):
+        try:
+            if self.network.startup_timeout:
+                await asyncio.to_thread(self.bootstrap)
+        except BootstrapError as error:
+            print(error)
+            exit(1)
+
+        await self.network.open()
+        self.local_queue = asyncio.Queue()
+
+        if self.is_dealer():
+            self.start_great_round()
+
+        router = asyncio.create_task(self.route())
+        try:
+            await self.dispatch()
+        except RingError as error:
+            print(error)
+            exit(1)
+        finally:
+            router.cancel()
+            # Let the loop flush the frames sent by the last handler
+            await asyncio.sleep(0)
+            self.network.close()
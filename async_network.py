@@ -0,0 +1,106 @@
+import asyncio
+import socket
+import threading
+
+from network import Network
+from protocol import encode_hello, is_hello
+from settings import BASE_PORT, NUM_PLAYERS
+
+
+class AsyncNetwork(Network, asyncio.DatagramProtocol):
+    transport: asyncio.DatagramTransport = None
+    loop: asyncio.AbstractEventLoop = None
+    loop_thread_id = 0
+    queue: asyncio.Queue = None
+    token_lock: threading.Lock = None
+
+    # Frames may be forwarded while a local handler still holds the token,
+    # so the token is counted per received frame instead of being a flag
+    has_token = 0
+
+    def __init__(
+        self,
+        player_id,
+        player_ip,
+        next_player_ip,
+        num_players=NUM_PLAYERS,
+        base_port=BASE_PORT,
+        topology=None,
+        startup_timeout=0,
+    ):
+        # The socket is bound here so the startup barrier can run on it before
+        # the event loop takes it over in open()
+        super().__init__(
+            player_id,
+            player_ip,
+            next_player_ip,
+            num_players,
+            base_port,
+            topology=topology,
+            startup_timeout=startup_timeout,
+        )
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+        self.token_lock = threading.Lock()
+
+    async def open(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.queue = asyncio.Queue()
+
+        await self.loop.create_datagram_endpoint(lambda: self, sock=self.sock)
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+
+    ###################### DatagramProtocol ######################
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    # Probes and laps still going round after the barrier are answered here
+    def datagram_received(self, data, addr):
+        if is_hello(data):
+            self.answer_hello(data, addr)
+            return
+        self.queue.put_nowait(data)
+
+    def error_received(self, exc):
+        print("Network error:", exc)
+
+    def send_hello(self, kind, nonce, address, lap=None):
+        if not self.transport:
+            return super().send_hello(kind, nonce, address, lap)
+        self.transport.sendto(encode_hello(kind, self.player_id, nonce, lap), address)
+
+    ######################### Token path #########################
+
+    # Safe to call from handler threads, the datagram is sent by the loop
+    def send_message(self, message):
+        with self.token_lock:
+            if self.has_token <= 0:
+                print("The player does not have the token to send the message")
+                exit(1)
+            self.has_token -= 1
+
+        address = (self.next_player_ip, self.next_player_port)
+        if self.metrics:
+            self.metrics.sent(message)
+        if self.journal:
+            self.journal.sent(message)
+
+        if threading.get_ident() == self.loop_thread_id:
+            self.transport.sendto(message, address)
+        else:
+            self.loop.call_soon_threadsafe(self.transport.sendto, message, address)
+
+    async def receive_message(self):
+        data = await self.queue.get()
+        with self.token_lock:
+            self.has_token += 1
+        if self.metrics:
+            self.metrics.received(data)
+        if self.journal:
+            self.journal.received(data)
+        return data
@@ -0,0 +1,121 @@
+import argparse
+import time
+
+# NumPy is needed here only, the game, the ring and the other tools run on the
+# standard library. pip install numpy
+try:
+    import numpy as np
+except ImportError as error:
+    raise ImportError(
+        "batch.py needs NumPy, install it with: pip install numpy"
+    ) from error
+
+from game import CARDS, DECK_SIZE, SUITS, Game
+from outbox import Outbox
+from settings import CARDS_PER_HAND, NUM_PLAYERS
+from simulation import silent
+
+
+# card protocol - rank * 4 + suit, so a larger int is a stronger card and
+# argmax gives the same winner as sorting by (-rank, -suit)
+def card_rank(cards):
+    return cards // len(SUITS)
+
+
+def card_suit(cards):
+    return cards % len(SUITS)
+
+
+# Returns hands[game, player, card] for n_games independent shuffles
+def deal(n_games, num_players=NUM_PLAYERS, cards_per_hand=CARDS_PER_HAND, rng=None):
+    if num_players * cards_per_hand > DECK_SIZE:
+        raise ValueError(
+            f"Cannot deal {cards_per_hand} cards to {num_players} players "
+            f"from a {DECK_SIZE} card deck"
+        )
+
+    rng = rng or np.random.default_rng()
+    decks = np.argsort(rng.random((n_games, DECK_SIZE)), axis=1)
+    dealt = decks[:, : num_players * cards_per_hand].astype(np.int8)
+    return dealt.reshape(n_games, num_players, cards_per_hand)
+
+
+# Returns the winning player index (0 based) of each trick[game, player]
+def trick_winners(tricks):
+    return np.argmax(tricks, axis=1)
+
+
+# Players lead their cards in hand order, returns wins[game, player]
+def great_round_wins(hands):
+    n_games, num_players, cards_per_hand = hands.shape
+    wins = np.zeros((n_games, num_players), dtype=np.int16)
+    rows = np.arange(n_games)
+
+    for trick in range(cards_per_hand):
+        winners = trick_winners(hands[:, :, trick])
+        wins[rows, winners] += 1
+
+    return wins
+
+
+def scalar_trick_winner(game, trick):
+    for i, value in enumerate(trick.tolist()):
+        game.players_round_cards[i] = CARDS[value]
+
+    game.network.has_token = 1
+    game.finish_round()
+    return game.last_win_player_id - 1
+
+
+# Checks the vectorized winners against Game.finish_round
+def verify_against_scalar(n_games, seed=0):
+    rng = np.random.default_rng(seed)
+    tricks = deal(n_games, NUM_PLAYERS, 1, rng)[:, :, 0]
+    winners = trick_winners(tricks)
+
+    game = Game(1, Outbox(1, 2), output=silent)
+    for i in range(n_games):
+        expected = scalar_trick_winner(game, tricks[i])
+        if winners[i] != expected:
+            raise AssertionError(
+                f"Trick {tricks[i].tolist()}: batch picked player {winners[i] + 1}, "
+                f"finish_round picked player {expected + 1}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized deal and trick engine")
+    parser.add_argument("-g", "--games", type=int, default=1000000)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument(
+        "--verify", type=int, default=10000, help="Tricks checked against finish_round"
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    verify_against_scalar(args.verify, args.seed)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{args.verify} tricks match finish_round "
+        f"(scalar: {args.verify / elapsed:.0f} tricks/s)"
+    )
+
+    rng = np.random.default_rng(args.seed)
+
+    start = time.perf_counter()
+    hands = deal(args.games, rng=rng)
+    dealt = time.perf_counter()
+    wins = great_round_wins(hands)
+    resolved = time.perf_counter()
+
+    print(f"Dealt {args.games} games in {dealt - start:.2f}s")
+    print(
+        f"Resolved {args.games * CARDS_PER_HAND} tricks in {resolved - dealt:.2f}s "
+        f"({args.games * CARDS_PER_HAND / (resolved - dealt):.0f} tricks/s)"
+    )
+    for i, mean in enumerate(wins.mean(axis=0)):
+        print(f"Player {i + 1} wins {mean:.3f} tricks per great round")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import argparse
+import random
+import time
+import tracemalloc
+
+from game import Game
+from network import Network
+from outbox import Outbox
+from protocol import HEADER_SIZE, Actions, decode_frame, encode_raw_frame
+from settings import BASE_PORT, BUFFER_SIZE, NUM_PLAYERS
+from simulation import Simulation, silent
+from strategies import RandomStrategy
+from topology import Topology
+
+
+# Peak traced memory above what was live when the great round started
+class PeakObserver:
+    def __init__(self):
+        self.peaks = []
+        self.mark = tracemalloc.get_traced_memory()[0]
+
+    def great_round_finished(self, game):
+        current, peak = tracemalloc.get_traced_memory()
+        self.peaks.append(peak - self.mark)
+        tracemalloc.reset_peak()
+        self.mark = current
+
+
+def make_games(games, num_players, seed):
+    rng = random.Random(seed)
+    for _ in range(games):
+        strategies = [
+            RandomStrategy(random.Random(rng.getrandbits(64)))
+            for _ in range(num_players)
+        ]
+        yield strategies, rng.getrandbits(64)
+
+
+def bench_great_rounds(games, num_players, seed):
+    great_rounds = 0
+    start = time.perf_counter()
+    for strategies, game_seed in make_games(games, num_players, seed):
+        great_rounds += Simulation(strategies, game_seed).run()["great_rounds"]
+    elapsed = time.perf_counter() - start
+
+    # Same games again, traced
+    tracemalloc.start()
+    observer = PeakObserver()
+    for strategies, game_seed in make_games(games, num_players, seed):
+        Simulation(strategies, game_seed, observer=observer).run()
+    tracemalloc.stop()
+
+    peaks = sorted(observer.peaks)
+    return {
+        "great_rounds": great_rounds,
+        "great_round_us": elapsed / great_rounds * 1e6,
+        "peak_bytes_p50": peaks[len(peaks) // 2],
+        "peak_bytes_max": peaks[-1],
+    }
+
+
+# Dealer side of a great round without the network: shuffle, split, reset
+def bench_deal(rounds, num_players):
+    game = Game(1, Outbox(1, 2), output=silent)
+    game.num_players = num_players
+    game.players_alive = [1] * num_players
+
+    def deal():
+        game.reset_states()
+        game.split_cards()
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        deal()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    deal()
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    return {
+        "deal_us": elapsed / rounds * 1e6,
+        "deal_peak_bytes": peak,
+        "deal_retained_bytes": current,
+        "deal_retained_blocks": sum(
+            stat.count for stat in snapshot.statistics("filename")
+        ),
+    }
+
+
+# Receive and header decode of one frame at a time over loopback, as a node
+# forwarding it does. copying receives the way Network did before frames were
+# read into pooled buffers.
+def bench_receive(frames, frame_size, base_port, copying=False):
+    topology = Topology.consecutive(2, "127.0.0.1", base_port)
+    sender = Network(1, None, None, topology=topology)
+    receiver = Network(2, None, None, topology=topology)
+    frame = encode_raw_frame(
+        1, 2, Actions.SHOW_RESULTS, 1, bytes(frame_size - HEADER_SIZE)
+    )
+
+    def receive():
+        sender.transmit(frame)
+        if copying:
+            data, _ = receiver.sock.recvfrom(BUFFER_SIZE)
+        else:
+            data = receiver.receive_frame()
+        decode_frame(data, with_data=False)
+        return data
+
+    receive()
+    start = time.perf_counter()
+    for _ in range(frames):
+        receive()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    peaks = []
+    for _ in range(frames):
+        mark = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        receive()
+        peaks.append(tracemalloc.get_traced_memory()[1] - mark)
+    tracemalloc.stop()
+
+    sender.close()
+    receiver.close()
+    peaks.sort()
+    return {
+        "receive_us": elapsed / frames * 1e6,
+        "peak_bytes_p50": peaks[len(peaks) // 2],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Allocations per great round")
+    parser.add_argument("-g", "--games", type=int, default=300)
+    parser.add_argument("-p", "--players", type=int, default=NUM_PLAYERS)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("--deal-rounds", type=int, default=20000)
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument(
+        "--frame-sizes",
+        type=int,
+        nargs="*",
+        default=[64, BUFFER_SIZE, 4 * BUFFER_SIZE],
+        help="Receive bench, frames over BUFFER_SIZE are fragmented",
+    )
+    parser.add_argument("--base-port", type=int, default=BASE_PORT + 2000)
+    args = parser.parse_args()
+
+    deal = bench_deal(args.deal_rounds, args.players)
+    print(
+        f"deal: {deal['deal_us']:.2f} us, peak {deal['deal_peak_bytes']} bytes, "
+        f"{deal['deal_retained_bytes']} bytes in {deal['deal_retained_blocks']} "
+        f"blocks kept for the great round"
+    )
+
+    for frame_size in args.frame_sizes:
+        paths = [False] if frame_size > BUFFER_SIZE else [True, False]
+        for copying in paths:
+            receive = bench_receive(args.frames, frame_size, args.base_port, copying)
+            print(
+                f"receive {frame_size} byte frame "
+                f"({'recvfrom' if copying else 'pooled recvfrom_into'}): "
+                f"{receive['receive_us']:.2f} us, peak "
+                f"{receive['peak_bytes_p50']} bytes (p50) per frame"
+            )
+
+    rounds = bench_great_rounds(args.games, args.players, args.seed)
+    print(
+        f"great round: {rounds['great_round_us']:.1f} us over "
+        f"{rounds['great_rounds']} great rounds, peak "
+        f"{rounds['peak_bytes_p50']} bytes (p50), {rounds['peak_bytes_max']} (max)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import random
+import time
+
+from bench_ring import percentile
+from settings import DECISION_BUDGET, NUM_PLAYERS
+from simulation import Simulation
+from strategies import STRATEGIES, MonteCarloStrategy, Strategy
+
+
+# Times the decisions of the strategy it wraps
+class TimedStrategy(Strategy):
+    def __init__(self, strategy):
+        self.strategy = strategy
+        self.bets = []
+        self.cards = []
+
+    def choose_bet(self, game, bets):
+        start = time.perf_counter()
+        bet = self.strategy.choose_bet(game, bets)
+        self.bets.append(time.perf_counter() - start)
+        return bet
+
+    def choose_card(self, game, played_cards):
+        start = time.perf_counter()
+        card_index = self.strategy.choose_card(game, played_cards)
+        self.cards.append(time.perf_counter() - start)
+        return card_index
+
+
+def baseline(name, rng):
+    strategy = STRATEGIES[name]()
+    strategy.rng = random.Random(rng.getrandbits(64))
+    return strategy
+
+
+# One seat, rotating over the games, plays the strategy made by make_seat. The
+# others, the deals and the seeds are the same for every make_seat.
+def bench_seat(games, num_players, seed, opponents, make_seat):
+    rng = random.Random(seed)
+    wins = 0
+    timed = []
+
+    for game_index in range(games):
+        seat = game_index % num_players
+        strategies = [baseline(opponents, rng) for _ in range(num_players)]
+        game_seed = rng.getrandbits(64)
+
+        strategies[seat] = TimedStrategy(make_seat(random.Random(game_seed)))
+        timed.append(strategies[seat])
+        if Simulation(strategies, game_seed).run()["winner"] == seat + 1:
+            wins += 1
+
+    bets = [elapsed for strategy in timed for elapsed in strategy.bets]
+    cards = [elapsed for strategy in timed for elapsed in strategy.cards]
+    return {
+        "win_rate": wins / games,
+        "bets": len(bets),
+        "cards": len(cards),
+        "bet_p50_us": percentile(bets, 0.50) * 1e6,
+        "card_p50_us": percentile(cards, 0.50) * 1e6,
+        "card_p99_us": percentile(cards, 0.99) * 1e6,
+        "card_max_us": max(cards, default=0.0) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Monte Carlo bot against a table of baseline players"
+    )
+    parser.add_argument("-g", "--games", type=int, default=400)
+    parser.add_argument("-p", "--players", type=int, default=NUM_PLAYERS)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument(
+        "--opponents", choices=list(STRATEGIES), default="random", help="Baseline"
+    )
+    parser.add_argument(
+        "--budgets",
+        type=float,
+        nargs="+",
+        default=[DECISION_BUDGET * 1e3],
+        help="Milliseconds per decision",
+    )
+    args = parser.parse_args()
+
+    result = bench_seat(
+        args.games,
+        args.players,
+        args.seed,
+        args.opponents,
+        lambda rng: baseline(args.opponents, rng),
+    )
+    print(
+        f"{args.opponents} seat: {result['win_rate']:.1%} of {args.games} games won "
+        f"(even share {1 / args.players:.1%})"
+    )
+
+    for budget in args.budgets:
+        # One bot over every game, as a long running player keeps its memo
+        bot = MonteCarloStrategy(budget=budget / 1e3)
+
+        def make_seat(rng):
+            bot.rng = rng
+            return bot
+
+        result = bench_seat(
+            args.games, args.players, args.seed, args.opponents, make_seat
+        )
+        playouts = bot.playouts
+        searched = bot.decisions - bot.memo_hits
+        print(
+            f"mc seat, {budget:g} ms budget: {result['win_rate']:.1%} won, "
+            f"bet {result['bet_p50_us']:.1f} us p50, card "
+            f"{result['card_p50_us']:.0f} us p50, {result['card_p99_us']:.0f} us "
+            f"p99, {result['card_max_us']:.0f} us max over {result['cards']} "
+            f"cards, {playouts / max(1, searched):.0f} deals per search, "
+            f"{bot.memo_hits} memo hits of {bot.decisions} decisions"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import timeit
+
+from protocol import Actions, decode_frame, encode_frame
+
+# Representative frames for a 4 player ring, one per payload type
+SAMPLES = [
+    (Actions.DEAL_CARDS, [(12, 3), (0, 1), (7, 2)]),
+    (Actions.ASK_BET, [(1, 2), (2, 0), (3, 1)]),
+    (Actions.SHOW_BETS, [2, 0, 1, 3]),
+    (Actions.ASK_CARD, [(1, 12, 3), (2, 0, 1), (3, 7, 2)]),
+    (Actions.SHOW_RESULTS, [3, -1, 2, 0]),
+    (Actions.WINNER, 3),
+]
+
+
+########################### TEXT FORMAT ###########################
+
+
+def text_encode_data(action, data):
+    match action:
+        case Actions.DEAL_CARDS:
+            return str([f"{rank}-{suit}" for rank, suit in data])
+        case Actions.ASK_BET:
+            return ",".join(f"{player_id}-{bet}" for player_id, bet in data)
+        case Actions.SHOW_BETS:
+            return str(data)
+        case Actions.ASK_CARD:
+            return ",".join(
+                f"{player_id}-{rank}-{suit}" for player_id, rank, suit in data
+            )
+        case Actions.SHOW_RESULTS:
+            return ",".join(str(life) for life in data)
+        case _:
+            return str(data)
+
+
+def text_decode_data(action, data):
+    match action:
+        case Actions.DEAL_CARDS:
+            return [tuple(int(x) for x in card.split("-")) for card in eval(data)]
+        case Actions.ASK_BET:
+            return [
+                tuple(int(x) for x in raw_bet.split("-")) for raw_bet in data.split(",")
+            ]
+        case Actions.SHOW_BETS:
+            return [int(bet) for bet in eval(data)]
+        case Actions.ASK_CARD:
+            return [tuple(int(x) for x in card.split("-")) for card in data.split(",")]
+        case Actions.SHOW_RESULTS:
+            return [int(life) for life in data.split(",")]
+        case _:
+            return int(data)
+
+
+def text_encode(from_player_id, to_player_id, action, data):
+    message = (
+        str(from_player_id)
+        + str(to_player_id)
+        + str(action.value)
+        + text_encode_data(action, data)
+    )
+    return message.encode()
+
+
+def text_decode(frame):
+    message = frame.decode()
+    action = Actions(int(message[2]))
+    return {
+        "from_player_id": int(message[0]),
+        "to_player_id": int(message[1]),
+        "action": action,
+        "data": text_decode_data(action, message[3:]),
+    }
+
+
+########################### BENCHMARK ###########################
+
+
+def run(number):
+    print(f"{'action':<14} {'format':<7} {'bytes':>5} {'encode ns':>10} {'decode ns':>10}")
+
+    for action, data in SAMPLES:
+        text_frame = text_encode(1, 2, action, data)
+        binary_frame = encode_frame(1, 2, action, 1, data)
+
+        rows = [
+            (
+                "text",
+                text_frame,
+                lambda: text_encode(1, 2, action, data),
+                lambda: text_decode(text_frame),
+            ),
+            (
+                "binary",
+                binary_frame,
+                lambda: encode_frame(1, 2, action, 1, data),
+                lambda: decode_frame(binary_frame),
+            ),
+        ]
+
+        for name, frame, encode, decode in rows:
+            encode_ns = timeit.timeit(encode, number=number) / number * 1e9
+            decode_ns = timeit.timeit(decode, number=number) / number * 1e9
+            print(
+                f"{action.name:<14} {name:<7} {len(frame):>5} "
+                f"{encode_ns:>10.0f} {decode_ns:>10.0f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wire format benchmark")
+    parser.add_argument(
+        "-n", "--number", type=int, default=100000, help="Iterations per measurement"
+    )
+    args = parser.parse_args()
+
+    run(args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,553 @@
+import argparse
+import csv
+import json
+import random
+import threading
+import time
+from collections import deque
+
+from game import Game, RingError
+from metrics import Metrics
+from network import Network
+from reliable_network import ReliableNetwork
+from protocol import (
+    ACTION_OFFSET,
+    ACTIONS_BY_VALUE,
+    Actions,
+    decode_header,
+    encode_raw_frame,
+)
+from settings import BASE_PORT, NUM_PLAYERS
+from simulation import silent
+from strategies import RandomStrategy
+from topology import Topology
+
+LOOPBACK = "127.0.0.1"
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# Send timestamps per receiving player. A token ring has at most one frame in
+# flight per link, so each receive pairs with the oldest pending send.
+class HopRecorder:
+    def __init__(self, num_players):
+        self.pending = [deque() for _ in range(num_players + 1)]
+        self.hops = {}  # action -> list of hop latencies in seconds
+
+    # Frames still in flight when a ring shuts down are never received
+    def drop_pending(self):
+        for pending in self.pending:
+            pending.clear()
+
+    def sent(self, to_player_id, action):
+        self.pending[to_player_id].append((time.perf_counter(), action))
+
+    def received(self, player_id):
+        sent_at, action = self.pending[player_id].popleft()
+        self.hops.setdefault(action, []).append(time.perf_counter() - sent_at)
+
+
+class TimedNetwork(Network):
+    recorder: HopRecorder = None
+
+    def send_message(self, message):
+        action = ACTIONS_BY_VALUE[message[ACTION_OFFSET]]
+        self.recorder.sent(self.next_player_id, action)
+        super().send_message(message)
+
+    def receive_message(self):
+        data = super().receive_message()
+        self.recorder.received(self.player_id)
+        return data
+
+
+def open_ring(num_players, base_port, recorder):
+    topology = Topology.consecutive(num_players, LOOPBACK, base_port)
+    networks = []
+    for player_id in range(1, num_players + 1):
+        network = TimedNetwork(player_id, None, None, topology=topology)
+        network.recorder = recorder
+        networks.append(network)
+    return networks
+
+
+def hop_summary(hops):
+    return {
+        "hops": len(hops),
+        "mean_us": sum(hops) / len(hops) * 1e6 if hops else 0.0,
+        "p50_us": percentile(hops, 0.50) * 1e6,
+        "p95_us": percentile(hops, 0.95) * 1e6,
+        "p99_us": percentile(hops, 0.99) * 1e6,
+    }
+
+
+######################### TOKEN LAPS #########################
+
+
+def token_node(network, laps):
+    for _ in range(laps):
+        frame = network.receive_message()
+        decode_header(frame)
+        network.send_message(frame)
+
+
+def bench_token(num_players, payload_size, laps, base_port):
+    recorder = HopRecorder(num_players)
+    networks = open_ring(num_players, base_port, recorder)
+    frame = encode_raw_frame(1, 1, Actions.SHOW_RESULTS, 1, bytes(payload_size))
+
+    threads = [
+        threading.Thread(target=token_node, args=(network, laps), daemon=True)
+        for network in networks[1:]
+    ]
+    for thread in threads:
+        thread.start()
+
+    dealer = networks[0]
+    dealer.has_token = 1
+    lap_times = []
+
+    start = time.perf_counter()
+    for _ in range(laps):
+        lap_start = time.perf_counter()
+        dealer.send_message(frame)
+        frame = dealer.receive_message()
+        lap_times.append(time.perf_counter() - lap_start)
+    elapsed = time.perf_counter() - start
+
+    for thread in threads:
+        thread.join()
+    for network in networks:
+        network.close()
+
+    hops = [hop for action_hops in recorder.hops.values() for hop in action_hops]
+    return {
+        "bench": "token",
+        "ring_size": num_players,
+        "payload_bytes": payload_size,
+        "action": "ALL",
+        "lap_mean_us": sum(lap_times) / laps * 1e6,
+        "lap_p50_us": percentile(lap_times, 0.50) * 1e6,
+        "lap_p99_us": percentile(lap_times, 0.99) * 1e6,
+        "messages_per_s": len(hops) / elapsed,
+        **hop_summary(hops),
+    }
+
+
+######################### SCRIPTED GAMES #########################
+
+
+def game_node(game):
+    if game.is_dealer():
+        game.start_great_round()
+    while game.handle_message(game.receive_decoded_message()):
+        pass
+
+
+def bench_games(
+    games,
+    num_players,
+    base_port,
+    seed,
+    splice_dead=True,
+    piggyback=False,
+    deal_per_hand=False,
+    metrics=False,
+):
+    recorder = HopRecorder(num_players)
+    rng = random.Random(seed)
+    elapsed = 0.0
+    great_rounds = 0
+
+    for _ in range(games):
+        networks = open_ring(num_players, base_port, recorder)
+        nodes = [
+            Game(
+                player_id,
+                network,
+                strategy=RandomStrategy(random.Random(rng.getrandbits(64))),
+                rng=random.Random(rng.getrandbits(64)),
+                output=silent,
+                num_players=num_players,
+                piggyback=piggyback,
+                deal_per_hand=deal_per_hand,
+            )
+            for player_id, network in enumerate(networks, start=1)
+        ]
+        for game in nodes:
+            game.splice_dead = splice_dead
+            if metrics:
+                game.metrics = game.network.metrics = Metrics(game.player_id)
+
+        threads = [threading.Thread(target=game_node, args=(game,)) for game in nodes]
+        start = time.perf_counter()
+        # Dealer last, every other node is already waiting on its socket
+        for thread in reversed(threads):
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed += time.perf_counter() - start
+        great_rounds += sum(game.great_rounds for game in nodes)
+
+        for network in networks:
+            network.close()
+        recorder.drop_pending()
+
+    total = sum(len(hops) for hops in recorder.hops.values())
+    # One frame in flight, so the deal phase lasts as long as its hops add up
+    deal_time = sum(
+        sum(recorder.hops.get(action, []))
+        for action in (Actions.DEAL_CARDS, Actions.DEAL_HANDS)
+    )
+    results = []
+    for action in Actions:
+        hops = recorder.hops.get(action, [])
+        if hops:
+            results.append(
+                {
+                    "bench": "game",
+                    "ring_size": num_players,
+                    "payload_bytes": "",
+                    "action": action.name,
+                    "splice": splice_dead,
+                    "piggyback": piggyback,
+                    "deal": "per-hand" if deal_per_hand else "lap",
+                    "deal_ms": deal_time / great_rounds * 1e3,
+                    "metrics": metrics,
+                    "hops_per_game": total / games,
+                    "hops_per_great_round": total / great_rounds,
+                    "great_round_ms": elapsed / great_rounds * 1e3,
+                    "game_ms": elapsed / games * 1e3,
+                    "messages_per_s": total / elapsed,
+                    **hop_summary(hops),
+                }
+            )
+    return results
+
+
+########################### LOSSY LINKS ###########################
+
+# Token recovery is what plain nodes fall back on when a frame is dropped
+LOSS_TOKEN_TIMEOUT_LAPS = 3
+
+
+# Drops a share of what a node sends, frames and acknowledgements alike
+class LossySocket:
+    dropped = 0
+
+    def __init__(self, sock, loss, rng):
+        self.sock = sock
+        self.loss = loss
+        self.rng = rng
+
+    def sendto(self, data, address):
+        if self.rng.random() < self.loss:
+            self.dropped += 1
+            return len(data)
+        return self.sock.sendto(data, address)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+# Upper bound of the bucket holding the given fraction of the samples
+def histogram_quantile(histograms, fraction):
+    counts = [sum(column) for column in zip(*(h.counts for h in histograms))]
+    bounds = histograms[0].bounds
+    rank = fraction * sum(counts)
+    cumulative = 0
+    for bound, count in zip((*bounds, float("inf")), counts):
+        cumulative += count
+        if cumulative >= rank:
+            return bound
+    return 0.0
+
+
+def bench_loss(games, num_players, base_port, seed, loss, reliable, timeout):
+    rng = random.Random(seed)
+    network_class = ReliableNetwork if reliable else Network
+    elapsed = 0.0
+    great_rounds = 0
+    finished = 0
+    frames = 0
+    laps = []
+    networks = []
+
+    for game_index in range(games):
+        # Stalled rings are abandoned, every game gets its own ports
+        topology = Topology.consecutive(
+            num_players, LOOPBACK, base_port + game_index * num_players
+        )
+        ring = [
+            network_class(
+                player_id,
+                None,
+                None,
+                token_timeout_laps=LOSS_TOKEN_TIMEOUT_LAPS,
+                topology=topology,
+            )
+            for player_id in range(1, num_players + 1)
+        ]
+        try:
+            nodes = []
+            for player_id, network in enumerate(ring, start=1):
+                network.sock = LossySocket(
+                    network.sock, loss, random.Random(rng.getrandbits(64))
+                )
+                game = Game(
+                    player_id,
+                    network,
+                    strategy=RandomStrategy(random.Random(rng.getrandbits(64))),
+                    rng=random.Random(rng.getrandbits(64)),
+                    output=silent,
+                    num_players=num_players,
+                )
+                network.on_token_lost = game.handle_token_lost
+                game.metrics = network.metrics = Metrics(player_id)
+                nodes.append(game)
+
+            errors = []
+            threads = [
+                threading.Thread(target=loss_node, args=(game, errors), daemon=True)
+                for game in nodes
+            ]
+            start = time.perf_counter()
+            for thread in reversed(threads):
+                thread.start()
+            for thread in threads:
+                thread.join(max(0.0, start + timeout - time.perf_counter()))
+            if errors or any(thread.is_alive() for thread in threads):
+                continue
+
+            elapsed += time.perf_counter() - start
+            finished += 1
+            great_rounds += sum(game.great_rounds for game in nodes)
+            frames += sum(sum(game.metrics.frames_received) for game in nodes)
+            laps += [game.metrics.token_lap for game in nodes]
+            networks += ring
+        finally:
+            # A node still running in a stalled ring fails on its next receive
+            for network in ring:
+                network.close()
+
+    result = {
+        "bench": "loss",
+        "ring_size": num_players,
+        "loss": loss,
+        "reliable": reliable,
+        "games": finished,
+        "stalled": games - finished,
+        "game_ms": elapsed / finished * 1e3 if finished else 0.0,
+        "great_round_ms": elapsed / great_rounds * 1e3 if great_rounds else 0.0,
+        "messages_per_s": frames / elapsed if elapsed else 0.0,
+        "lap_mean_us": (
+            sum(h.total for h in laps) / sum(h.count for h in laps) * 1e6
+            if laps
+            else 0.0
+        ),
+        "lap_p99_us": histogram_quantile(laps, 0.99) * 1e6 if laps else 0.0,
+        "dropped": sum(network.sock.dropped for network in networks),
+    }
+    if reliable:
+        result["retransmitted"] = sum(n.retransmitted for n in networks)
+        result["duplicates"] = sum(n.duplicates for n in networks)
+    return result
+
+
+# A node that gives the ring up, or whose ring was closed under it, stalls the
+# game
+def loss_node(game, errors):
+    try:
+        if game.is_dealer():
+            game.start_great_round()
+        while game.handle_message(game.receive_decoded_message()):
+            pass
+        game.network.flush()
+    except (RingError, OSError) as error:
+        errors.append(error)
+
+
+def write_results(results, json_path, csv_path):
+    if json_path:
+        with open(json_path, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if csv_path:
+        fields = []
+        for result in results:
+            fields += [key for key in result if key not in fields]
+        with open(csv_path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(results)
+
+
+def print_results(results):
+    hops = [r for r in results if r["bench"] != "loss"]
+    if hops:
+        print(
+            f"{'bench':<6} {'ring':>4} {'payload':>7} {'action':<18} "
+            f"{'hops':>7} {'p50 us':>8} {'p95 us':>8} {'p99 us':>8} "
+            f"{'msg/s':>8} {'lap us':>8}"
+        )
+    for r in hops:
+        print(
+            f"{r['bench']:<6} {r['ring_size']:>4} {r['payload_bytes']:>7} "
+            f"{r['action']:<18} {r['hops']:>7} {r['p50_us']:>8.1f} "
+            f"{r['p95_us']:>8.1f} {r['p99_us']:>8.1f} {r['messages_per_s']:>8.0f} "
+            + (f"{r['lap_mean_us']:>8.1f}" if "lap_mean_us" in r else f"{'-':>8}")
+        )
+
+    games = {
+        (r["ring_size"], r["splice"], r["piggyback"], r["deal"], r["metrics"]): r
+        for r in results
+        if r["bench"] == "game"
+    }
+    for (ring_size, splice, piggyback, deal, metrics), r in games.items():
+        print(
+            f"game ring {ring_size} ({'splice' if splice else 'no splice'}, "
+            f"{'piggyback' if piggyback else 'one phase per frame'}, "
+            f"{deal} deal{', metrics' if metrics else ''}): "
+            f"{r['hops_per_game']:.1f} hops, {r['game_ms']:.2f} ms per game, "
+            f"{r['hops_per_great_round']:.1f} hops, "
+            f"{r['great_round_ms']:.2f} ms per great round, "
+            f"{r['deal_ms']:.3f} ms dealing"
+        )
+
+    for r in results:
+        if r["bench"] == "loss":
+            print(
+                f"loss ring {r['ring_size']} {r['loss']:.0%} drop "
+                f"({'reliable' if r['reliable'] else 'token recovery only'}): "
+                f"{r['games']} games, {r['stalled']} stalled, "
+                f"{r['game_ms']:.1f} ms per game, "
+                f"{r['great_round_ms']:.1f} ms per great round, "
+                f"{r['messages_per_s']:.0f} msg/s, lap {r['lap_mean_us']:.0f} us "
+                f"mean, {r['lap_p99_us']:.0f} us p99, {r['dropped']} dropped"
+                + (
+                    f", {r['retransmitted']} resent, {r['duplicates']} duplicates"
+                    if r["reliable"]
+                    else ""
+                )
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback ring benchmark")
+    parser.add_argument(
+        "--ring-sizes",
+        type=int,
+        nargs="*",
+        default=[2, 4, 8, 16],
+        help="Token bench, none skips it",
+    )
+    parser.add_argument(
+        "--payload-sizes", type=int, nargs="+", default=[0, 64, 512], help="Token bench"
+    )
+    parser.add_argument("--laps", type=int, default=500, help="Laps per token run")
+    parser.add_argument("--games", type=int, default=20, help="Scripted games")
+    parser.add_argument(
+        "--game-ring-sizes",
+        type=int,
+        nargs="+",
+        default=[NUM_PLAYERS],
+        help="Ring sizes for scripted games",
+    )
+    parser.add_argument(
+        "--no-splice",
+        action="store_true",
+        help="Keep eliminated players in the ring during scripted games",
+    )
+    parser.add_argument(
+        "--piggyback",
+        choices=["off", "on", "both"],
+        default="off",
+        help="Carry display phases on the next frame, both compares the two",
+    )
+    parser.add_argument(
+        "--deal",
+        choices=["lap", "per-hand", "both"],
+        default="lap",
+        help="Deal every hand in one lap or one lap per hand, both compares the two",
+    )
+    parser.add_argument(
+        "--metrics",
+        choices=["off", "on", "both"],
+        default="off",
+        help="Record node metrics during scripted games, both compares the two",
+    )
+    parser.add_argument(
+        "--loss",
+        type=float,
+        nargs="+",
+        default=[],
+        help="Drop rates for the lossy ring bench, e.g. 0 0.01 0.05 0.2",
+    )
+    parser.add_argument(
+        "--reliable",
+        choices=["off", "on", "both"],
+        default="both",
+        help="Hop acknowledgements in the lossy ring bench",
+    )
+    parser.add_argument("--loss-games", type=int, default=5, help="Games per rate")
+    parser.add_argument(
+        "--loss-timeout", type=float, default=60, help="Seconds before a game stalls"
+    )
+    parser.add_argument("--base-port", type=int, default=BASE_PORT + 1000)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results as JSON to this path")
+    parser.add_argument("--csv", help="Write results as CSV to this path")
+    args = parser.parse_args()
+
+    results = []
+    for num_players in args.ring_sizes:
+        for payload_size in args.payload_sizes:
+            results.append(
+                bench_token(num_players, payload_size, args.laps, args.base_port)
+            )
+    switch_modes = {"off": [False], "on": [True], "both": [False, True]}
+    deal_modes = {"lap": [False], "per-hand": [True], "both": [True, False]}
+    if args.games:
+        for num_players in args.game_ring_sizes:
+            for piggyback in switch_modes[args.piggyback]:
+                for deal_per_hand in deal_modes[args.deal]:
+                    for metrics in switch_modes[args.metrics]:
+                        results += bench_games(
+                            args.games,
+                            num_players,
+                            args.base_port,
+                            args.seed,
+                            not args.no_splice,
+                            piggyback,
+                            deal_per_hand,
+                            metrics,
+                        )
+
+    # Every run and every game in it gets ports of its own
+    loss_port = args.base_port
+    for loss in args.loss:
+        for reliable in switch_modes[args.reliable]:
+            results.append(
+                bench_loss(
+                    args.loss_games,
+                    NUM_PLAYERS,
+                    loss_port,
+                    args.seed,
+                    loss,
+                    reliable,
+                    args.loss_timeout,
+                )
+            )
+            loss_port += args.loss_games * NUM_PLAYERS
+
+    print_results(results)
+    write_results(results, args.json, args.csv)
+
+
+if __name__ == "__main__":
+    main()
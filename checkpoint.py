@@ -0,0 +1,316 @@
+import os
+import struct
+import zlib
+
+from game import CARD_WIRE, CARDS, Card
+from protocol import ACTIONS_BY_VALUE
+from settings import BUFFER_SIZE
+
+CHECKPOINT_MAGIC = b"RCKP"
+CHECKPOINT_VERSION = 1
+
+# magic, version, slot size. Two slots follow, each checkpoint overwrites the
+# older one in place, so a write cut short only ever damages that slot.
+FILE_HEADER = struct.Struct("!4sBI")
+# generation, body length, then the body and a CRC32 of both
+SLOT = struct.Struct("!QI")
+CRC = struct.Struct("!I")
+# Room for a frame handled, the frame sent back and the node state
+SLOT_SIZE = 4 * BUFFER_SIZE
+
+# player id, number of players, table id, dealer id, alive flag, current
+# round, last trick winner, last dealt player, great rounds, cards per hand,
+# lives, token epoch, sequence number, last handled epoch
+STATE = struct.Struct("!HHHHBBHHIBHHIH")
+COUNT = struct.Struct("!H")
+PENDING_HAND = struct.Struct("!HB")  # player id (0 when dealt per hand), cards
+LAST_HANDLED = struct.Struct("!BH")  # action, from player id
+NOTHING_HANDLED = 0xFF
+
+
+def pack_values(fmt, values):
+    return COUNT.pack(len(values)) + struct.pack(f"!{len(values)}{fmt}", *values)
+
+
+def unpack_values(fmt, raw, offset):
+    (count,) = COUNT.unpack_from(raw, offset)
+    offset += COUNT.size
+    values = struct.unpack_from(f"!{count}{fmt}", raw, offset)
+    return list(values), offset + struct.calcsize(f"!{count}{fmt}")
+
+
+def pack_bytes(raw):
+    return COUNT.pack(len(raw)) + raw
+
+
+def unpack_bytes(raw, offset):
+    (length,) = COUNT.unpack_from(raw, offset)
+    offset += COUNT.size
+    return raw[offset : offset + length], offset + length
+
+
+def wire_to_values(cards):
+    return bytes(Card(rank, suit) for rank, suit in cards)
+
+
+def values_to_wire(values):
+    return [CARD_WIRE[value] for value in values]
+
+
+# Node state saved every time a handled frame is answered. The checkpoint is
+# written ahead of the answer and holds it, so a node killed at any point
+# resumes either before the frame or able to resend its answer. Slots are
+# rewritten in place without fsync: a checkpoint survives the process dying
+# but not the machine.
+class Checkpointer:
+    path = ""
+    game = None
+    fd = None
+    slot_size = SLOT_SIZE
+    generation = 0
+    handling = False  # the next frame sent answers a handled frame
+    saves = 0
+
+    def __init__(self, path, game):
+        self.path = path
+        self.partial = f"{path}.tmp"
+        self.game = game
+
+    # Attaches the checkpointer to a game and its network
+    @classmethod
+    def attach(cls, path, game):
+        checkpointer = cls(path, game)
+        game.checkpointer = checkpointer
+        game.network.checkpointer = checkpointer
+        return checkpointer
+
+    def handle(self):
+        self.handling = True
+
+    def handled(self, running):
+        self.handling = False
+        if not running:
+            self.clear()
+
+    def sending(self, frame):
+        if self.handling:
+            self.handling = False
+            self.save(frame)
+
+    def clear(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def save(self, last_sent):
+        self.generation += 1
+        slot = bytearray(SLOT.size)
+        self.encode(slot, self.game, last_sent)
+        SLOT.pack_into(slot, 0, self.generation, len(slot) - SLOT.size)
+        slot += CRC.pack(zlib.crc32(slot))
+
+        if self.fd is None or len(slot) > self.slot_size:
+            self.create(slot)
+        else:
+            os.pwrite(self.fd, slot, self.slot_offset(self.generation))
+        self.saves += 1
+
+    def slot_offset(self, generation):
+        return FILE_HEADER.size + (generation & 1) * self.slot_size
+
+    # A new file, or a bigger one, is written whole and renamed into place
+    def create(self, slot):
+        while self.slot_size < len(slot):
+            self.slot_size *= 2
+
+        raw = bytearray(
+            FILE_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, self.slot_size)
+        )
+        raw += bytes(self.slot_offset(self.generation) - len(raw))
+        raw += slot
+        with open(self.partial, "wb") as file:
+            file.write(raw)
+        os.replace(self.partial, self.path)
+
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = os.open(self.path, os.O_RDWR)
+
+    # Restores the newest intact slot, later checkpoints continue the file
+    def restore(self):
+        with open(self.path, "rb") as file:
+            raw = file.read()
+
+        if len(raw) < FILE_HEADER.size:
+            raise ValueError(f"{self.path}: too short to be a checkpoint")
+        magic, version, slot_size = FILE_HEADER.unpack_from(raw)
+        if magic != CHECKPOINT_MAGIC:
+            raise ValueError(f"{self.path}: not a checkpoint")
+        if version != CHECKPOINT_VERSION:
+            raise ValueError(f"{self.path}: unsupported checkpoint version {version}")
+
+        newest = None
+        for offset in (FILE_HEADER.size, FILE_HEADER.size + slot_size):
+            if len(raw) < offset + SLOT.size:
+                continue
+            generation, length = SLOT.unpack_from(raw, offset)
+            end = offset + SLOT.size + length
+            if length > slot_size or len(raw) < end + CRC.size:
+                continue
+            if zlib.crc32(raw[offset:end]) != CRC.unpack_from(raw, end)[0]:
+                continue
+            if not newest or generation > newest[0]:
+                newest = (generation, raw[offset + SLOT.size : end])
+
+        if not newest:
+            raise ValueError(f"{self.path}: no intact checkpoint")
+
+        self.generation, body = newest
+        try:
+            self.decode(body, self.game)
+        except struct.error:
+            raise ValueError(f"{self.path}: truncated checkpoint")
+
+        self.slot_size = slot_size
+        self.fd = os.open(self.path, os.O_RDWR)
+
+    ######################### FORMAT #########################
+
+    def encode(self, raw, game, last_sent):
+        network = game.network
+        action_value, from_player_id, payload, piggyback = NOTHING_HANDLED, 0, b"", b""
+        if game.last_handled:
+            action, from_player_id, payload, piggyback = game.last_handled
+            action_value = action.value
+
+        raw += STATE.pack(
+            game.player_id,
+            game.num_players,
+            game.table_id,
+            game.dealer_id,
+            game.is_alive,
+            game.curr_round,
+            game.last_win_player_id,
+            game.last_dealt_player_id,
+            game.great_rounds,
+            game.cards_per_hand,
+            game.num_lives,
+            network.epoch,
+            network.seq,
+            game.last_handled_epoch,
+        )
+        raw += pack_values("B", game.players_alive)
+        raw += pack_values("h", game.players_lives)
+        raw += pack_values("H", game.players_bets)
+        raw += pack_values("H", game.players_wins)
+        raw += pack_values("B", game.players_round_cards)
+        raw += pack_values("B", game.player_hand)
+
+        # Hands the dealer has not sent yet
+        raw += COUNT.pack(len(game.hands))
+        for hand in game.hands:
+            player_id, cards = (0, hand) if game.deal_per_hand else hand
+            raw += PENDING_HAND.pack(player_id, len(cards))
+            raw += wire_to_values(cards)
+
+        raw += LAST_HANDLED.pack(action_value, from_player_id)
+        raw += pack_bytes(payload)
+        raw += pack_bytes(piggyback)
+        raw += pack_bytes(last_sent)
+
+    def decode(self, raw, game):
+        (
+            player_id,
+            num_players,
+            table_id,
+            dealer_id,
+            is_alive,
+            curr_round,
+            last_win_player_id,
+            last_dealt_player_id,
+            great_rounds,
+            cards_per_hand,
+            num_lives,
+            epoch,
+            seq,
+            last_handled_epoch,
+        ) = STATE.unpack_from(raw)
+
+        if (player_id, num_players, table_id) != (
+            game.player_id,
+            game.num_players,
+            game.table_id,
+        ):
+            raise ValueError(
+                f"{self.path}: checkpoint of player {player_id} of {num_players} "
+                f"on table {table_id}, not of this node"
+            )
+
+        offset = STATE.size
+        players_alive, offset = unpack_values("B", raw, offset)
+        players_lives, offset = unpack_values("h", raw, offset)
+        players_bets, offset = unpack_values("H", raw, offset)
+        players_wins, offset = unpack_values("H", raw, offset)
+        round_cards, offset = unpack_values("B", raw, offset)
+        hand, offset = unpack_values("B", raw, offset)
+
+        (pending,) = COUNT.unpack_from(raw, offset)
+        offset += COUNT.size
+        hands = []
+        for _ in range(pending):
+            hand_player_id, count = PENDING_HAND.unpack_from(raw, offset)
+            offset += PENDING_HAND.size
+            cards = values_to_wire(raw[offset : offset + count])
+            offset += count
+            hands.append((hand_player_id, cards) if hand_player_id else cards)
+
+        action_value, from_player_id = LAST_HANDLED.unpack_from(raw, offset)
+        offset += LAST_HANDLED.size
+        payload, offset = unpack_bytes(raw, offset)
+        piggyback, offset = unpack_bytes(raw, offset)
+        last_sent, offset = unpack_bytes(raw, offset)
+
+        game.dealer_id = dealer_id
+        game.is_alive = is_alive
+        game.curr_round = curr_round
+        game.last_win_player_id = last_win_player_id
+        game.last_dealt_player_id = last_dealt_player_id
+        game.great_rounds = great_rounds
+        game.cards_per_hand = cards_per_hand
+        game.num_lives = num_lives
+        game.players_alive = players_alive
+        game.players_lives = players_lives
+        game.players_bets = players_bets
+        game.players_wins = players_wins
+        game.players_round_cards = [CARDS[value] for value in round_cards]
+        game.player_hand = [CARDS[value] for value in hand]
+        game.hands = hands
+        if action_value != NOTHING_HANDLED:
+            game.last_handled = (
+                ACTIONS_BY_VALUE[action_value],
+                from_player_id,
+                payload,
+                piggyback,
+            )
+        game.last_handled_epoch = last_handled_epoch
+
+        network = game.network
+        network.epoch = epoch
+        network.seq = seq
+        network.last_sent = last_sent or None
+        network.has_token = 0
+
+        # The checkpoint may predate the splice that followed the last frame
+        if (
+            game.splice_dead
+            and network.can_splice()
+            and game.number_players_alive() > 1
+        ):
+            next_player_id = game.next_alive_player(game.player_id)
+            if next_player_id != game.next_player_id:
+                game.next_player_id = next_player_id
+                network.set_next_player(next_player_id)
+
+        game.resumed = True
@@ -0,0 +1,381 @@
+import argparse
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+
+from launcher import LOOPBACK, free_ports
+from ring_host import format_play, parse_result
+from settings import MATCH_ATTEMPTS, NUM_PLAYERS, RING_HOST_PORT
+from strategies import STRATEGIES
+
+RING_HOST = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ring_host.py")
+
+# Seconds between attempts to reach a host that is still starting
+CONNECT_POLL_INTERVAL = 0.05
+
+
+class CoordinatorError(Exception):
+    pass
+
+
+# One ring of the bracket, group is its place in the level. Entrants sit in
+# bracket order, so the first one deals first.
+class Match:
+    level = 0
+    group = 0
+    entrants: list[int]
+    attempts = 0
+    seconds = 0.0
+    frames = 0
+    winner = 0  # entrant
+
+    def __init__(self, level, group, entrants):
+        self.level = level
+        self.group = group
+        self.entrants = entrants
+
+    def name(self):
+        return f"{self.level}.{self.group}"
+
+
+# Single elimination over rings of ring_size, the winner of ring g of a level
+# takes place g of the next one. A ring is formed as soon as the rings feeding
+# it are done, without waiting for the rest of their level, and whichever host
+# plays first the bracket is the same. A lone entrant moves up without playing.
+class Bracket:
+    ring_size = NUM_PLAYERS
+    sizes: list[int]  # entrants reaching each level
+    places: list[list[int]]  # entrant in each place of each level, 0 until known
+    ready: deque  # matches formed and not handed out yet
+    matches: list[Match]
+    champion = 0
+
+    def __init__(self, entrants, ring_size, rng):
+        self.ring_size = ring_size
+        self.sizes = [len(entrants)]
+        while self.sizes[-1] > 1:
+            self.sizes.append(-(-self.sizes[-1] // ring_size))
+        self.places = [[0] * size for size in self.sizes]
+        self.ready = deque()
+        self.matches = []
+
+        seeded = list(entrants)
+        rng.shuffle(seeded)
+        for place, entrant in enumerate(seeded):
+            self.advance(entrant, 0, place)
+
+    def levels(self):
+        return len(self.sizes) - 1
+
+    def advance(self, entrant, level, place):
+        if level == self.levels():
+            self.champion = entrant
+            return
+
+        places = self.places[level]
+        places[place] = entrant
+        group = place // self.ring_size
+        entrants = places[group * self.ring_size : (group + 1) * self.ring_size]
+        if not all(entrants):
+            return
+
+        if len(entrants) == 1:
+            self.advance(entrants[0], level + 1, group)
+            return
+        match = Match(level, group, entrants)
+        self.matches.append(match)
+        self.ready.append(match)
+
+    def finished(self, match):
+        self.advance(match.winner, match.level + 1, match.group)
+
+
+class HostStats:
+    matches = 0
+    busy = 0.0  # seconds spent in rings
+    lost = False
+
+
+# Hands matches to every slot of every host through one work queue, so a
+# fast host simply takes more of them
+class Coordinator:
+    hosts: list  # (host, port)
+    strategies: list[str]  # strategy of every entrant, by entrant - 1
+    seed = 0
+    work: queue.Queue = None  # matches, None stops a slot
+    results: queue.Queue = None  # (slot, match, result) or (slot, None, error)
+    host_stats: dict = None
+    slots = 0
+    output = print
+
+    def __init__(self, hosts, strategies, seed, output=None):
+        self.hosts = hosts
+        self.strategies = strategies
+        self.seed = seed
+        self.work = queue.Queue()
+        self.results = queue.Queue()
+        self.host_stats = {}
+        if output:
+            self.output = output
+
+    def connect(self, host, port, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                sock = socket.create_connection((host, port), timeout)
+                break
+            except OSError as error:
+                if time.monotonic() >= deadline:
+                    raise CoordinatorError(
+                        f"Cannot reach host {host}:{port}: {error}"
+                    ) from None
+                time.sleep(CONNECT_POLL_INTERVAL)
+
+        # Rings take as long as they take, only connecting is bounded
+        sock.settimeout(None)
+        file = sock.makefile("rw")
+        greeting = file.readline().split()
+        if len(greeting) != 2 or greeting[0] != "READY":
+            sock.close()
+            raise CoordinatorError(f"Host {host}:{port} did not greet with READY")
+        return sock, file, int(greeting[1])
+
+    # One connection per slot the host offers, each plays a match at a time
+    def start_slots(self, timeout):
+        for host, port in self.hosts:
+            name = f"{host}:{port}"
+            connection = self.connect(host, port, timeout)
+            self.host_stats[name] = HostStats()
+            connections = [connection]
+            for _ in range(connection[2] - 1):
+                connections.append(self.connect(host, port, timeout))
+
+            for sock, file, _ in connections:
+                threading.Thread(
+                    target=self.slot, args=(name, sock, file), daemon=True
+                ).start()
+                self.slots += 1
+
+    def slot(self, name, sock, file):
+        try:
+            while True:
+                match = self.work.get()
+                if match is None:
+                    return
+                try:
+                    seed = self.match_seed(match)
+                    strategies = [self.strategies[e - 1] for e in match.entrants]
+                    file.write(format_play(match.name(), seed, strategies))
+                    file.flush()
+                    line = file.readline()
+                    if not line:
+                        raise OSError("connection closed")
+                    result = parse_result(line)
+                except (OSError, ValueError) as error:
+                    # The match goes back for another host
+                    self.work.put(match)
+                    self.results.put((name, None, f"{name} lost: {error}"))
+                    return
+                self.results.put((name, match, result))
+        finally:
+            sock.close()
+
+    # Every attempt plays other deals, a seed that stalls is not tried twice
+    def match_seed(self, match):
+        return random.Random(
+            f"{self.seed}:{match.name()}:{match.attempts}"
+        ).getrandbits(32)
+
+    def run(self, bracket):
+        playing = 0
+        while bracket.ready:
+            self.work.put(bracket.ready.popleft())
+            playing += 1
+
+        while playing:
+            name, match, result = self.results.get()
+            if match is None:
+                self.slots -= 1
+                self.host_stats[name].lost = True
+                self.output(result)
+                if not self.slots:
+                    raise CoordinatorError("Every host is gone, matches are left")
+                continue
+
+            _, seat, seconds, frames, detail = result
+            stats = self.host_stats[name]
+            stats.matches += 1
+            stats.busy += seconds
+            playing -= 1
+
+            if not seat:
+                match.attempts += 1
+                if match.attempts >= MATCH_ATTEMPTS:
+                    raise CoordinatorError(
+                        f"Ring {match.name()} failed {match.attempts} times, "
+                        f"last on {name}: {detail}"
+                    )
+                self.output(
+                    f"Ring {match.name()} failed on {name}, playing it again: "
+                    f"{detail}"
+                )
+                self.work.put(match)
+                playing += 1
+                continue
+
+            match.winner = match.entrants[seat - 1]
+            match.seconds = seconds
+            match.frames = frames
+            bracket.finished(match)
+            while bracket.ready:
+                self.work.put(bracket.ready.popleft())
+                playing += 1
+
+        for _ in range(self.slots):
+            self.work.put(None)
+
+
+# Hosts on this machine, each a process of its own like a separate machine
+def start_local_hosts(count, slots, processes):
+    hosts = []
+    children = []
+    for port in free_ports(count):
+        command = [sys.executable, RING_HOST, "--ip", LOOPBACK, "--port", str(port)]
+        command += ["--slots", str(slots)]
+        if processes:
+            command.append("--processes")
+        children.append(subprocess.Popen(command, stdout=subprocess.DEVNULL))
+        hosts.append((LOOPBACK, port))
+    return hosts, children
+
+
+def parse_host(text):
+    host, _, port = text.partition(":")
+    if not host:
+        raise ValueError(f"No host in {text!r}")
+    try:
+        return host, int(port) if port else RING_HOST_PORT
+    except ValueError:
+        raise ValueError(f"Bad port in {text!r}") from None
+
+
+def print_summary(bracket, coordinator, strategies, elapsed):
+    matches = bracket.matches
+    frames = sum(match.frames for match in matches)
+    print(
+        f"Entrant {bracket.champion} ({strategies[bracket.champion - 1]}) won, "
+        f"{len(strategies)} entrants in {bracket.levels()} levels, "
+        f"{len(matches)} rings in {elapsed:.2f}s "
+        f"({len(matches) / elapsed:.1f} rings/s, {frames / elapsed:.0f} frames/s)"
+    )
+
+    won = {}
+    for match in matches:
+        strategy = strategies[match.winner - 1]
+        won[strategy] = won.get(strategy, 0) + 1
+    for strategy in sorted(won):
+        print(f"  {strategy} won {won[strategy]} rings")
+
+    for name, stats in coordinator.host_stats.items():
+        print(
+            f"  {name}: {stats.matches} rings, busy {stats.busy:.2f}s"
+            + (", lost" if stats.lost else "")
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a bracket of bot players as rings on ring_host.py hosts"
+    )
+    parser.add_argument(
+        "-e", "--entrants", type=int, default=64, help="Players in the bracket"
+    )
+    parser.add_argument(
+        "-p", "--players", type=int, default=NUM_PLAYERS, help="Seats per ring"
+    )
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument(
+        "--strategies",
+        choices=list(STRATEGIES),
+        nargs="+",
+        default=["random"],
+        help="Strategies handed to the entrants in turn",
+    )
+    parser.add_argument(
+        "--hosts",
+        nargs="+",
+        metavar="HOST[:PORT]",
+        help="ring_host.py instances to play on",
+    )
+    parser.add_argument(
+        "--local",
+        type=int,
+        metavar="COUNT",
+        help="Start this many hosts on this machine instead of using --hosts",
+    )
+    parser.add_argument(
+        "--local-slots", type=int, default=1, help="Rings each local host plays"
+    )
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="Local hosts run every node as a main.py process",
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        type=float,
+        default=10,
+        help="Seconds hosts have to accept the coordinator",
+    )
+    args = parser.parse_args()
+
+    if args.players < 2:
+        parser.error("A ring needs at least 2 players")
+    if args.entrants < 2:
+        parser.error("A bracket needs at least 2 entrants")
+    if bool(args.hosts) == bool(args.local):
+        parser.error("Give either --hosts or --local")
+
+    children = []
+    if args.local:
+        hosts, children = start_local_hosts(
+            args.local, args.local_slots, args.processes
+        )
+    else:
+        try:
+            hosts = [parse_host(text) for text in args.hosts]
+        except ValueError as error:
+            parser.error(str(error))
+
+    strategies = [
+        args.strategies[i % len(args.strategies)] for i in range(args.entrants)
+    ]
+    bracket = Bracket(
+        range(1, args.entrants + 1), args.players, random.Random(args.seed)
+    )
+    coordinator = Coordinator(hosts, strategies, args.seed)
+
+    try:
+        coordinator.start_slots(args.connect_timeout)
+        start = time.perf_counter()
+        coordinator.run(bracket)
+        elapsed = time.perf_counter() - start
+    except CoordinatorError as error:
+        print(error)
+        exit(1)
+    finally:
+        for child in children:
+            child.terminate()
+            child.wait()
+
+    print_summary(bracket, coordinator, strategies, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,40 @@
 import random
-from enum import Enum
-
-from network import NUM_PLAYERS, Network
-from settings import CARDS_PER_HAND, NUM_LIVES
+import time
+
+from network import BootstrapError, Network
+from protocol import (
+    ACTIONS_BY_VALUE,
+    Actions,
+    decode_frame,
+    decode_payload,
+    decode_sections,
+    encode_frame,
+    encode_raw_frame,
+    encode_sections,
+    hands_per_frame,
+    mask_cards,
+)
+from settings import (
+    BUFFER_SIZE,
+    CARDS_PER_HAND,
+    NUM_LIVES,
+    NUM_PLAYERS,
+    TOKEN_RECOVERY_PATIENCE,
+)
 
 SUITS = ["Hearts", "Diamonds", "Clubs", "Spades"]
 RANKS = ["2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K", "A"]
+DECK_SIZE = len(RANKS) * len(SUITS)
+
+
+# Hands shrink so the whole ring can be dealt from one deck, rings larger than
+# the deck get one card each from as many decks as needed
+def hand_size(num_players, cards_per_hand=CARDS_PER_HAND):
+    return max(1, min(cards_per_hand, DECK_SIZE // num_players))
+
+
+def decks_needed(num_players, cards_per_hand):
+    return -(-num_players * cards_per_hand // DECK_SIZE)
 
 
 class PrintColors:
@@ -18,59 +47,191 @@ class PrintColors:
     ENDC = "\033[0m"
 
 
-# Value must be one character
-class Actions(Enum):
-    NEW_DEALER = 0
-    INFO_NEW_DEALER = 1
-    DEAL_CARDS = 2
-    ASK_BET = 3
-    WINNER = 4
-    SHOW_BETS = 5
-    ASK_CARD = 6
-    RETURN_CARDS = 7
-    SHOW_ROUND_RESULT = 8
-    SHOW_RESULTS = 9
+# An output that shows nothing, a Game given it skips building its display
+def silent(*args):
+    pass
+
+
+# A card is an int, rank * 4 + suit, so comparing cards compares the rank and
+# then the suit. Card(rank, suit) returns one of the shared CARDS instances.
+class Card(int):
+    __slots__ = ()
 
+    def __new__(cls, rank, suit):
+        return CARDS[rank * len(SUITS) + suit]
 
-class Card:
-    rank = 0
-    suit = 0
+    @property
+    def rank(self):
+        return CARD_RANKS[self]
 
-    def __init__(self, rank, suit):
-        self.rank = rank
-        self.suit = suit
+    @property
+    def suit(self):
+        return CARD_SUITS[self]
 
     def to_string(self):
-        return f"{RANKS[self.rank]} of {SUITS[self.suit]}"
+        return CARD_NAMES[self]
 
+    # (rank, suit) as sent on the wire
     def encode(self):
-        return f"{self.rank}-{self.suit}"
+        return CARD_WIRE[self]
+
+
+# Per-card tables, indexed by card value
+CARD_RANKS = tuple(value // len(SUITS) for value in range(DECK_SIZE))
+CARD_SUITS = tuple(value % len(SUITS) for value in range(DECK_SIZE))
+CARD_NAMES = tuple(
+    f"{RANKS[rank]} of {SUITS[suit]}" for rank, suit in zip(CARD_RANKS, CARD_SUITS)
+)
+CARD_WIRE = tuple(zip(CARD_RANKS, CARD_SUITS))
+CARDS = tuple(int.__new__(Card, value) for value in range(DECK_SIZE))
+
+# Canonical deck, copied and shuffled every great round
+DECK = tuple(range(DECK_SIZE))
+
+
+# The game cannot go on at this node, the loop driving it reports and stops
+class RingError(Exception):
+    pass
+
+
+# The player did not decide before Game.turn_deadline
+class TurnExpired(Exception):
+    pass
+
+
+# Method handling each action, looked up per Game so subclasses can override
+HANDLERS = {
+    Actions.NEW_DEALER: "on_new_dealer",
+    Actions.INFO_NEW_DEALER: "on_info_new_dealer",
+    Actions.DEAL_CARDS: "on_deal_cards",
+    Actions.ASK_BET: "on_ask_bet",
+    Actions.WINNER: "on_winner",
+    Actions.SHOW_BETS: "on_show_bets",
+    Actions.ASK_CARD: "on_ask_card",
+    Actions.RETURN_CARDS: "on_return_cards",
+    Actions.SHOW_ROUND_RESULT: "on_show_round_result",
+    Actions.SHOW_RESULTS: "on_show_results",
+    Actions.DEAL_HANDS: "on_deal_hands",
+}
 
 
 class Game:
     network: Network = {}
+    table_id = 0
+    strategy = None  # a Strategy, main.py plays the terminal through one
+    splice_dead = True
+    piggyback = False  # ride display phases on the frame of the next phase
+    deal_per_hand = False  # one DEAL_CARDS lap per hand instead of DEAL_HANDS
+    deal_secret = None  # bytes shared by the ring, masks the dealt hands
+    observer = None
+    spectators = None  # a Broadcaster, spectator.py
+    metrics = None
+    journal = None
+    checkpointer = None
+    resumed = False  # state restored from a checkpoint, the game is underway
+    turn_timeout = 0  # seconds per decision, 0 waits for the strategy forever
+    turn_deadline = 0.0  # monotonic time the decision being made is due, or 0
+    default_strategy = None  # a Strategy deciding the turns that ran out
+    rng = random
+    output = print
+    display = True  # False with a silent output
+
+    # Rules
+    num_players = NUM_PLAYERS
+    cards_per_hand = CARDS_PER_HAND
+    num_decks = 1
+    num_lives = NUM_LIVES
 
     # Player states
     player_id = 0
     next_player_id = 0
     dealer_id = 1
     is_alive = 1
-    player_hand = []
+    player_hand: list[Card]
 
     # Game states - Dealer
     curr_round = 1
     last_win_player_id = 0
-    deck = []
-    players_alive = [1] * NUM_PLAYERS  # 1 if it is alive, 0 otherwise
-    players_lives = [NUM_LIVES] * NUM_PLAYERS
-    players_bets = [0] * NUM_PLAYERS
-    players_round_cards = [Card(0, 0)] * NUM_PLAYERS
-    players_wins = [0] * NUM_PLAYERS
-
-    def __init__(self, player_id, network):
+    deck: list
+    shuffler: random.Random = None  # reseeded every great round
+    hands: list  # cards per hand, or (player_id, cards) left to deal in one lap
+    last_dealt_player_id = 0
+    # Per-player lists are created in __init__, so every Game owns its state
+    players_alive: list[int]  # 1 if it is alive, 0 otherwise
+    players_lives: list[int]
+    players_bets: list[int]
+    players_round_cards: list[Card]
+    players_wins: list[int]
+    players_expired: list[int]  # turns that ran out, as reported to the dealer
+    great_rounds = 0
+    winner_id = 0
+
+    # Last frame handled here, to recognise regenerated copies of it
+    last_handled = None
+    last_handled_epoch = 0
+    # Piggybacked sections already applied, a frame can visit a node twice
+    piggyback_seen: set
+    # TURN_EXPIRED sections for the next frame this node sends
+    expired_reports: list
+
+    handlers: list  # bound HANDLERS, indexed by action value
+    running = True  # False once on_frame has seen the game end here
+
+    def __init__(
+        self,
+        player_id,
+        network,
+        strategy=None,
+        rng=None,
+        output=None,
+        cards_per_hand=None,
+        num_lives=NUM_LIVES,
+        table_id=0,
+        num_players=NUM_PLAYERS,
+        piggyback=False,
+        deal_per_hand=False,
+        deal_secret=None,
+        turn_timeout=0,
+        default_strategy=None,
+    ):
         self.player_id = player_id
+        self.table_id = table_id
+        self.num_players = num_players
         self.next_player_id = self.next_player(player_id)
         self.network = network
+        self.cards_per_hand = cards_per_hand or hand_size(num_players)
+        self.num_decks = decks_needed(num_players, self.cards_per_hand)
+        self.num_lives = num_lives
+        self.piggyback = piggyback
+        self.deal_per_hand = deal_per_hand
+        self.deal_secret = deal_secret
+        self.turn_timeout = turn_timeout
+        if turn_timeout and not default_strategy:
+            raise ValueError("A turn timeout needs a default strategy")
+
+        if strategy:
+            self.strategy = strategy
+        if default_strategy:
+            self.default_strategy = default_strategy
+        if rng:
+            self.rng = rng
+        if output:
+            self.output = output
+        self.display = self.output is not silent
+
+        self.network.on_token_lost = self.handle_token_lost
+
+        self.players_alive = [1] * num_players
+        self.players_lives = [self.num_lives] * num_players
+        self.players_expired = [0] * num_players
+        self.piggyback_seen = set()
+        self.expired_reports = []
+        self.shuffler = random.Random()
+        self.reset_states()
+
+        self.handlers = [None] * len(ACTIONS_BY_VALUE)
+        for action, name in HANDLERS.items():
+            self.handlers[action.value] = getattr(self, name)
 
         if player_id == self.dealer_id:
             self.network.has_token = 1
@@ -81,37 +242,57 @@ class Game:
         return self.dealer_id == self.player_id
 
     def next_player(self, current_player_id):
-        return current_player_id % NUM_PLAYERS + 1
+        return current_player_id % self.num_players + 1
 
-    def encode_message(self, from_player_id, to_player_id, action, data):
-        return str(from_player_id) + str(to_player_id) + str(action.value) + str(data)
+    def encode_message(
+        self, from_player_id, to_player_id, action, data, piggyback=b""
+    ):
+        return encode_frame(
+            from_player_id,
+            to_player_id,
+            action,
+            self.network.next_seq(),
+            data,
+            self.network.epoch,
+            self.table_id,
+            piggyback,
+        )
 
     def decode_message(self, message):
-        from_player_id = int(message[0])
-        to_player_id = int(message[1])
-        action = Actions(int(message[2]))
-        data = str(message[3:])
-
-        return {
-            "from_player_id": from_player_id,
-            "to_player_id": to_player_id,
-            "action": action,
-            "data": data,
-        }
+        return decode_frame(message, with_data=False)
 
     def receive_decoded_message(self):
         network_message = self.network.receive_message()
         return self.decode_message(network_message)
 
     def pass_message(self, decoded_message):
-        encoded_message = self.encode_message(
+        # Payload is forwarded as received, only the header is rebuilt
+        encoded_message = encode_raw_frame(
             decoded_message["from_player_id"],
             decoded_message["to_player_id"],
             decoded_message["action"],
-            decoded_message["data"],
+            self.network.next_seq(),
+            decoded_message["payload"],
+            self.network.epoch,
+            self.table_id,
+            decoded_message["piggyback"],
         )
         self.network.send_message(encoded_message)
 
+    # Sections sent by this node are marked seen, it already showed them
+    def encode_piggyback(self, sections, seen=()):
+        piggyback = encode_sections(sections)
+        for action, payload in decode_sections(piggyback):
+            if action in seen:
+                self.piggyback_seen.add((action, payload))
+        return piggyback
+
+    def next_alive_player(self, current_player_id):
+        next_player_id = self.next_player(current_player_id)
+        while not self.players_alive[next_player_id - 1]:
+            next_player_id = self.next_player(next_player_id)
+        return next_player_id
+
     def number_players_alive(self):
         alive = 0
         for i in self.players_alive:
@@ -120,33 +301,35 @@ class Game:
         return alive
 
     def print_purple(self, string):
-        print(PrintColors.PURPLE + string + PrintColors.ENDC)
+        self.output(PrintColors.PURPLE + string + PrintColors.ENDC)
 
     def print_blue(self, string):
-        print(PrintColors.CYAN + string + PrintColors.ENDC)
+        self.output(PrintColors.CYAN + string + PrintColors.ENDC)
 
     def print_green(self, string):
-        print(PrintColors.GREEN + string + PrintColors.ENDC)
+        self.output(PrintColors.GREEN + string + PrintColors.ENDC)
 
     def print_red(self, string):
-        print(PrintColors.RED + string + PrintColors.ENDC)
+        self.output(PrintColors.RED + string + PrintColors.ENDC)
 
     def print_orange(self, string):
-        print(PrintColors.ORANGE + string + PrintColors.ENDC)
+        self.output(PrintColors.ORANGE + string + PrintColors.ENDC)
 
     def print_bold(self, string):
-        print(PrintColors.BOLD + string + PrintColors.ENDC)
+        self.output(PrintColors.BOLD + string + PrintColors.ENDC)
 
     def print_hand(self):
+        if not self.display:
+            return
         self.print_bold("=============================")
         self.print_bold("Your hand:")
         for i, card in enumerate(self.player_hand):
             self.print_bold(f"{i+1} - {card.to_string()}")
         self.print_bold("=============================")
 
-    def print_curr_wins(self, encoded_wins):
-        wins = encoded_wins.split(",")
-
+    def print_curr_wins(self, wins):
+        if not self.display:
+            return
         self.print_blue("=============================")
         self.print_blue("Number of wins:")
         for i, win in enumerate(wins):
@@ -154,7 +337,21 @@ class Game:
                 self.print_blue(f"Player {i + 1} has {win} wins")
         self.print_blue("=============================")
 
+    def print_bets(self, bets):
+        if not self.display:
+            return
+        self.output("=============================")
+        self.output("BETS:")
+        for i, bet in enumerate(bets):
+            if self.players_alive[i]:
+                self.output(
+                    f"Player {i + 1} bet: {bet}",
+                )
+        self.output("=============================")
+
     def print_curr_lives(self, lives):
+        if not self.display:
+            return
         self.print_purple("=============================")
         self.print_purple("Lives:")
         for i, life in enumerate(lives):
@@ -167,91 +364,240 @@ class Game:
         self.curr_round = 1
         self.last_win_player_id = 0
         self.deck = []
-        self.players_bets = [0] * NUM_PLAYERS
-        self.players_round_cards = [Card(0, 0)] * NUM_PLAYERS
-        self.players_wins = [0] * NUM_PLAYERS
-
-    def place_bet(self):
-        bet = int(input("Place your bet - how many rounds are you going to win?\n"))
-        while bet < 0 or bet > CARDS_PER_HAND:
-            bet = int(input("Place your bet - how many rounds are you going to win?\n"))
-
+        self.hands = []
+        self.players_bets = [0] * self.num_players
+        self.players_round_cards = [CARDS[0]] * self.num_players
+        self.players_wins = [0] * self.num_players
+
+    def place_bet(self, bets=()):
+        bet = self.decide(
+            Actions.ASK_BET, lambda strategy: strategy.choose_bet(self, bets)
+        )
+        if self.journal:
+            self.journal.decision(bet)
         return bet
 
-    def register_bets(self, encoded_bets):
-        raw_bets = encoded_bets.split(",")
-
-        for raw_bet in raw_bets:
-            player_id, bet = str(raw_bet).split("-")
-            self.players_bets[int(player_id) - 1] = int(bet)
-
-    def select_card(self):
-        self.print_hand()
-
-        card_index = int(input("\nPlay your card: \n")) - 1
-
-        while card_index < 0 or card_index > len(self.player_hand) - 1:
-            card_index = int(input("\nPlay your card: \n")) - 1
+    def register_bets(self, bets):
+        for player_id, bet in bets:
+            self.players_bets[player_id - 1] = bet
 
+    def select_card(self, played_cards=()):
+        card_index = self.decide(
+            Actions.ASK_CARD, lambda strategy: strategy.choose_card(self, played_cards)
+        )
+        if self.journal:
+            self.journal.decision(card_index)
         card = self.player_hand.pop(card_index)
-        print("Card selected:", card.to_string())
+        if self.display:
+            self.output(f"Card selected: {card.to_string()}")
 
         return card
 
+    # The default strategy decides once the turn runs out, so the token moves on
+    def decide(self, action, choose):
+        if not self.turn_timeout:
+            return choose(self.strategy)
+
+        self.turn_deadline = time.monotonic() + self.turn_timeout
+        try:
+            return choose(self.strategy)
+        except TurnExpired:
+            self.turn_deadline = 0.0
+            decision = choose(self.default_strategy)
+            self.turn_expired(action)
+            return decision
+        finally:
+            self.turn_deadline = 0.0
+
+    # The dealer learns of it from a section on the next frame this node sends
+    def turn_expired(self, action):
+        self.print_red("Out of time, a default move was made for you")
+        if self.journal:
+            self.journal.turn_expired()
+        if self.metrics:
+            self.metrics.turn_expired(action)
+
+        report = [self.player_id, action.value, len(self.player_hand)]
+        if self.is_dealer():
+            self.expired_reported(report)
+        else:
+            self.expired_reports.append((Actions.TURN_EXPIRED, report))
+
+    def expired_reported(self, report):
+        if not self.is_dealer():
+            return
+        player_id = report[0]
+        self.players_expired[player_id - 1] += 1
+        self.print_orange(
+            f"Player {player_id} ran out of time "
+            f"({self.players_expired[player_id - 1]} turns so far)"
+        )
+        if self.metrics:
+            self.metrics.turn_reported()
+
+    # Piggyback of a frame passed on, with the reports this node has to send
+    def with_expired_reports(self, piggyback):
+        if not self.expired_reports:
+            return piggyback
+        reports = encode_sections(self.expired_reports)
+        self.expired_reports = []
+        return bytes(piggyback) + reports
+
+    # Reports riding on a trick go on to the dealer with its cards
+    def expired_sections(self, piggyback):
+        return encode_sections(
+            [
+                (action, decode_payload(action, payload))
+                for action, payload in decode_sections(piggyback)
+                if action == Actions.TURN_EXPIRED
+            ]
+        )
+
     ####################### UTILS - ADMIN #######################
 
     def assemble_deck(self):
-        for rank in range(len(RANKS)):
-            for suit in range(len(SUITS)):
-                self.deck.append(Card(rank, suit).encode())
+        self.deck = list(DECK * self.num_decks)
 
+    # Randomness used by the dealer goes through here, so a journal can replay
+    # the deal from a few bytes
+    def draw_seed(self, bits):
+        seed = self.rng.getrandbits(bits)
+        if self.journal:
+            self.journal.seed(seed)
+        return seed
+
+    # Each great round is shuffled from its own seed
     def split_cards(self):
         self.assemble_deck()
-        random.shuffle(self.deck)
+        self.shuffler.seed(self.draw_seed(64))
+        self.shuffler.shuffle(self.deck)
 
+        deck = self.deck
+        size = self.cards_per_hand
         hands = [
-            self.deck[i * CARDS_PER_HAND : (i + 1) * CARDS_PER_HAND]
+            [CARD_WIRE[card] for card in deck[i * size : (i + 1) * size]]
             for i in range(self.number_players_alive())
         ]
 
         return hands
 
-    def finish_round(self):
-        parsed_round_cards = []
+    def start_great_round(self):
+        self.print_orange("===========YOU ARE THE DEALER===========")
+        self.great_rounds += 1
+        self.piggyback_seen.clear()
+        if self.spectators:
+            self.spectators.dealt()
+        self.hands = self.split_cards()
+        self.last_dealt_player_id = self.player_id
+
+        if self.deal_per_hand:
+            self.deal_next_hand()
+        else:
+            self.hands = self.address_hands(self.hands)
+            self.deal_hands_action()
+
+    # Same seats as deal_next_hand, starting after the dealer
+    def address_hands(self, hands):
+        addressed = []
+        player_id = self.player_id
+        for cards in hands:
+            player_id = self.next_alive_player(player_id)
+            addressed.append((player_id, cards))
+        return addressed
+
+    # Every hand travels in one frame, split only when they outgrow a datagram
+    def deal_hands_action(self):
+        count = hands_per_frame(BUFFER_SIZE, self.cards_per_hand)
+        hands, self.hands = self.hands[:count], self.hands[count:]
+
+        nonce = 0
+        if self.deal_secret:
+            nonce = self.draw_seed(32)
+            hands = [
+                (player_id, mask_cards(cards, self.deal_secret, nonce, player_id))
+                for player_id, cards in hands
+            ]
 
-        for i, card in enumerate(self.players_round_cards):
-            parsed_round_cards.append(
-                {
-                    "player_id": i + 1,
-                    "rank": card.rank,
-                    "suit": card.suit,
-                }
-            )
+        message = self.encode_message(
+            self.player_id,
+            self.player_id,
+            Actions.DEAL_HANDS,
+            (nonce, hands),
+        )
+        self.network.send_message(message)
+
+    def deal_next_hand(self):
+        to_player_id = self.next_player(self.last_dealt_player_id)
+        # To player is not alive
+        while not self.players_alive[to_player_id - 1]:
+            to_player_id = self.next_player(to_player_id)
+
+        self.last_dealt_player_id = to_player_id
 
-        sorted_players_cards = sorted(
-            parsed_round_cards, key=lambda x: (-x["rank"], -x["suit"])
+        message = self.encode_message(
+            self.player_id,
+            to_player_id,
+            Actions.DEAL_CARDS,
+            self.hands.pop(0),
         )
+        self.network.send_message(message)
 
-        win_player_id = sorted_players_cards[0]["player_id"]
+    def ask_bet_action(self):
+        message = self.encode_message(
+            self.player_id,
+            self.next_player_id,
+            Actions.ASK_BET,
+            [],
+        )
+        self.network.send_message(message)
+
+    def show_bets_action(self):
+        message = self.encode_message(
+            self.player_id,
+            self.next_player_id,
+            Actions.SHOW_BETS,
+            self.players_bets,
+        )
+        self.network.send_message(message)
+
+    def finish_round(self, played_cards=()):
+        # Highest card wins, the first player holding it on a tie
+        round_cards = self.players_round_cards
+        win_player_id = max(range(self.num_players), key=round_cards.__getitem__) + 1
 
         self.players_wins[win_player_id - 1] += 1
         self.last_win_player_id = win_player_id
+        if self.spectators:
+            self.spectators.trick(
+                self.curr_round, win_player_id, played_cards, self.players_wins
+            )
 
-        wins_encoded = ",".join(str(win) for win in self.players_wins)
+        self.print_curr_wins(self.players_wins)
 
-        self.print_curr_wins(wins_encoded)
+        if self.piggyback:
+            # Wins ride on the next trick, or on the results after the last one
+            sections = [(Actions.SHOW_ROUND_RESULT, self.players_wins)]
+            if self.curr_round == self.cards_per_hand:
+                self.finish_great_round(sections)
+            else:
+                self.curr_round += 1
+                self.ask_card_action(
+                    self.last_win_player_id,
+                    self.encode_piggyback(sections, {Actions.SHOW_ROUND_RESULT}),
+                )
+            return
 
         show_round_results_message = self.encode_message(
             self.player_id,
             self.next_player_id,
             Actions.SHOW_ROUND_RESULT,
-            wins_encoded,
+            self.players_wins,
         )
         self.network.send_message(show_round_results_message)
 
-    def finish_great_round(self):
+    def finish_great_round(self, sections=()):
         # Decrease lives
-        for i in range(NUM_PLAYERS):
+        for i in range(self.num_players):
             diff = abs(self.players_bets[i] - self.players_wins[i])
             self.players_lives[i] -= diff
 
@@ -259,37 +605,58 @@ class Game:
             if life <= 0:
                 self.players_alive[i] = 0
 
-        lives_encoded = ",".join([str(life) for life in self.players_lives])
+        if self.spectators:
+            self.spectators.results(self.players_lives)
+        if self.observer:
+            self.observer.great_round_finished(self)
+
+        if self.piggyback:
+            # Results ride on the winner or new dealer lap, every node applies
+            # them as the frame passes
+            piggyback = self.encode_piggyback(
+                [*sections, (Actions.SHOW_RESULTS, self.players_lives)],
+                {Actions.SHOW_ROUND_RESULT},
+            )
+            if not self.verify_winners(piggyback):
+                self.new_dealer_action(
+                    self.players_lives,
+                    self.next_alive_player(self.player_id),
+                    piggyback,
+                )
+            return
 
         show_results_message = self.encode_message(
             self.player_id,
             self.next_player_id,
             Actions.SHOW_RESULTS,
-            lives_encoded,
+            self.players_lives,
         )
         self.network.send_message(show_results_message)
 
-    def won_game(self, winner_player):
+    def won_game(self, winner_player, piggyback=b""):
         winner_message = self.encode_message(
             self.player_id,
             self.next_player_id,
             Actions.WINNER,
-            str(winner_player),
+            winner_player,
+            piggyback,
         )
         self.network.send_message(winner_message)
 
-    def verify_winners(self):
+    def verify_winners(self, piggyback=b""):
         num_alive = self.number_players_alive()
 
         if num_alive <= 1:
             greater_life_player = self.players_lives.index(max(self.players_lives)) + 1
-            self.won_game(greater_life_player)
+            if self.spectators:
+                self.spectators.winner(greater_life_player)
+            self.won_game(greater_life_player, piggyback)
             return True
         elif num_alive > 1:
             return False
 
-    def new_dealer_action(self, encoded_lives):
-        to_player_id = self.next_player_id
+    def new_dealer_action(self, lives, to_player_id=None, piggyback=b""):
+        to_player_id = to_player_id or self.next_player_id
 
         self.dealer_id = to_player_id
 
@@ -297,13 +664,14 @@ class Game:
             self.player_id,
             to_player_id,
             Actions.NEW_DEALER,
-            encoded_lives,
+            lives,
+            piggyback,
         )
         self.network.send_message(message)
 
     ######################### ACTIONS HANDLERS #########################
 
-    def handle_new_dealer(self):
+    def handle_new_dealer(self, decoded_message):
         self.dealer_id = self.player_id
 
         self.reset_states()
@@ -313,51 +681,78 @@ class Game:
             self.next_player_id,
             Actions.INFO_NEW_DEALER,
             self.player_id,
+            decoded_message["piggyback"],
         )
         self.network.send_message(show_round_results_message)
 
     def handle_info_new_dealer(self, decoded_message):
-        self.dealer_id = int(decoded_message["data"])
+        self.dealer_id = decoded_message["data"]
         self.reset_states()
 
         decoded_message["from_player_id"] = self.player_id
         decoded_message["to_player_id"] = self.next_player_id
 
     def handle_deal_cards(self, decoded_message):
-        cards = eval(decoded_message["data"])
+        self.take_hand(decoded_message["data"])
 
-        for card in cards:
-            rank, suit = card.split("-")
-            created_card = Card(int(rank), int(suit))
-            self.player_hand.append(created_card)
+    def take_hand(self, cards):
+        self.piggyback_seen.clear()
+        for rank, suit in cards:
+            self.player_hand.append(Card(rank, suit))
 
         self.print_hand()
 
-    def handle_ask_bet(self, decoded_message):
-        raw_bets = decoded_message["data"].split(",")
+    def handle_deal_hands(self, decoded_message):
+        nonce, hands = decoded_message["data"]
+
+        for player_id, cards in hands:
+            if player_id == self.player_id:
+                if self.deal_secret:
+                    cards = mask_cards(cards, self.deal_secret, nonce, player_id)
+                if any(
+                    rank >= len(RANKS) or suit >= len(SUITS) for rank, suit in cards
+                ):
+                    raise RingError(
+                        "Dealt hand is unreadable, check the deal secret of the ring"
+                    )
+                self.take_hand(cards)
+
+    def handle_dealt_hands(self, decoded_message):
+        self.handle_deal_hands(decoded_message)
+
+        if self.hands:
+            self.deal_hands_action()
+        else:
+            self.ask_bet_action()
 
-        data_to_send = ""
+    def handle_dealt_cards(self, decoded_message):
+        if decoded_message["to_player_id"] == self.player_id:
+            self.handle_deal_cards(decoded_message)
 
-        # bet protocol - PLAYER_ID-BET
-        if len(raw_bets) > 0 and len(raw_bets[0]) > 0:
-            print("=============================")
-            print("Bets already placed:")
-            for raw_bet in raw_bets:
-                player_id, bet = str(raw_bet).split("-")
-                print(
+        if self.hands:
+            self.deal_next_hand()
+        else:
+            self.ask_bet_action()
+
+    def handle_ask_bet(self, decoded_message):
+        bets = decoded_message["data"]
+
+        if self.display and len(bets) > 0:
+            self.output("=============================")
+            self.output("Bets already placed:")
+            for player_id, bet in bets:
+                self.output(
                     f"Player {player_id} bet: {bet}",
                 )
-            print("=============================")
-            selected_bet = self.place_bet()
-            data_to_send = (
-                f"{decoded_message['data']},{str(self.player_id)}-{str(selected_bet)}"
-            )
-        else:
-            selected_bet = self.place_bet()
-            data_to_send = f"{str(self.player_id)}-{str(selected_bet)}"
+            self.output("=============================")
+
+        selected_bet = self.place_bet(bets)
+        data_to_send = bets + [(self.player_id, selected_bet)]
 
         if self.is_dealer():
             self.register_bets(data_to_send)
+            if self.spectators:
+                self.spectators.bets(self.players_bets)
             return
 
         message = self.encode_message(
@@ -365,39 +760,30 @@ class Game:
             self.next_player_id,
             Actions.ASK_BET,
             data_to_send,
+            self.with_expired_reports(decoded_message["piggyback"]),
         )
 
         self.network.send_message(message)
 
     def handle_show_bets(self, decoded_message):
-        bets = [int(bet) for bet in eval(decoded_message["data"])]
-
-        print("=============================")
-        print("BETS:")
-        for i, bet in enumerate(bets):
-            if self.players_alive[i]:
-                print(
-                    f"Player {i + 1} bet: {bet}",
-                )
-        print("=============================")
+        self.print_bets(decoded_message["data"])
 
         # Pass Message to next
         decoded_message["from_player_id"] = self.player_id
         decoded_message["to_player_id"] = self.next_player_id
 
     def handle_ask_card(self, decoded_message):
-        raw_cards = decoded_message["data"].split(",")
-
-        data_to_send = ""
+        played_cards = decoded_message["data"]
 
         # All Cards Played - send to dealer
-        if len(raw_cards) == self.number_players_alive():
+        if len(played_cards) == self.number_players_alive():
             if not self.is_dealer():
                 message = self.encode_message(
                     self.player_id,
                     self.dealer_id,
                     Actions.RETURN_CARDS,
                     decoded_message["data"],
+                    self.expired_sections(decoded_message["piggyback"]),
                 )
 
                 self.network.send_message(message)
@@ -407,81 +793,82 @@ class Game:
                 self.handle_return_cards(decoded_message)
                 return
 
-        # card protocol - PLAYER_ID-RANK-SUIT
-        if len(raw_cards) > 0 and len(raw_cards[0]) > 0:
-            print("=============================")
-            print("Cards already played:")
-            for card in raw_cards:
-                player_id, rank, suit = str(card).split("-")
-                print(
-                    f"Player {player_id} played: ",
-                    Card(int(rank), int(suit)).to_string(),
+        if self.display and len(played_cards) > 0:
+            self.output("=============================")
+            self.output("Cards already played:")
+            for player_id, rank, suit in played_cards:
+                self.output(
+                    f"Player {player_id} played: {Card(rank, suit).to_string()}"
                 )
-            print("=============================")
-            selected_card = self.select_card()
-            data_to_send = f"{decoded_message['data']},{str(self.player_id)}-{selected_card.encode()}"
-        else:
-            if len(self.player_hand) != CARDS_PER_HAND:
-                self.print_green("You won last round!")
-            selected_card = self.select_card()
-            data_to_send = f"{str(self.player_id)}-{selected_card.encode()}"
+            self.output("=============================")
+        elif self.display and len(self.player_hand) != self.cards_per_hand:
+            self.print_green("You won last round!")
 
+        selected_card = self.select_card(played_cards)
+        data_to_send = played_cards + [(self.player_id, *selected_card.encode())]
+
+        # Piggybacked sections travel with the trick until every player saw them
         message = self.encode_message(
             self.player_id,
             self.next_player_id,
             Actions.ASK_CARD,
             data_to_send,
+            self.with_expired_reports(decoded_message["piggyback"]),
         )
 
         self.network.send_message(message)
 
-    def ask_card_action(self, to_player_id):
+    def ask_card_action(self, to_player_id, piggyback=b""):
         message = self.encode_message(
             self.player_id,
             to_player_id,
             Actions.ASK_CARD,
-            "",
+            [],
+            piggyback,
         )
         self.network.send_message(message)
 
     def handle_return_cards(self, decoded_message):
-        raw_cards = decoded_message["data"].split(",")
-
-        for card in raw_cards:
-            player_id, rank, suit = str(card).split("-")
-            played_card = Card(int(rank), int(suit))
-            self.players_round_cards[int(player_id) - 1] = played_card
+        for player_id, rank, suit in decoded_message["data"]:
+            self.players_round_cards[player_id - 1] = Card(rank, suit)
 
-        self.finish_round()
+        self.finish_round(decoded_message["data"])
 
     def handle_show_round_result(self, decoded_message):
-        self.print_curr_wins(decoded_message["data"])
+        self.apply_wins(decoded_message["data"])
 
         # Pass Message to next
         decoded_message["to_player_id"] = self.next_player_id
 
     def handle_show_results(self, decoded_message):
-        self.players_lives = [int(life) for life in decoded_message["data"].split(",")]
+        self.apply_results(decoded_message["data"])
+
+        # Pass Message to next
+        decoded_message["from_player_id"] = self.player_id
+        decoded_message["to_player_id"] = self.next_player_id
+
+    # Every player keeps the tricks won so far, bots play by them
+    def apply_wins(self, wins):
+        self.players_wins = list(wins)
+        self.print_curr_wins(self.players_wins)
+
+    def apply_results(self, lives):
+        self.players_lives = list(lives)
 
         for i, life in enumerate(self.players_lives):
             if life <= 0:
                 self.players_alive[i] = 0
 
-        lives = decoded_message["data"].split(",")
-
         self.print_curr_lives(self.players_lives)
 
-        player_life = int(lives[self.player_id - 1])
+        player_life = self.players_lives[self.player_id - 1]
         if player_life <= 0:
             self.print_red("You died :(\n")
             self.is_alive = 0
 
-        # Pass Message to next
-        decoded_message["from_player_id"] = self.player_id
-        decoded_message["to_player_id"] = self.next_player_id
-
     def handle_winner(self, decoded_message):
-        winner = int(decoded_message["data"])
+        winner = decoded_message["data"]
+        self.winner_id = winner
 
         if winner == self.player_id:
             self.print_green("You won! :)")
@@ -493,148 +880,295 @@ class Game:
         decoded_message["to_player_id"] = self.next_player_id
         self.pass_message(decoded_message)
 
-    ####################### START GAME #######################
+    ####################### DISPATCH #######################
 
-    def start(self):
-        net = self.network
-        while True:
-            if self.is_dealer():
-                self.print_orange("===========YOU ARE THE DEALER===========")
-                hands = self.split_cards()
-
-                # Deal Cards
-                last_to_player_id = self.player_id
-                for hand in hands:
-                    to_player_id = self.next_player(last_to_player_id)
-                    # To player is not alive
-                    while not self.players_alive[to_player_id - 1]:
-                        to_player_id = self.next_player(to_player_id)
-
-                    last_to_player_id = to_player_id
-
-                    message = self.encode_message(
-                        self.player_id,
-                        to_player_id,
-                        Actions.DEAL_CARDS,
-                        hand,
-                    )
-                    net.send_message(message)
-                    message = self.receive_decoded_message()
-                    if (
-                        message["to_player_id"] == self.player_id
-                        and message["action"] == Actions.DEAL_CARDS
-                    ):
-                        self.handle_deal_cards(message)
-
-                # Ask bets
-                message = self.encode_message(
-                    self.player_id,
-                    self.next_player_id,
-                    Actions.ASK_BET,
-                    "",
-                )
-                self.network.send_message(message)
-                decoded_message = self.receive_decoded_message()
+    def is_addressed(self, decoded_message):
+        action = decoded_message["action"]
 
-                if decoded_message["action"] == Actions.ASK_BET:
-                    self.handle_ask_bet(decoded_message)
-                else:
-                    print("Game flow was broken")
-                    exit(1)
+        # Dealer sees its own deal frames when they complete the lap
+        if action == Actions.DEAL_CARDS and self.is_dealer():
+            return True
 
-                # Show bets
-                message = self.encode_message(
-                    self.player_id,
+        # Every player picks its hand out of the one dealing frame
+        if action == Actions.DEAL_HANDS:
+            return self.is_alive
+
+        return (
+            decoded_message["to_player_id"] == self.player_id and self.is_alive
+        ) or action == Actions.WINNER
+
+    def forward_message(self, decoded_message):
+        if not self.is_alive and decoded_message["to_player_id"] == self.player_id:
+            decoded_message["to_player_id"] = self.next_player_id
+        self.pass_message(decoded_message)
+        if self.metrics:
+            self.metrics.forwarded(decoded_message["action"])
+
+    # Returns False once the game is over
+    def handle_message(self, decoded_message):
+        if not self.is_addressed(decoded_message):
+            self.forward_message(decoded_message)
+            return True
+
+        if self.checkpointer:
+            self.checkpointer.handle()
+
+        if not self.metrics:
+            running = self.dispatch_message(decoded_message)
+        else:
+            start = time.perf_counter()
+            running = self.dispatch_message(decoded_message)
+            self.metrics.handled(
+                decoded_message["action"], time.perf_counter() - start
+            )
+
+        if self.checkpointer:
+            self.checkpointer.handled(running)
+        # The token is on its way, spectators are sent what the handler saw
+        if self.spectators:
+            self.spectators.flush()
+        return running
+
+    def dispatch_message(self, decoded_message):
+        action = decoded_message["action"]
+
+        handled_key = (
+            action,
+            decoded_message["from_player_id"],
+            bytes(decoded_message["payload"]),
+            bytes(decoded_message["piggyback"]),
+        )
+        if (
+            handled_key == self.last_handled
+            and decoded_message["epoch"] != self.last_handled_epoch
+        ):
+            # Regenerated copy of a frame already handled, answer as before
+            self.network.resend_last()
+            return True
+        self.last_handled = handled_key
+        self.last_handled_epoch = decoded_message["epoch"]
+
+        decoded_message["data"] = decode_payload(action, decoded_message["payload"])
+
+        # Results ride on the new dealer lap, splice once it has been passed on.
+        # Eliminated players only see the WINNER frame and skip its sections.
+        results = self.is_alive and self.handle_piggyback(decoded_message["piggyback"])
+
+        handler = self.handlers[action.value]
+        if not handler:
+            raise RingError(f"Message with unknown action {action.name}")
+        return handler(decoded_message, results)
+
+    ####################### DISPATCH TABLE #######################
+
+    # Handlers get the frame and whether it carried results that were applied,
+    # and return False once the game is over
+
+    def on_new_dealer(self, decoded_message, results):
+        self.handle_new_dealer(decoded_message)
+        return self.splice_ring() if results else True
+
+    def on_info_new_dealer(self, decoded_message, results):
+        if self.is_dealer():
+            # Start another game
+            self.start_great_round()
+            return True
+
+        self.handle_info_new_dealer(decoded_message)
+        return self.pass_on(decoded_message, results)
+
+    def on_deal_cards(self, decoded_message, results):
+        if self.is_dealer():
+            self.handle_dealt_cards(decoded_message)
+            return True
+
+        self.handle_deal_cards(decoded_message)
+        return self.pass_on(decoded_message, results)
+
+    def on_deal_hands(self, decoded_message, results):
+        if self.is_dealer():
+            self.handle_dealt_hands(decoded_message)
+            return True
+
+        self.handle_deal_hands(decoded_message)
+        return self.pass_on(decoded_message, results)
+
+    def on_ask_bet(self, decoded_message, results):
+        self.handle_ask_bet(decoded_message)
+        if self.is_dealer():
+            if self.piggyback:
+                # Bets are shown as the first trick goes around
+                self.ask_card_action(
                     self.next_player_id,
-                    Actions.SHOW_BETS,
-                    self.players_bets,
+                    self.encode_piggyback([(Actions.SHOW_BETS, self.players_bets)]),
                 )
-                self.network.send_message(message)
+            else:
+                self.show_bets_action()
+        return True
 
-                decoded_message = self.receive_decoded_message()
-
-                if decoded_message["action"] == Actions.SHOW_BETS:
-                    self.handle_show_bets(decoded_message)
-                else:
-                    print("Game flow was broken")
-                    exit(1)
-
-                self.ask_card_action(self.next_player_id)
-
-            # Round loop
-            while True:
-                decoded_message = self.receive_decoded_message()
-                action = decoded_message["action"]
-
-                if (
-                    decoded_message["to_player_id"] == self.player_id and self.is_alive
-                ) or action == Actions.WINNER:
-                    # print(
-                    #     f"Player on port {self.network.player_port} received: {decoded_message}"
-                    # )
-
-                    match action:
-                        case Actions.NEW_DEALER:
-                            self.handle_new_dealer()
-                            continue
-                        case Actions.INFO_NEW_DEALER:
-                            if not self.is_dealer():
-                                self.handle_info_new_dealer(decoded_message)
-                            else:
-                                # Start another game
-                                break
-                        case Actions.DEAL_CARDS:
-                            self.handle_deal_cards(decoded_message)
-
-                        case Actions.ASK_BET:
-                            self.handle_ask_bet(decoded_message)
-                            continue
-
-                        case Actions.SHOW_BETS:
-                            if not self.is_dealer():
-                                self.handle_show_bets(decoded_message)
-                            else:
-                                continue
-
-                        case Actions.ASK_CARD:
-                            self.handle_ask_card(decoded_message)
-                            continue
-
-                        case Actions.RETURN_CARDS:
-                            if self.is_dealer():
-                                self.handle_return_cards(decoded_message)
-                                continue
-
-                        case Actions.SHOW_ROUND_RESULT:
-                            if not self.is_dealer():
-                                self.handle_show_round_result(decoded_message)
-                            else:
-                                if self.curr_round == CARDS_PER_HAND:
-                                    self.finish_great_round()
-                                else:
-                                    # New round
-                                    self.ask_card_action(self.last_win_player_id)
-                                    self.curr_round += 1
-                                continue
-
-                        case Actions.SHOW_RESULTS:
-                            self.handle_show_results(decoded_message)
-                            if self.is_dealer():
-                                if self.verify_winners():
-                                    continue
-
-                                self.new_dealer_action(decoded_message["data"])
-                                continue
-                        case Actions.WINNER:
-                            self.handle_winner(decoded_message)
-                            exit(0)
-
-                        case _:
-                            print("Message with unknown action")
-                            exit(1)
-                elif (
-                    not self.is_alive
-                    and decoded_message["to_player_id"] == self.player_id
-                ):
-                    decoded_message["to_player_id"] = self.next_player_id
-                self.pass_message(decoded_message)
+    def on_show_bets(self, decoded_message, results):
+        self.handle_show_bets(decoded_message)
+        if self.is_dealer():
+            self.ask_card_action(self.next_player_id)
+            return True
+        return self.pass_on(decoded_message, results)
+
+    def on_ask_card(self, decoded_message, results):
+        self.handle_ask_card(decoded_message)
+        return True
+
+    def on_return_cards(self, decoded_message, results):
+        if self.is_dealer():
+            self.handle_return_cards(decoded_message)
+            return True
+        return self.pass_on(decoded_message, results)
+
+    def on_show_round_result(self, decoded_message, results):
+        if not self.is_dealer():
+            self.handle_show_round_result(decoded_message)
+            return self.pass_on(decoded_message, results)
+
+        if self.curr_round == self.cards_per_hand:
+            self.finish_great_round()
+        else:
+            # New round
+            self.curr_round += 1
+            self.ask_card_action(self.last_win_player_id)
+        return True
+
+    def on_show_results(self, decoded_message, results):
+        self.handle_show_results(decoded_message)
+        if self.is_dealer():
+            in_ring = self.splice_ring()
+            if not self.verify_winners():
+                self.new_dealer_action(decoded_message["data"])
+            return in_ring
+
+        # Splice only after passing, the next player may have just died and
+        # still needs to learn it
+        self.pass_message(decoded_message)
+        return self.splice_ring()
+
+    def on_winner(self, decoded_message, results):
+        self.handle_winner(decoded_message)
+        return False
+
+    # Passes the frame on, leaving the ring once the results it carried are
+    # applied
+    def pass_on(self, decoded_message, results):
+        self.pass_message(decoded_message)
+        return self.splice_ring() if results else True
+
+    # Display phases carried by another frame, returns True when results were
+    # applied
+    def handle_piggyback(self, piggyback):
+        results = False
+        for action, payload in decode_sections(piggyback):
+            key = (action, bytes(payload))
+            if key in self.piggyback_seen:
+                continue
+            self.piggyback_seen.add(key)
+
+            data = decode_payload(action, payload)
+            match action:
+                case Actions.SHOW_BETS:
+                    self.print_bets(data)
+                case Actions.SHOW_ROUND_RESULT:
+                    self.apply_wins(data)
+                case Actions.SHOW_RESULTS:
+                    self.apply_results(data)
+                    results = True
+                case Actions.TURN_EXPIRED:
+                    self.expired_reported(data)
+                case _:
+                    raise RingError(f"Action {action.name} cannot be piggybacked")
+        return results
+
+    # Eliminated players are routed around once the game goes on without them,
+    # returns False when this node has left the ring
+    def splice_ring(self):
+        if (
+            not self.splice_dead
+            or not self.network.can_splice()
+            or self.number_players_alive() <= 1
+        ):
+            return True
+
+        next_player_id = self.next_alive_player(self.player_id)
+        if next_player_id != self.next_player_id:
+            self.next_player_id = next_player_id
+            self.network.set_next_player(next_player_id)
+
+        if not self.is_alive:
+            self.print_red("You left the ring")
+        return self.is_alive
+
+    # Dealer regenerates first, then each successor one timeout later
+    def handle_token_lost(self, timeouts):
+        distance = (self.player_id - self.dealer_id) % self.num_players
+
+        # Nodes measuring a short lap time out more often than a dealer
+        # measuring a long one, so giving up goes by time and not by count
+        silence = time.monotonic() - self.network.waiting_since
+        if timeouts > distance and silence >= TOKEN_RECOVERY_PATIENCE:
+            raise RingError("Token could not be recovered, the ring is down")
+
+        # The ring went on while a resumed node was down, the frame it sent
+        # before crashing is stale and the node that sent the lost one resends
+        if self.resumed and not self.network.last_receive_at:
+            return
+
+        if timeouts > distance and self.network.regenerate_token():
+            self.print_red(f"Token lost, regenerated it with epoch {self.network.epoch}")
+
+    ####################### START GAME #######################
+
+    # The first frame waits for the startup barrier, a resumed node rejoins a
+    # ring that is already up
+    def bootstrap(self):
+        start = time.perf_counter()
+        lap = self.network.bootstrap(self.is_dealer())
+        elapsed = time.perf_counter() - start
+        if self.metrics:
+            self.metrics.bootstrapped(elapsed, self.network.hop_rtt)
+        if lap:
+            _, count, slowest_player_id, slowest_us, total_us = lap
+            self.print_orange(
+                f"Ring of {count} ready in {elapsed * 1e3:.1f} ms, hop round trip "
+                f"{total_us / count / 1e3:.3f} ms on average, "
+                f"{slowest_us / 1e3:.3f} ms from player {slowest_player_id}"
+            )
+
+    # Blocking loop over the network, owns the process
+    def start(self):
+        try:
+            if self.network.startup_timeout and not self.resumed:
+                self.bootstrap()
+            if self.is_dealer() and not self.resumed:
+                if self.checkpointer:
+                    self.checkpointer.handle()
+                self.start_great_round()
+
+            while self.handle_message(self.receive_decoded_message()):
+                pass
+        except (RingError, BootstrapError) as error:
+            print(error)
+            exit(1)
+
+        self.network.flush()
+        exit(0)
+
+    ####################### SANS-IO #######################
+
+    # The game on an Outbox is stepped by the caller, which owns the sockets
+    # and the process. Both return the (player id, frame) pairs sent.
+
+    def on_start(self):
+        if self.is_dealer():
+            self.start_great_round()
+        return self.network.drain()
+
+    def on_frame(self, frame):
+        self.network.has_token = 1
+        self.running = self.handle_message(self.decode_message(frame))
+        return self.network.drain()
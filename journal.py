@@ -0,0 +1,471 @@
+import argparse
+import math
+import struct
+import threading
+import time
+from collections import deque
+
+from game import Game, TurnExpired
+from protocol import (
+    HEADER_SIZE,
+    MAX_EPOCH,
+    MAX_SEQ,
+    SEQ,
+    SEQ_OFFSET,
+    decode_frame,
+    frame_epoch,
+    restamp_epoch,
+)
+from simulation import silent
+from strategies import Strategy
+
+JOURNAL_MAGIC = b"RJNL"
+JOURNAL_VERSION = 1
+
+# magic, version, player id, number of players, cards per hand, lives,
+# table id, flags, unix start time
+JOURNAL_HEADER = struct.Struct("!4sBHHBHHBd")
+# kind, microseconds since the previous record, payload length
+RECORD = struct.Struct("!BIH")
+SEED = struct.Struct("!Q")
+DECISION = struct.Struct("!H")
+
+MAX_DELTA_US = 0xFFFFFFFF
+
+# Record kinds
+SENT = 0
+RECEIVED = 1
+DEAL_SEED = 2
+PLAYER_DECISION = 3  # bet, or index of the card played
+TOKEN_REGENERATED = 4
+TURN_EXPIRED = 5  # the decision after it is the default move
+
+KIND_NAMES = {
+    SENT: "SENT",
+    RECEIVED: "RECEIVED",
+    DEAL_SEED: "DEAL_SEED",
+    PLAYER_DECISION: "DECISION",
+    TOKEN_REGENERATED: "REGENERATED",
+    TURN_EXPIRED: "EXPIRED",
+}
+
+# Header flags
+PIGGYBACK = 1
+DEAL_PER_HAND = 2
+SPLICE_DEAD = 4
+
+# The sequence number is per-node bookkeeping, replayed frames may number
+# their sends differently when the live node forwarded concurrently
+SEQ_END = SEQ_OFFSET + SEQ.size
+
+
+# Append-only record of one node: frames sent and received, deal seeds and the
+# player's decisions. Every record is flushed, so a crashed node leaves a
+# journal that ends at its last frame.
+class Journal:
+    file = None
+    last_record_at = 0.0
+    lock: threading.Lock = None
+
+    def __init__(self, path, game):
+        self.lock = threading.Lock()
+        # One journal per file, an existing journal is never overwritten
+        self.file = open(path, "xb")
+
+        flags = (
+            (PIGGYBACK if game.piggyback else 0)
+            | (DEAL_PER_HAND if game.deal_per_hand else 0)
+            | (SPLICE_DEAD if game.splice_dead and game.network.can_splice() else 0)
+        )
+        self.file.write(
+            JOURNAL_HEADER.pack(
+                JOURNAL_MAGIC,
+                JOURNAL_VERSION,
+                game.player_id,
+                game.num_players,
+                game.cards_per_hand,
+                game.num_lives,
+                game.table_id,
+                flags,
+                time.time(),
+            )
+        )
+        self.file.flush()
+        self.last_record_at = time.perf_counter()
+
+    def close(self):
+        self.file.close()
+
+    def write(self, kind, payload=b""):
+        with self.lock:
+            now = time.perf_counter()
+            delta = min(MAX_DELTA_US, int((now - self.last_record_at) * 1e6))
+            self.last_record_at = now
+
+            self.file.write(RECORD.pack(kind, delta, len(payload)) + payload)
+            self.file.flush()
+
+    def sent(self, frame):
+        self.write(SENT, frame)
+
+    def received(self, frame):
+        self.write(RECEIVED, frame)
+
+    def seed(self, seed):
+        self.write(DEAL_SEED, SEED.pack(seed))
+
+    def decision(self, value):
+        self.write(PLAYER_DECISION, DECISION.pack(value))
+
+    def regenerated(self):
+        self.write(TOKEN_REGENERATED)
+
+    def turn_expired(self):
+        self.write(TURN_EXPIRED)
+
+    # Attaches the journal to a game and its network
+    @classmethod
+    def record(cls, path, game):
+        journal = cls(path, game)
+        game.journal = journal
+        game.network.journal = journal
+        return journal
+
+
+class JournalHeader:
+    player_id = 0
+    num_players = 0
+    cards_per_hand = 0
+    num_lives = 0
+    table_id = 0
+    flags = 0
+    started_at = 0.0
+
+
+# Returns the header and a list of (kind, seconds since start, payload), a
+# journal cut short by a crash ends at its last whole record
+def read_journal(path):
+    with open(path, "rb") as file:
+        raw = file.read()
+
+    if len(raw) < JOURNAL_HEADER.size:
+        raise ValueError(f"{path}: too short to be a journal")
+
+    header = JournalHeader()
+    (
+        magic,
+        version,
+        header.player_id,
+        header.num_players,
+        header.cards_per_hand,
+        header.num_lives,
+        header.table_id,
+        header.flags,
+        header.started_at,
+    ) = JOURNAL_HEADER.unpack_from(raw)
+
+    if magic != JOURNAL_MAGIC:
+        raise ValueError(f"{path}: not a journal")
+    if version != JOURNAL_VERSION:
+        raise ValueError(f"{path}: unsupported journal version {version}")
+
+    records = []
+    offset = JOURNAL_HEADER.size
+    elapsed = 0.0
+    while offset + RECORD.size <= len(raw):
+        kind, delta, length = RECORD.unpack_from(raw, offset)
+        offset += RECORD.size
+        if offset + length > len(raw):
+            break
+
+        elapsed += delta / 1e6
+        records.append((kind, elapsed, raw[offset : offset + length]))
+        offset += length
+
+    return header, records
+
+
+########################### REPLAY ###########################
+
+
+# The live node was still waiting on something when its journal ended
+class JournalExhausted(Exception):
+    pass
+
+
+# Plays back the decisions recorded by the live player, a turn that ran out
+# runs out again and the recorded default move is made in its place
+class ReplayStrategy(Strategy):
+    decisions: deque = None  # (decision, expired)
+    expiring = False
+
+    def __init__(self, decisions):
+        self.decisions = deque(decisions)
+
+    def next_decision(self):
+        if not self.decisions:
+            raise JournalExhausted("Journal has no more player decisions")
+        decision, expired = self.decisions[0]
+        if expired and not self.expiring:
+            self.expiring = True
+            raise TurnExpired()
+        self.expiring = False
+        self.decisions.popleft()
+        return decision
+
+    def choose_bet(self, game, bets):
+        return self.next_decision()
+
+    def choose_card(self, game, played_cards):
+        return self.next_decision()
+
+
+# Hands out the recorded dealer seeds in place of game.rng
+class ReplaySeeds:
+    seeds: deque = None
+
+    def __init__(self, seeds):
+        self.seeds = deque(seeds)
+
+    def getrandbits(self, bits):
+        if not self.seeds:
+            raise JournalExhausted("Journal has no more dealer seeds")
+        return self.seeds.popleft()
+
+
+# Collects what the replayed game sends instead of putting it on a socket
+class ReplayNetwork:
+    has_token = 0
+    seq = 0
+    epoch = 0
+    last_sent = None
+    on_token_lost = None
+
+    def __init__(self, player_id, next_player_id):
+        self.player_id = player_id
+        self.next_player_id = next_player_id
+        self.sent = deque()
+
+    def next_seq(self):
+        self.seq = (self.seq + 1) & MAX_SEQ
+        return self.seq
+
+    def can_splice(self):
+        return True
+
+    def set_next_player(self, player_id):
+        self.next_player_id = player_id
+
+    def send_message(self, message):
+        if not self.has_token:
+            raise RuntimeError(f"Player {self.player_id} sent without the token")
+
+        self.has_token = 0
+        self.last_sent = message
+        self.sent.append(message)
+
+    def resend_last(self):
+        self.send_message(restamp_epoch(self.last_sent, self.epoch))
+
+
+def without_seq(frame):
+    return frame[:SEQ_OFFSET] + frame[SEQ_END:]
+
+
+class ReplayResult:
+    frames = 0
+    divergences: list = None  # (record index or None, frame) not matched
+    recorded_seconds = 0.0
+    replay_seconds = 0.0
+    winner = 0
+    finished = False
+
+    def __init__(self):
+        self.divergences = []
+
+
+# Feeds every received frame of a journal through the Game handlers and checks
+# that the replayed node sends what the live node sent
+def replay(path, deal_secret=None, output=silent, verify=True):
+    header, records = read_journal(path)
+
+    seeds = [SEED.unpack(p)[0] for kind, _, p in records if kind == DEAL_SEED]
+    decisions = []
+    expired = False
+    for kind, _, payload in records:
+        if kind == TURN_EXPIRED:
+            expired = True
+        elif kind == PLAYER_DECISION:
+            decisions.append((DECISION.unpack(payload)[0], expired))
+            expired = False
+
+    network = ReplayNetwork(
+        header.player_id, header.player_id % header.num_players + 1
+    )
+    game = Game(
+        header.player_id,
+        network,
+        strategy=ReplayStrategy(decisions),
+        rng=ReplaySeeds(seeds),
+        output=output,
+        cards_per_hand=header.cards_per_hand,
+        num_lives=header.num_lives,
+        table_id=header.table_id,
+        num_players=header.num_players,
+        piggyback=bool(header.flags & PIGGYBACK),
+        deal_per_hand=bool(header.flags & DEAL_PER_HAND),
+        deal_secret=deal_secret,
+    )
+    game.splice_dead = bool(header.flags & SPLICE_DEAD)
+    if any(expired for _, expired in decisions):
+        # Only the replayed strategy decides when a turn runs out
+        game.turn_timeout = math.inf
+        game.default_strategy = game.strategy
+
+    result = ReplayResult()
+    start = time.perf_counter()
+
+    running = True
+    skip_sent = 0
+    try:
+        if game.is_dealer():
+            game.start_great_round()
+    except JournalExhausted:
+        running = False
+
+    for index, (kind, _, payload) in enumerate(records):
+        if kind == RECEIVED and running:
+            network.has_token = 1
+            network.epoch = frame_epoch(payload)
+            try:
+                running = game.handle_message(game.decode_message(payload))
+            except JournalExhausted:
+                running = False
+            result.frames += 1
+
+        elif kind == TOKEN_REGENERATED:
+            # The reissued frame came from a timeout, not from a handler
+            network.epoch = (network.epoch + 1) & MAX_EPOCH
+            skip_sent += 1
+
+        elif kind == SENT and verify:
+            if skip_sent:
+                skip_sent -= 1
+                continue
+
+            expected = without_seq(payload)
+            for i, frame in enumerate(network.sent):
+                if without_seq(frame) == expected:
+                    del network.sent[i]
+                    break
+            else:
+                result.divergences.append((index, payload))
+
+    result.replay_seconds = time.perf_counter() - start
+    result.recorded_seconds = records[-1][1] if records else 0.0
+    result.winner = game.winner_id
+    result.finished = bool(game.winner_id) or not game.is_alive
+    if verify:
+        result.divergences += [(None, frame) for frame in network.sent]
+    return result
+
+
+def describe_frame(frame):
+    if len(frame) < HEADER_SIZE:
+        return frame.hex()
+    decoded = decode_frame(frame)
+    return (
+        f"{decoded['action'].name} {decoded['from_player_id']}->"
+        f"{decoded['to_player_id']} seq={decoded['seq']} epoch={decoded['epoch']} "
+        f"{decoded['data']}"
+    )
+
+
+def dump(path):
+    header, records = read_journal(path)
+    print(
+        f"Player {header.player_id} of {header.num_players}, table "
+        f"{header.table_id}, {header.cards_per_hand} cards per hand, "
+        f"{header.num_lives} lives, flags {header.flags:#x}, "
+        f"started {time.ctime(header.started_at)}"
+    )
+    for kind, at, payload in records:
+        if kind in (SENT, RECEIVED):
+            detail = describe_frame(payload)
+        elif kind == DEAL_SEED:
+            detail = SEED.unpack(payload)[0]
+        elif kind == PLAYER_DECISION:
+            detail = DECISION.unpack(payload)[0]
+        else:
+            detail = ""
+        print(f"{at:12.6f} {KIND_NAMES.get(kind, kind):<11} {detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Game journal tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    dump_parser = commands.add_parser("dump", help="Print every record")
+    dump_parser.add_argument("journal")
+
+    replay_parser = commands.add_parser(
+        "replay", help="Run a journal through the game handlers"
+    )
+    replay_parser.add_argument("journal")
+    replay_parser.add_argument(
+        "--repeat", type=int, default=1, help="Replays, for benchmarking"
+    )
+    replay_parser.add_argument(
+        "--deal-secret", type=str, help="Deal secret the live ring used"
+    )
+    replay_parser.add_argument(
+        "--verbose", action="store_true", help="Show the game output"
+    )
+    replay_parser.add_argument(
+        "--no-verify", action="store_true", help="Skip comparing the sent frames"
+    )
+    args = parser.parse_args()
+
+    try:
+        if args.command == "dump":
+            dump(args.journal)
+            return
+
+        deal_secret = args.deal_secret.encode() if args.deal_secret else None
+        elapsed = 0.0
+        for _ in range(args.repeat):
+            result = replay(
+                args.journal,
+                deal_secret,
+                print if args.verbose else silent,
+                not args.no_verify,
+            )
+            elapsed += result.replay_seconds
+    except (OSError, ValueError) as error:
+        print(error)
+        exit(1)
+
+    print(
+        f"Replayed {result.frames} frames in {elapsed / args.repeat * 1e3:.2f} ms "
+        f"({result.frames * args.repeat / elapsed:.0f} frames/s), recorded over "
+        f"{result.recorded_seconds:.2f}s "
+        f"({result.recorded_seconds * args.repeat / elapsed:.0f}x real time)"
+    )
+    if result.winner:
+        print(f"Game finished, player {result.winner} won")
+    elif result.finished:
+        print("Player left the ring")
+    else:
+        print("Journal ends before the game does")
+
+    for index, frame in result.divergences:
+        if index is None:
+            print(f"Replay sent an unrecorded frame: {describe_frame(frame)}")
+        else:
+            print(f"Record {index} was not sent by the replay: {describe_frame(frame)}")
+    if result.divergences:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,463 @@
+import argparse
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bench_ring import percentile
+from game import Game, RingError
+from metrics import Metrics
+from network import Network
+from reliable_network import ReliableNetwork
+from settings import NUM_PLAYERS, TOKEN_TIMEOUT_LAPS
+from simulation import silent
+from spectator import Broadcaster, parse_address
+from strategies import STRATEGIES
+from topology import Topology
+
+LOOPBACK = "127.0.0.1"
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+# Seconds between checks that the spawned nodes are still running
+EXIT_POLL_INTERVAL = 0.01
+
+
+# Ports the kernel hands out on loopback, all held until the last is picked so
+# none repeats
+def free_ports(count):
+    socks = []
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((LOOPBACK, 0))
+        socks.append(sock)
+
+    ports = [sock.getsockname()[1] for sock in socks]
+    for sock in socks:
+        sock.close()
+    return ports
+
+
+def loopback_ring(num_players):
+    return Topology(
+        (player_id, LOOPBACK, port)
+        for player_id, port in enumerate(free_ports(num_players), start=1)
+    )
+
+
+# Outcome of one game. A stalled game did not finish in time, a failed one had
+# every node exit without a winner. Process rings count their startup.
+class GameResult:
+    finished = False
+    stalled = False
+    winner_id = 0
+    seconds = 0.0
+    frames = 0
+    detail = ""
+
+
+########################### THREADS ###########################
+
+
+# strategies names the strategy of every seat
+def play_threads(args, topology, seed, strategies):
+    rng = random.Random(seed)
+    network_class = ReliableNetwork if args.reliable else Network
+
+    # Every node is bound once its Network exists, the dealer can start at once
+    nodes = []
+    for player_id in range(1, topology.num_players + 1):
+        network = network_class(
+            player_id,
+            None,
+            None,
+            token_timeout_laps=args.token_timeout_laps,
+            topology=topology,
+        )
+        strategy = STRATEGIES[strategies[player_id - 1]]()
+        strategy.rng = random.Random(rng.getrandbits(64))
+        game = Game(
+            player_id,
+            network,
+            strategy=strategy,
+            rng=random.Random(rng.getrandbits(64)),
+            output=silent,
+            num_players=topology.num_players,
+            piggyback=args.piggyback,
+        )
+        game.metrics = network.metrics = Metrics(player_id)
+        if args.spectators:
+            Broadcaster.publish(parse_address(args.spectators), game)
+        nodes.append(game)
+
+    errors = {}
+    threads = [
+        threading.Thread(target=thread_node, args=(game, errors), daemon=True)
+        for game in nodes
+    ]
+    result = GameResult()
+    start = time.perf_counter()
+    try:
+        for thread in reversed(threads):
+            thread.start()
+        for thread in threads:
+            thread.join(max(0.0, start + args.stall_timeout - time.perf_counter()))
+        result.seconds = time.perf_counter() - start
+        result.frames = sum(sum(game.metrics.frames_received) for game in nodes)
+        result.stalled = any(thread.is_alive() for thread in threads)
+        failure = ""
+        if errors:
+            player_id = min(errors)
+            failure = f"player {player_id} failed: {errors[player_id]}"
+    finally:
+        # Nodes of a stalled ring wake up to their closed socket and exit
+        for game in nodes:
+            game.network.close()
+            if game.spectators:
+                game.spectators.close()
+
+    if result.stalled:
+        result.detail = "no winner within --stall-timeout"
+        if failure:
+            result.detail += f", {failure}"
+        return result
+
+    result.winner_id = max(game.winner_id for game in nodes)
+    result.finished = not errors and bool(result.winner_id)
+    if failure:
+        result.detail = failure
+    elif not result.finished:
+        result.detail = "every node exited without a winner"
+    return result
+
+
+# A node that gives the ring up fails the game like a process exiting with an
+# error, one woken by the socket of a stalled ring closing under it exits too
+def thread_node(game, errors):
+    try:
+        if game.is_dealer():
+            game.start_great_round()
+        while game.handle_message(game.receive_decoded_message()):
+            pass
+        game.network.flush()
+    except (RingError, OSError) as error:
+        errors[game.player_id] = error
+
+
+########################## PROCESSES ##########################
+
+
+def play_processes(args, topology, seed, strategies, workdir):
+    ring = [
+        f"{player_id}:{host}:{port}"
+        for player_id, (host, port) in topology.nodes.items()
+    ]
+    command = [
+        sys.executable,
+        MAIN,
+        "--ring",
+        *ring,
+        "--seed",
+        str(seed),
+        "--quiet",
+        "--token-timeout-laps",
+        str(args.token_timeout_laps),
+        "--startup-timeout",
+        str(args.startup_timeout),
+        # Written once, when the node exits
+        "--metrics-interval",
+        str(24 * 3600),
+    ]
+    if args.reliable:
+        command.append("--reliable")
+    if args.piggyback:
+        command.append("--piggyback")
+    if args.spectators:
+        command += ["--spectators", args.spectators]
+
+    processes = {}
+    result = GameResult()
+    start = time.perf_counter()
+    try:
+        # The startup barrier holds the first deal until the ring is up
+        for player_id in range(1, topology.num_players + 1):
+            processes[player_id] = spawn_node(
+                command, player_id, strategies[player_id - 1], workdir
+            )
+
+        # The rest of the ring would wait on a node that exited with an error
+        deadline = start + args.stall_timeout
+        while True:
+            codes = [process.poll() for process in processes.values()]
+            if None not in codes or any(codes):
+                break
+            if time.perf_counter() > deadline:
+                result.stalled = True
+                break
+            time.sleep(EXIT_POLL_INTERVAL)
+    finally:
+        killed = set()
+        for player_id, process in processes.items():
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+                killed.add(player_id)
+    result.seconds = time.perf_counter() - start
+
+    for player_id in processes:
+        result.frames += read_frames(metrics_path(workdir, player_id))
+        result.winner_id = max(
+            result.winner_id, read_winner(result_path(workdir, player_id))
+        )
+
+    if result.stalled:
+        result.detail = "no winner within --stall-timeout, nodes killed"
+        return result
+
+    failed = [
+        p
+        for p, process in processes.items()
+        if process.returncode != 0 and p not in killed
+    ]
+    result.finished = not killed and not failed and bool(result.winner_id)
+    if failed:
+        player_id = failed[0]
+        result.detail = (
+            f"player {player_id} exited with {processes[player_id].returncode}"
+        )
+        last_error = read_last_line(error_path(workdir, player_id))
+        if last_error:
+            result.detail += f": {last_error}"
+    elif not result.finished:
+        result.detail = "every node exited without a winner"
+    return result
+
+
+def spawn_node(command, player_id, strategy, workdir):
+    metrics = metrics_path(workdir, player_id)
+    results = result_path(workdir, player_id)
+    for path in (metrics, results):
+        if os.path.exists(path):
+            os.remove(path)
+
+    with open(error_path(workdir, player_id), "w") as errors:
+        return subprocess.Popen(
+            [
+                *command,
+                "-n",
+                str(player_id),
+                "--strategy",
+                strategy,
+                "--metrics-file",
+                metrics,
+                "--result-file",
+                results,
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=errors,
+        )
+
+
+def metrics_path(workdir, player_id):
+    return os.path.join(workdir, f"node{player_id}.prom")
+
+
+def error_path(workdir, player_id):
+    return os.path.join(workdir, f"node{player_id}.err")
+
+
+def result_path(workdir, player_id):
+    return os.path.join(workdir, f"node{player_id}.result")
+
+
+def read_frames(path):
+    if not os.path.exists(path):
+        return 0
+    frames = 0
+    with open(path) as file:
+        for line in file:
+            if line.startswith("ring_frames_received_total{"):
+                frames += int(line.rsplit(" ", 1)[1])
+    return frames
+
+
+def read_winner(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as file:
+        return int(file.read().strip() or 0)
+
+
+def read_last_line(path):
+    with open(path) as file:
+        lines = file.read().strip().splitlines()
+    return lines[-1] if lines else ""
+
+
+############################ SOAK ############################
+
+
+class SoakStats:
+    games = 0
+    stalled = 0
+    failed = 0
+    frames = 0
+    playing = 0.0  # seconds spent in games that finished
+    game_seconds: list[float]
+
+    def __init__(self):
+        self.game_seconds = []
+
+    def add(self, result):
+        self.frames += result.frames
+        if result.stalled:
+            self.stalled += 1
+        elif not result.finished:
+            self.failed += 1
+        else:
+            self.games += 1
+            self.playing += result.seconds
+            self.game_seconds.append(result.seconds)
+
+    def summary(self, wall):
+        seconds = self.game_seconds
+        return (
+            f"{self.games} games, {self.stalled} stalled, {self.failed} failed in "
+            f"{wall:.1f}s: {self.games / wall:.2f} games/s, "
+            f"{self.frames / wall:.0f} frames/s overall, "
+            f"{self.frames / self.playing if self.playing else 0.0:.0f} frames/s "
+            f"playing, game {percentile(seconds, 0.50) * 1e3:.1f} ms p50, "
+            f"{percentile(seconds, 0.99) * 1e3:.1f} ms p99, "
+            f"{max(seconds, default=0.0) * 1e3:.1f} ms max"
+        )
+
+
+def soak(args, workdir):
+    rng = random.Random(args.seed)
+    stats = SoakStats()
+    start = time.perf_counter()
+    next_report = start + args.report_interval
+    game_index = 0
+
+    try:
+        while not args.games or game_index < args.games:
+            if args.duration and time.perf_counter() - start >= args.duration:
+                break
+
+            seed = rng.getrandbits(32)
+            topology = loopback_ring(args.players)
+            strategies = [args.strategy] * args.players
+            if args.processes:
+                result = play_processes(args, topology, seed, strategies, workdir)
+            else:
+                result = play_threads(args, topology, seed, strategies)
+            stats.add(result)
+
+            if result.detail:
+                print(
+                    f"Game {game_index} (seed {seed}) "
+                    f"{'stalled' if result.stalled else 'failed'} after "
+                    f"{result.seconds:.1f}s: {result.detail}"
+                )
+            game_index += 1
+
+            now = time.perf_counter()
+            if args.report_interval and now >= next_report:
+                print(stats.summary(now - start))
+                next_report = now + args.report_interval
+    except KeyboardInterrupt:
+        pass
+
+    return stats, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run whole rings of bot players on loopback"
+    )
+    parser.add_argument("-p", "--players", type=int, default=NUM_PLAYERS)
+    parser.add_argument(
+        "-g", "--games", type=int, default=1, help="Games to play, 0 for no limit"
+    )
+    parser.add_argument(
+        "-d",
+        "--duration",
+        type=float,
+        default=0,
+        help="Stop starting games after this many seconds, 0 for no limit",
+    )
+    parser.add_argument(
+        "-s", "--seed", type=int, default=0, help="Seeds every bot and deal"
+    )
+    parser.add_argument("--strategy", choices=list(STRATEGIES), default="random")
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="Run every node as a main.py process instead of a thread",
+    )
+    parser.add_argument(
+        "--token-timeout-laps",
+        type=float,
+        default=TOKEN_TIMEOUT_LAPS,
+        help="Regenerate a lost token after this many lap times, 0 disables",
+    )
+    parser.add_argument(
+        "--reliable", action="store_true", help="Acknowledge every hop"
+    )
+    parser.add_argument(
+        "--piggyback",
+        action="store_true",
+        help="Carry display phases on the frame of the next phase",
+    )
+    parser.add_argument(
+        "--spectators",
+        type=str,
+        metavar="HOST[:PORT]",
+        help="Every node publishes the great rounds it deals to this address",
+    )
+    parser.add_argument(
+        "--stall-timeout",
+        type=float,
+        default=60,
+        help="Seconds a game may take before it counts as stalled",
+    )
+    parser.add_argument(
+        "--startup-timeout",
+        type=float,
+        default=10,
+        help="Seconds spawned nodes have to bind their ports and bring the ring up",
+    )
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        default=60,
+        help="Seconds between progress reports, 0 for none",
+    )
+    args = parser.parse_args()
+
+    if args.players < 2:
+        parser.error("A ring needs at least 2 players")
+    if args.spectators:
+        try:
+            parse_address(args.spectators)
+        except ValueError as error:
+            parser.error(str(error))
+
+    with tempfile.TemporaryDirectory(prefix="ring-") as workdir:
+        try:
+            stats, wall = soak(args, workdir)
+        except OSError as error:
+            print(error)
+            exit(1)
+
+    print(stats.summary(wall))
+    if stats.stalled or stats.failed:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,28 @@
 import sys
 import argparse
+import atexit
+import asyncio
+import random
+import time
 
+from async_game import AsyncGame
+from async_network import AsyncNetwork
+from checkpoint import Checkpointer
 from game import Game
+from journal import Journal
+from metrics import Metrics
 from network import Network
+from reliable_network import ReliableNetwork
+from settings import (
+    METRICS_INTERVAL,
+    STARTUP_TIMEOUT,
+    TOKEN_TIMEOUT_LAPS,
+    TURN_TIMEOUT,
+)
+from simulation import silent
+from spectator import Broadcaster, parse_address
+from strategies import STRATEGIES, TerminalStrategy
+from topology import Topology
 
 
 def main():
@@ -11,23 +31,298 @@ def main():
         "-n", "--player-id", type=int, required=True, help="ID of this player"
     )
     parser.add_argument(
-        "-i", "--player-ip", type=str, required=True, help="IP address of this player"
+        "-i", "--player-ip", type=str, help="IP address of this player"
     )
     parser.add_argument(
         "-o",
         "--next-player-ip",
         type=str,
-        required=True,
         help="IP address of the next player in the game",
     )
+    parser.add_argument(
+        "-t",
+        "--topology",
+        type=str,
+        help="File with one 'ID HOST PORT' line per player, replaces -i/-o",
+    )
+    parser.add_argument(
+        "-r",
+        "--ring",
+        nargs="+",
+        metavar="ID:HOST:PORT",
+        help="Ring entries given on the command line, replaces -i/-o",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Run the node on asyncio, forwarding traffic while waiting for input",
+    )
+    parser.add_argument(
+        "--token-timeout-laps",
+        type=float,
+        default=TOKEN_TIMEOUT_LAPS,
+        help="Regenerate a lost token after this many lap times, 0 disables",
+    )
+    parser.add_argument(
+        "--reliable",
+        action="store_true",
+        help="Acknowledge every hop and resend lost frames, every player must agree",
+    )
+    parser.add_argument(
+        "--startup-timeout",
+        type=float,
+        default=STARTUP_TIMEOUT,
+        help="Seconds the ring has to come up before the first deal, 0 deals "
+        "at once, every player must agree",
+    )
+    parser.add_argument(
+        "--piggyback",
+        action="store_true",
+        help="Carry display phases on the frame of the next phase, "
+        "every player must agree",
+    )
+    parser.add_argument(
+        "--deal-secret",
+        type=str,
+        help="Secret shared by the ring, hides dealt hands from anyone without it",
+    )
+
+    parser.add_argument(
+        "--strategy",
+        choices=list(STRATEGIES),
+        help="Let a bot play this seat instead of reading the terminal",
+    )
+    parser.add_argument(
+        "--seed", type=int, help="Seeds the bot and the deals of this node"
+    )
+    parser.add_argument(
+        "--turn-timeout",
+        type=float,
+        default=TURN_TIMEOUT,
+        help="Seconds per bet or card before a default move is made, 0 waits "
+        "forever",
+    )
+    parser.add_argument(
+        "--default-move",
+        choices=list(STRATEGIES),
+        default="high",
+        help="Strategy making the moves of turns that ran out",
+    )
+    parser.add_argument("--quiet", action="store_true", help="Hide the game output")
+    parser.add_argument(
+        "--result-file",
+        type=str,
+        help="Write the id of the winner here when the node exits, 0 for none",
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        help="Write Prometheus metrics to this file every --metrics-interval",
+    )
+    parser.add_argument(
+        "--metrics-interval", type=float, default=METRICS_INTERVAL, help="Seconds"
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics",
+    )
+
+    parser.add_argument(
+        "--spectators",
+        type=str,
+        metavar="HOST[:PORT]",
+        help="Publish the great rounds this player deals to a broadcast or "
+        "multicast address, spectator.py watches them",
+    )
+
+    parser.add_argument(
+        "--journal",
+        type=str,
+        help="Record frames, deal seeds and decisions to this new file",
+    )
+
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        help="Save the node state to this file at every phase boundary",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Restore the node from --checkpoint and rejoin the ring, the "
+        "frame lost in the crash comes back through --token-timeout-laps",
+    )
 
     args = parser.parse_args()
 
-    network = Network(args.player_id, args.player_ip, args.next_player_ip)
-    game = Game(args.player_id, network)
+    if args.resume and not args.checkpoint:
+        parser.error("--resume needs --checkpoint")
+    if args.resume and not args.token_timeout_laps:
+        parser.error("--resume needs --token-timeout-laps to recover the lost frame")
+    if args.checkpoint and args.use_async:
+        parser.error("--checkpoint needs token recovery, which --async lacks")
+    if args.reliable and args.use_async:
+        parser.error("--reliable is not supported with --async")
+
+    topology = None
+    try:
+        if args.topology:
+            topology = Topology.load(args.topology)
+        elif args.ring:
+            topology = Topology.from_list(args.ring)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+
+    if topology:
+        if args.player_id not in topology.nodes:
+            parser.error(f"Player {args.player_id} is not in the topology")
+    elif not args.player_ip or not args.next_player_ip:
+        parser.error("-i and -o are required without --topology or --ring")
+
+    deal_secret = args.deal_secret.encode() if args.deal_secret else None
+    players = player_options(args)
+
+    if args.use_async:
+        network = AsyncNetwork(
+            args.player_id,
+            args.player_ip,
+            args.next_player_ip,
+            topology=topology,
+            startup_timeout=args.startup_timeout,
+        )
+        game = AsyncGame(
+            args.player_id,
+            network,
+            num_players=network.num_players,
+            piggyback=args.piggyback,
+            deal_secret=deal_secret,
+            **players,
+        )
+        start_metrics(args, game)
+        start_journal(parser, args, game)
+        start_spectators(parser, args, game)
+        start_results(args, game)
+        asyncio.run(game.start())
+        return
+
+    network_class = ReliableNetwork if args.reliable else Network
+    network = network_class(
+        args.player_id,
+        args.player_ip,
+        args.next_player_ip,
+        token_timeout_laps=args.token_timeout_laps,
+        topology=topology,
+        startup_timeout=args.startup_timeout,
+    )
+    game = Game(
+        args.player_id,
+        network,
+        num_players=network.num_players,
+        piggyback=args.piggyback,
+        deal_secret=deal_secret,
+        **players,
+    )
+    start_metrics(args, game)
+    start_journal(parser, args, game)
+    start_spectators(parser, args, game)
+    start_results(args, game)
+    start_checkpoints(parser, args, game)
 
     game.start()
 
 
+# Game options for the seat, a seeded node plays the same decisions and deals
+def player_options(args):
+    options = {"output": silent} if args.quiet else {}
+    rng = None
+    if args.seed is not None:
+        rng = random.Random(f"{args.seed}:{args.player_id}")
+
+    if args.strategy:
+        strategy = STRATEGIES[args.strategy]()
+        if rng:
+            strategy.rng = random.Random(rng.getrandbits(64))
+        options["strategy"] = strategy
+    else:
+        options["strategy"] = TerminalStrategy()
+    if args.turn_timeout:
+        default_strategy = STRATEGIES[args.default_move]()
+        if rng:
+            default_strategy.rng = random.Random(rng.getrandbits(64))
+        options["turn_timeout"] = args.turn_timeout
+        options["default_strategy"] = default_strategy
+    if rng:
+        options["rng"] = random.Random(rng.getrandbits(64))
+    return options
+
+
+def start_checkpoints(parser, args, game):
+    if not args.checkpoint:
+        return
+
+    checkpointer = Checkpointer.attach(args.checkpoint, game)
+    if not args.resume:
+        return
+
+    start = time.perf_counter()
+    try:
+        checkpointer.restore()
+    except (OSError, ValueError) as error:
+        parser.error(f"Cannot resume: {error}")
+    game.print_orange(
+        f"Resumed great round {game.great_rounds}, round {game.curr_round} "
+        f"in {(time.perf_counter() - start) * 1e3:.2f} ms"
+    )
+
+
+def start_journal(parser, args, game):
+    if not args.journal:
+        return
+
+    try:
+        Journal.record(args.journal, game)
+    except OSError as error:
+        parser.error(f"Cannot create journal: {error}")
+
+
+# Game.start ends the process, the winner is written on the way out
+def start_results(args, game):
+    if not args.result_file:
+        return
+
+    def write():
+        with open(args.result_file, "w") as file:
+            file.write(f"{game.winner_id}\n")
+
+    atexit.register(write)
+
+
+def start_spectators(parser, args, game):
+    if not args.spectators:
+        return
+
+    try:
+        Broadcaster.publish(parse_address(args.spectators), game)
+    except (OSError, ValueError) as error:
+        parser.error(f"Cannot publish to spectators: {error}")
+
+
+def start_metrics(args, game):
+    if not args.metrics_file and args.metrics_port is None:
+        return
+
+    metrics = Metrics(args.player_id)
+    game.metrics = metrics
+    game.network.metrics = metrics
+
+    if args.metrics_file:
+        metrics.export_to_file(args.metrics_file, args.metrics_interval)
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port)
+
+
 if __name__ == "__main__":
     main()
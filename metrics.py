@@ -0,0 +1,268 @@
+import atexit
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from protocol import ACTION_OFFSET, ACTIONS_BY_VALUE, Actions
+
+# Upper bounds in seconds, from a loopback hop up to a player thinking
+LATENCY_BUCKETS = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    bounds = LATENCY_BUCKETS
+    counts: list[int]  # per bucket, the last one is +Inf
+    total = 0.0
+    count = 0
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.bounds, "+Inf"), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+# Counters for one node. Every slot is allocated up front and indexed by action
+# value, so recording is a few list increments and exporting from another
+# thread never sees a container change size.
+class Metrics:
+    player_id = 0
+    frames_sent: list[int]
+    frames_received: list[int]
+    frames_forwarded: list[int]
+    frames_handled: list[int]
+    bytes_sent = 0
+    bytes_received = 0
+    token_hold: Histogram = None
+    token_lap: Histogram = None
+    handler_latency: list[Histogram]
+    turns_expired: list[int]  # by action, decisions this player ran out of time on
+    turns_reported = 0  # expired turns of any player reported to this dealer
+    startup_seconds = 0.0
+    hop_rtt = 0.0  # round trip to the successor measured at startup
+
+    received_at = 0.0
+    last_received_at = 0.0
+
+    def __init__(self, player_id=0):
+        self.player_id = player_id
+        num_actions = len(ACTIONS_BY_VALUE)
+        self.frames_sent = [0] * num_actions
+        self.frames_received = [0] * num_actions
+        self.frames_forwarded = [0] * num_actions
+        self.frames_handled = [0] * num_actions
+        self.turns_expired = [0] * num_actions
+        self.token_hold = Histogram()
+        self.token_lap = Histogram()
+        self.handler_latency = [Histogram() for _ in range(num_actions)]
+
+    ######################### RECORDING #########################
+
+    def received(self, frame):
+        now = time.perf_counter()
+        if self.last_received_at:
+            self.token_lap.observe(now - self.last_received_at)
+        self.last_received_at = now
+        self.received_at = now
+
+        self.frames_received[frame[ACTION_OFFSET]] += 1
+        self.bytes_received += len(frame)
+
+    def sent(self, frame):
+        if self.received_at:
+            self.token_hold.observe(time.perf_counter() - self.received_at)
+            self.received_at = 0.0
+
+        self.frames_sent[frame[ACTION_OFFSET]] += 1
+        self.bytes_sent += len(frame)
+
+    def forwarded(self, action):
+        self.frames_forwarded[action.value] += 1
+
+    def handled(self, action, elapsed):
+        self.frames_handled[action.value] += 1
+        self.handler_latency[action.value].observe(elapsed)
+
+    def turn_expired(self, action):
+        self.turns_expired[action.value] += 1
+
+    def turn_reported(self):
+        self.turns_reported += 1
+
+    def bootstrapped(self, seconds, hop_rtt):
+        self.startup_seconds = seconds
+        self.hop_rtt = hop_rtt
+
+    ######################### EXPORT #########################
+
+    # Prometheus text exposition format
+    def render(self):
+        player = f'player="{self.player_id}"'
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def per_action(name, help_text, values):
+            family(name, "counter", help_text)
+            for action in ACTIONS_BY_VALUE:
+                lines.append(
+                    f'{name}{{{player},action="{action.name}"}} {values[action.value]}'
+                )
+
+        per_action("ring_frames_sent_total", "Frames sent.", self.frames_sent)
+        per_action(
+            "ring_frames_received_total", "Frames received.", self.frames_received
+        )
+        per_action(
+            "ring_frames_forwarded_total",
+            "Frames passed on without being handled.",
+            self.frames_forwarded,
+        )
+        per_action(
+            "ring_frames_handled_total",
+            "Frames addressed to this player.",
+            self.frames_handled,
+        )
+
+        family(
+            "ring_turns_expired_total",
+            "counter",
+            "Decisions of this player made by default after the turn deadline.",
+        )
+        for action in (Actions.ASK_BET, Actions.ASK_CARD):
+            lines.append(
+                f'ring_turns_expired_total{{{player},action="{action.name}"}} '
+                f"{self.turns_expired[action.value]}"
+            )
+        family(
+            "ring_turns_expired_reported_total",
+            "counter",
+            "Expired turns of any player reported to this node as dealer.",
+        )
+        lines.append(
+            f"ring_turns_expired_reported_total{{{player}}} {self.turns_reported}"
+        )
+
+        family(
+            "ring_startup_seconds",
+            "gauge",
+            "Time spent in the startup barrier before the first frame.",
+        )
+        lines.append(f"ring_startup_seconds{{{player}}} {self.startup_seconds}")
+        family(
+            "ring_hop_rtt_seconds",
+            "gauge",
+            "Round trip to the next player measured at startup.",
+        )
+        lines.append(f"ring_hop_rtt_seconds{{{player}}} {self.hop_rtt}")
+
+        family("ring_bytes_sent_total", "counter", "Frame bytes sent.")
+        lines.append(f"ring_bytes_sent_total{{{player}}} {self.bytes_sent}")
+        family("ring_bytes_received_total", "counter", "Frame bytes received.")
+        lines.append(f"ring_bytes_received_total{{{player}}} {self.bytes_received}")
+
+        family(
+            "ring_token_hold_seconds",
+            "histogram",
+            "Time between receiving the token and sending it on.",
+        )
+        lines += self.token_hold.render("ring_token_hold_seconds", player)
+        family(
+            "ring_token_lap_seconds",
+            "histogram",
+            "Time between consecutive frames reaching this player.",
+        )
+        lines += self.token_lap.render("ring_token_lap_seconds", player)
+
+        family(
+            "ring_handler_seconds",
+            "histogram",
+            "Time spent handling frames addressed to this player.",
+        )
+        for action in ACTIONS_BY_VALUE:
+            histogram = self.handler_latency[action.value]
+            if histogram.count:
+                lines += histogram.render(
+                    "ring_handler_seconds", f'{player},action="{action.name}"'
+                )
+
+        return "\n".join(lines) + "\n"
+
+    # Written beside the target and renamed, scrapers never read half a file
+    def write(self, path):
+        partial = f"{path}.tmp"
+        with open(partial, "w") as file:
+            file.write(self.render())
+        os.replace(partial, path)
+
+    def export_to_file(self, path, interval):
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.write(path)
+
+        threading.Thread(target=loop, daemon=True).start()
+        atexit.register(self.write, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
@@ -1,6 +1,49 @@
 import socket
+import time
 
-from settings import BASE_PORT, BUFFER_SIZE, NUM_PLAYERS
+from protocol import (
+    FRAGMENT,
+    HELLO_ECHO,
+    HELLO_LAP,
+    HELLO_PROBE,
+    MAX_EPOCH,
+    MAX_RTT_US,
+    MAX_SEQ,
+    PROTOCOL_VERSION,
+    decode_hello,
+    encode_hello,
+    fragment_frame,
+    frame_epoch,
+    is_fragment,
+    is_hello,
+    is_stale_epoch,
+    restamp_epoch,
+)
+from settings import (
+    BASE_PORT,
+    BOOTSTRAP_PROBES,
+    BOOTSTRAP_RETRY,
+    BUFFER_SIZE,
+    INITIAL_TOKEN_TIMEOUT,
+    MAX_TOKEN_TIMEOUT,
+    MIN_TOKEN_TIMEOUT,
+    NUM_PLAYERS,
+    TOKEN_TIMEOUT_LAPS,
+)
+from topology import Topology
+
+# Weight of the newest sample in the lap time average
+LAP_TIME_WEIGHT = 0.125
+# Datagrams are received into a rotating pool of buffers, a received frame is
+# valid until this many more datagrams have been received
+RECEIVE_BUFFERS = 4
+# A zero socket timeout would turn the socket non-blocking
+MIN_WAIT = 0.000001
+
+
+# The ring did not come up within the startup timeout
+class BootstrapError(Exception):
+    pass
 
 
 class Network:
@@ -10,37 +53,423 @@ class Network:
     player_ip = ""
     next_player_ip = ""
 
+    player_id = 0
+    next_player_id = 0
+    num_players = NUM_PLAYERS
+    base_port = BASE_PORT
+    topology: Topology = None
+
     has_token = 0
+    seq = 0
+
+    # Token recovery
+    epoch = 0
+    last_sent = None
+    token_timeout_laps = TOKEN_TIMEOUT_LAPS
+    lap_time = 0.0
+    last_receive_at = 0.0
+    waiting_since = 0.0
+    on_token_lost = None  # called with the number of consecutive timeouts
+
+    # Startup barrier
+    startup_timeout = 0  # seconds, 0 sends the first frame without one
+    hop_rtt = 0.0  # round trip to the successor measured by the barrier
+
+    metrics = None
+    journal = None
+    checkpointer = None
+
+    buffers: list[memoryview] = []
+    buffer_index = 0
+    # Frames partly received, per sender: address -> ((epoch, seq), parts)
+    fragments: dict = {}
+
+    def __init__(
+        self,
+        player_id,
+        player_ip,
+        next_player_ip,
+        num_players=NUM_PLAYERS,
+        base_port=BASE_PORT,
+        token_timeout_laps=TOKEN_TIMEOUT_LAPS,
+        topology=None,
+        startup_timeout=0,
+    ):
+        self.token_timeout_laps = token_timeout_laps
+        self.startup_timeout = startup_timeout
+        self.configure(
+            player_id, player_ip, next_player_ip, num_players, base_port, topology
+        )
+
+        # Broadcasts to spectators go through a socket of their own
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((self.player_ip, self.player_port))
+
+        self.buffers = [
+            memoryview(bytearray(BUFFER_SIZE)) for _ in range(RECEIVE_BUFFERS)
+        ]
+        self.fragments = {}
+
+    # Without a topology the ring is NUM_PLAYERS consecutive ports, with this
+    # node on player_ip and its successor on next_player_ip
+    def configure(
+        self, player_id, player_ip, next_player_ip, num_players, base_port, topology
+    ):
+        self.player_id = player_id
+        self.topology = topology
 
-    def __init__(self, player_id, player_ip, next_player_ip):
-        self.player_port = BASE_PORT + player_id - 1
+        if topology:
+            self.num_players = topology.num_players
+            self.next_player_id = topology.next_player(player_id)
+            self.player_ip, self.player_port = topology.address(player_id)
+            self.next_player_ip, self.next_player_port = topology.address(
+                self.next_player_id
+            )
+            return
+
+        self.num_players = num_players
+        self.base_port = base_port
+        self.next_player_id = player_id % num_players + 1
+
+        self.player_port = self.port_for(player_id)
         self.next_player_port = self.next_port(self.player_port)
 
         self.player_ip = player_ip
         self.next_player_ip = next_player_ip
 
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Shutting down first wakes a receive blocked on another thread, which
+    # would otherwise keep the socket and its port alive
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # unconnected, but the receive is woken all the same
+        self.sock.close()
 
-        # Broadcast message
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    # Successor addresses are only known for every player with a topology
+    def can_splice(self):
+        return self.topology is not None
 
-        self.sock.bind((self.player_ip, self.player_port))
+    def set_next_player(self, player_id):
+        self.next_player_id = player_id
+        self.next_player_ip, self.next_player_port = self.topology.address(player_id)
+
+    def port_for(self, player_id):
+        return self.base_port + player_id - 1
 
     def next_port(self, current_port):
-        return (current_port + 1 - BASE_PORT) % NUM_PLAYERS + BASE_PORT
+        return (current_port + 1 - self.base_port) % self.num_players + self.base_port
+
+    def next_seq(self):
+        self.seq = (self.seq + 1) & MAX_SEQ
+        return self.seq
 
     def send_message(self, message):
         if self.has_token:
-            self.sock.sendto(
-                message.encode(), (self.next_player_ip, self.next_player_port)
-            )
+            if self.checkpointer:
+                self.checkpointer.sending(message)
+            self.transmit(message)
+            self.last_sent = message
             self.has_token = 0
+            if self.metrics:
+                self.metrics.sent(message)
+            if self.journal:
+                self.journal.sent(message)
         else:
             print("The player does not have the token to send the message")
             exit(1)
 
     def receive_message(self):
+        if not self.token_timeout_laps:
+            self.has_token = 1
+            data = self.receive_frame()
+            if self.metrics:
+                self.metrics.received(data)
+            if self.journal:
+                self.journal.received(data)
+            return data
+
+        timeouts = 0
+        self.waiting_since = time.monotonic()
+        while True:
+            try:
+                data = self.receive_frame(self.token_timeout(timeouts))
+            except TimeoutError:
+                timeouts += 1
+                if self.on_token_lost:
+                    self.on_token_lost(timeouts)
+                continue
+
+            epoch = frame_epoch(data)
+            if is_stale_epoch(epoch, self.epoch):
+                # Token superseded by a regenerated one
+                continue
+
+            self.epoch = epoch
+            self.observe_lap(timeouts == 0)
+            self.has_token = 1
+            if self.metrics:
+                self.metrics.received(data)
+            if self.journal:
+                self.journal.received(data)
+            return data
+
+    def transmit(self, message):
+        self.send_frame(message, (self.next_player_ip, self.next_player_port))
+
+    # Frames over BUFFER_SIZE are sent as fragments
+    def send_frame(self, frame, address):
+        if len(frame) <= BUFFER_SIZE:
+            self.sock.sendto(frame, address)
+            return
+        for fragment in fragment_frame(frame, BUFFER_SIZE):
+            self.sock.sendto(fragment, address)
+
+    # Waits at most timeout seconds when one is given. Frames that fit one
+    # datagram are returned as a view of the receive buffer, not copied.
+    def receive_frame(self, timeout=None):
+        if timeout is not None:
+            self.sock.settimeout(timeout)
+        while True:
+            datagram, address = self.receive_datagram()
+            if not is_fragment(datagram):
+                return datagram
+            frame = self.reassemble(datagram, address)
+            if frame is not None:
+                return frame
+
+    # Probes and laps still going round after the barrier are answered here
+    # and never reach the game
+    def receive_datagram(self):
+        self.buffer_index = (self.buffer_index + 1) % RECEIVE_BUFFERS
+        buffer = self.buffers[self.buffer_index]
+        while True:
+            size, address = self.sock.recvfrom_into(buffer)
+            if address is None:
+                raise ConnectionAbortedError("Socket closed while receiving")
+            if not is_hello(buffer[:size]):
+                return buffer[:size], address
+            self.answer_hello(bytes(buffer[:size]), address)
+
+    # Returns the frame once all its fragments are in. A sender moves on to
+    # another frame only when the previous one got through or was lost, so
+    # one partial frame is kept per sender.
+    def reassemble(self, fragment, address):
+        _, epoch, seq, index, count = FRAGMENT.unpack_from(fragment)
+        key = (epoch, seq)
+        partial = self.fragments.get(address)
+        if not partial or partial[0] != key:
+            partial = (key, [None] * count)
+            self.fragments[address] = partial
+
+        parts = partial[1]
+        if index >= len(parts):
+            return None
+        parts[index] = bytes(fragment[FRAGMENT.size :])
+        if None in parts:
+            return None
+
+        del self.fragments[address]
+        return b"".join(parts)
+
+    # Called before the node exits, nothing is left in flight without hop
+    # acknowledgements
+    def flush(self):
+        pass
+
+    ####################### TOKEN RECOVERY #######################
+
+    # Every node sees the token once per lap, so the receive interval is the
+    # lap time
+    def observe_lap(self, measure):
+        now = time.monotonic()
+        if measure and self.last_receive_at:
+            sample = now - self.last_receive_at
+            if self.lap_time:
+                self.lap_time += LAP_TIME_WEIGHT * (sample - self.lap_time)
+            else:
+                self.lap_time = sample
+        self.last_receive_at = now
+
+    def resend_last(self):
+        self.send_message(restamp_epoch(self.last_sent, self.epoch))
+
+    def token_timeout(self, timeouts=0):
+        if not self.lap_time:
+            return INITIAL_TOKEN_TIMEOUT
+        timeout = max(MIN_TOKEN_TIMEOUT, self.token_timeout_laps * self.lap_time)
+        return min(MAX_TOKEN_TIMEOUT, timeout * 2**timeouts)
+
+    # Reissues the last frame sent by this node under a new epoch, the old
+    # token is dropped by every node that has seen the new one
+    def regenerate_token(self):
+        if self.last_sent is None:
+            return False
+
+        self.epoch = (self.epoch + 1) & MAX_EPOCH
         self.has_token = 1
-        data, _ = self.sock.recvfrom(BUFFER_SIZE)
-        decoded = data.decode()
-        return decoded
+        if self.journal:
+            self.journal.regenerated()
+        self.send_message(restamp_epoch(self.last_sent, self.epoch))
+        return True
+
+    ########################### BOOTSTRAP ###########################
+
+    # Blocks until every node is bound and reachable, for at most
+    # startup_timeout seconds. Each node measures the round trip to its
+    # successor, then passes on the lap the dealer sends. Returns the lap back
+    # at the dealer, None at the other nodes once they have passed it on.
+    def bootstrap(self, is_dealer):
+        try:
+            return self.wait_ready(is_dealer)
+        finally:
+            self.sock.settimeout(None)
+
+    def wait_ready(self, is_dealer):
+        now = time.monotonic()
+        deadline = now + self.startup_timeout
+        successor = (self.next_player_ip, self.next_player_port)
+        samples = []
+        probe_nonce = 0
+        probe_sent_at = 0.0
+        next_probe_at = now
+        next_lap_at = now
+        held_lap = None  # (nonce, lap) that came before the hop was measured
+
+        # With a topology the dealer calls the roll of the whole ring, so a
+        # timeout names every node that never answered
+        roll = set()
+        if is_dealer and self.topology:
+            roll = set(self.topology.nodes) - {self.player_id}
+        next_roll_at = now
+
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                raise BootstrapError(self.not_ready(samples, is_dealer, roll))
+
+            measured = len(samples) >= BOOTSTRAP_PROBES
+            if not measured and now >= next_probe_at:
+                probe_nonce += 1
+                probe_sent_at = now
+                next_probe_at = now + BOOTSTRAP_RETRY
+                self.send_hello(HELLO_PROBE, probe_nonce, successor)
+            if roll and now >= next_roll_at:
+                next_roll_at = now + BOOTSTRAP_RETRY
+                for player_id in roll:
+                    self.send_hello(HELLO_PROBE, 0, self.topology.address(player_id))
+            if is_dealer and measured and now >= next_lap_at:
+                next_lap_at = now + BOOTSTRAP_RETRY
+                rtt_us = self.hop_rtt_us()
+                self.send_hello(
+                    HELLO_LAP,
+                    0,
+                    successor,
+                    (self.player_id, 1, self.player_id, rtt_us, rtt_us),
+                )
+
+            events = [deadline]
+            if not measured:
+                events.append(next_probe_at)
+            if roll:
+                events.append(next_roll_at)
+            if is_dealer and measured:
+                events.append(next_lap_at)
+            self.sock.settimeout(max(MIN_WAIT, min(events) - now))
+            try:
+                datagram, address = self.sock.recvfrom(BUFFER_SIZE)
+            except TimeoutError:
+                continue
+            except ConnectionResetError:
+                # Windows reports a probe sent before the node was bound here
+                continue
+            if not is_hello(datagram):
+                # Nobody sends a frame before the lap is back at the dealer
+                continue
+
+            version, kind, player_id, nonce, lap = decode_hello(datagram)
+            if version != PROTOCOL_VERSION:
+                raise BootstrapError(
+                    f"Player {player_id} at {address[0]}:{address[1]} speaks "
+                    f"protocol version {version}, this node {PROTOCOL_VERSION}"
+                )
+            roll.discard(player_id)
+
+            if kind == HELLO_PROBE:
+                self.send_hello(HELLO_ECHO, nonce, address)
+            elif kind == HELLO_ECHO:
+                if nonce != probe_nonce or player_id != self.next_player_id:
+                    continue
+                samples.append(time.monotonic() - probe_sent_at)
+                next_probe_at = 0.0
+                # The smallest round trip, queueing only adds to the others
+                self.hop_rtt = min(samples)
+                if held_lap and len(samples) >= BOOTSTRAP_PROBES:
+                    self.pass_lap(*held_lap)
+                    return None
+            elif kind == HELLO_LAP and lap:
+                if lap[0] == self.player_id:
+                    if is_dealer and lap[1] == self.num_players:
+                        return lap
+                elif measured:
+                    self.pass_lap(nonce, lap)
+                    if not is_dealer:
+                        return None
+                else:
+                    held_lap = (nonce, lap)
+
+    def send_hello(self, kind, nonce, address, lap=None):
+        self.sock.sendto(encode_hello(kind, self.player_id, nonce, lap), address)
+
+    def hop_rtt_us(self):
+        return min(MAX_RTT_US, int(self.hop_rtt * 1e6))
+
+    # Adds the hop to the successor to the lap
+    def pass_lap(self, nonce, lap):
+        origin, count, slowest_player_id, slowest_us, total_us = lap
+        rtt_us = self.hop_rtt_us()
+        if rtt_us > slowest_us:
+            slowest_player_id, slowest_us = self.player_id, rtt_us
+        self.send_hello(
+            HELLO_LAP,
+            nonce,
+            (self.next_player_ip, self.next_player_port),
+            (
+                origin,
+                count + 1,
+                slowest_player_id,
+                slowest_us,
+                min(MAX_RTT_US, total_us + rtt_us),
+            ),
+        )
+
+    # Late copies of laps still go round, the dealer drops its own
+    def answer_hello(self, datagram, address):
+        _, kind, _, nonce, lap = decode_hello(datagram)
+        if kind == HELLO_PROBE:
+            self.send_hello(HELLO_ECHO, nonce, address)
+        elif kind == HELLO_LAP and lap and lap[0] != self.player_id:
+            self.pass_lap(nonce, lap)
+
+    def not_ready(self, samples, is_dealer, roll):
+        waited = f"within {self.startup_timeout:g}s"
+        if roll:
+            missing = []
+            for player_id in sorted(roll):
+                host, port = self.topology.address(player_id)
+                missing.append(f"player {player_id} at {host}:{port}")
+            return f"Ring not ready {waited}, no answer from {', '.join(missing)}"
+        if not samples:
+            return (
+                f"Player {self.next_player_id} at {self.next_player_ip}:"
+                f"{self.next_player_port} did not answer {waited}"
+            )
+        if is_dealer:
+            return (
+                f"Ring not ready {waited}, the readiness lap did not come back, "
+                f"the node before the missing one names it"
+            )
+        return (
+            f"Ring not ready {waited}, no readiness lap reached this node, "
+            f"a node before it is missing"
+        )
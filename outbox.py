@@ -0,0 +1,43 @@
+from protocol import MAX_SEQ, restamp_epoch
+
+
+# Network of a Game stepped through on_start/on_frame. Frames the handlers send
+# are kept with the player they go to until the caller drains them.
+class Outbox:
+    has_token = 0
+    seq = 0
+    epoch = 0
+    last_sent = None
+    on_token_lost = None
+    frames: list = None  # (player id, frame) pairs not drained yet
+
+    def __init__(self, player_id, next_player_id):
+        self.player_id = player_id
+        self.next_player_id = next_player_id
+        self.frames = []
+
+    def next_seq(self):
+        self.seq = (self.seq + 1) & MAX_SEQ
+        return self.seq
+
+    def can_splice(self):
+        return True
+
+    def set_next_player(self, player_id):
+        self.next_player_id = player_id
+
+    def send_message(self, message):
+        if not self.has_token:
+            raise RuntimeError(f"Player {self.player_id} sent without the token")
+
+        self.has_token = 0
+        self.last_sent = message
+        self.frames.append((self.next_player_id, message))
+
+    def resend_last(self):
+        self.send_message(restamp_epoch(self.last_sent, self.epoch))
+
+    def drain(self):
+        frames = self.frames
+        self.frames = []
+        return frames
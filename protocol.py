@@ -0,0 +1,394 @@
+import hashlib
+import struct
+from enum import Enum
+
+PROTOCOL_VERSION = 6
+
+# version, table id, token epoch, from_player_id, to_player_id, action,
+# sequence number, payload length. Piggybacked sections follow the payload.
+HEADER = struct.Struct("!BHHHHBIH")
+HEADER_SIZE = HEADER.size
+TABLE = struct.Struct("!H")
+TABLE_OFFSET = 1
+EPOCH = struct.Struct("!H")
+EPOCH_OFFSET = 3
+ACTION_OFFSET = 9
+SEQ = struct.Struct("!I")
+SEQ_OFFSET = 10
+
+COUNT = struct.Struct("!H")
+PLAYER = struct.Struct("!H")
+BET = struct.Struct("!HH")
+PLAYED_CARD = struct.Struct("!HBB")
+DEAL = struct.Struct("!IH")
+DEALT_HAND = struct.Struct("!HH")
+# piggyback protocol - ACTION LENGTH, then the payload of that action
+SECTION = struct.Struct("!BH")
+# hop acknowledgement - MARKER EPOCH SEQ of the frame received, shorter than
+# any frame and told apart by its first byte
+HOP_ACK = struct.Struct("!BHI")
+HOP_ACK_MARKER = 0xAC
+# fragment protocol - MARKER EPOCH SEQ INDEX COUNT, then a slice of a frame too
+# large for one datagram. The frame is named by the epoch and sequence number
+# stamped on it, a regenerated copy is a different frame.
+FRAGMENT = struct.Struct("!BHIBB")
+FRAGMENT_MARKER = 0xF4
+MAX_FRAGMENTS = 0xFF
+# bootstrap protocol - MARKER VERSION KIND PLAYER_ID NONCE, exchanged before the
+# first frame by the sender's player id. Any node sends a PROBE back as an ECHO.
+# A LAP leaves the dealer and is passed on by every node once it has measured
+# the round trip to its successor, it carries ORIGIN COUNT SLOWEST_PLAYER
+# SLOWEST_RTT TOTAL_RTT with round trips in microseconds.
+HELLO = struct.Struct("!BBBHI")
+HELLO_MARKER = 0xB0
+LAP = struct.Struct("!HHHII")
+MAX_RTT_US = 0xFFFFFFFF
+
+# Hello kinds
+HELLO_PROBE = 0
+HELLO_ECHO = 1
+HELLO_LAP = 2
+
+MAX_SEQ = 0xFFFFFFFF
+MAX_EPOCH = 0xFFFF
+
+
+class Actions(Enum):
+    NEW_DEALER = 0
+    INFO_NEW_DEALER = 1
+    DEAL_CARDS = 2
+    ASK_BET = 3
+    WINNER = 4
+    SHOW_BETS = 5
+    ASK_CARD = 6
+    RETURN_CARDS = 7
+    SHOW_ROUND_RESULT = 8
+    SHOW_RESULTS = 9
+    DEAL_HANDS = 10
+    TURN_EXPIRED = 11  # only piggybacked, on the way to the dealer
+
+
+########################### PAYLOADS ###########################
+
+# Signed so lives below zero survive the trip
+def encode_ints(values):
+    return COUNT.pack(len(values)) + struct.pack(f"!{len(values)}h", *values)
+
+
+def decode_ints(payload):
+    (count,) = COUNT.unpack_from(payload)
+    return list(struct.unpack_from(f"!{count}h", payload, COUNT.size))
+
+
+def encode_player(player_id):
+    return PLAYER.pack(player_id)
+
+
+def decode_player(payload):
+    return PLAYER.unpack_from(payload)[0]
+
+
+# hand protocol - COUNT, then RANK SUIT per card
+def encode_hand(cards):
+    raw = bytearray(COUNT.pack(len(cards)))
+    for rank, suit in cards:
+        raw.append(rank)
+        raw.append(suit)
+    return bytes(raw)
+
+
+def decode_hand(payload):
+    (count,) = COUNT.unpack_from(payload)
+    raw = payload[COUNT.size : COUNT.size + 2 * count]
+    return [(raw[i], raw[i + 1]) for i in range(0, 2 * count, 2)]
+
+
+# bet protocol - COUNT, then PLAYER_ID BET per bet
+def encode_bets(bets):
+    raw = bytearray(COUNT.pack(len(bets)))
+    for player_id, bet in bets:
+        raw += BET.pack(player_id, bet)
+    return bytes(raw)
+
+
+def decode_bets(payload):
+    (count,) = COUNT.unpack_from(payload)
+    return [
+        BET.unpack_from(payload, COUNT.size + i * BET.size) for i in range(count)
+    ]
+
+
+# card protocol - COUNT, then PLAYER_ID RANK SUIT per card
+def encode_played_cards(played_cards):
+    raw = bytearray(COUNT.pack(len(played_cards)))
+    for player_id, rank, suit in played_cards:
+        raw += PLAYED_CARD.pack(player_id, rank, suit)
+    return bytes(raw)
+
+
+def decode_played_cards(payload):
+    (count,) = COUNT.unpack_from(payload)
+    return [
+        PLAYED_CARD.unpack_from(payload, COUNT.size + i * PLAYED_CARD.size)
+        for i in range(count)
+    ]
+
+
+# deal protocol - NONCE COUNT, then PLAYER_ID COUNT and RANK SUIT per card for
+# each hand
+def encode_hands(deal):
+    nonce, hands = deal
+    raw = bytearray(DEAL.pack(nonce, len(hands)))
+    for player_id, cards in hands:
+        raw += DEALT_HAND.pack(player_id, len(cards))
+        for rank, suit in cards:
+            raw.append(rank)
+            raw.append(suit)
+    return bytes(raw)
+
+
+def decode_hands(payload):
+    nonce, count = DEAL.unpack_from(payload)
+    offset = DEAL.size
+    hands = []
+    for _ in range(count):
+        player_id, num_cards = DEALT_HAND.unpack_from(payload, offset)
+        offset += DEALT_HAND.size
+        raw = payload[offset : offset + 2 * num_cards]
+        hands.append(
+            (player_id, [(raw[i], raw[i + 1]) for i in range(0, 2 * num_cards, 2)])
+        )
+        offset += 2 * num_cards
+    return nonce, hands
+
+
+# Hands that fit in one DEAL_HANDS frame of at most frame_size bytes
+def hands_per_frame(frame_size, cards_per_hand):
+    room = frame_size - HEADER_SIZE - DEAL.size
+    return max(1, room // (DEALT_HAND.size + 2 * cards_per_hand))
+
+
+# XORs each card with a keystream derived from the secret, the deal nonce and
+# the recipient, applying it twice restores the cards. This only hides hands
+# from whoever lacks the secret: it is not authenticated, and with one secret
+# shared by the ring every player can still unmask the other hands.
+def mask_cards(cards, secret, nonce, player_id):
+    stream = hashlib.shake_256(
+        secret + DEAL.pack(nonce, player_id)
+    ).digest(2 * len(cards))
+    return [
+        (rank ^ stream[2 * i], suit ^ stream[2 * i + 1])
+        for i, (rank, suit) in enumerate(cards)
+    ]
+
+
+PAYLOADS = {
+    Actions.NEW_DEALER: (encode_ints, decode_ints),  # lives
+    Actions.INFO_NEW_DEALER: (encode_player, decode_player),
+    Actions.DEAL_CARDS: (encode_hand, decode_hand),
+    Actions.ASK_BET: (encode_bets, decode_bets),
+    Actions.WINNER: (encode_player, decode_player),
+    Actions.SHOW_BETS: (encode_ints, decode_ints),
+    Actions.ASK_CARD: (encode_played_cards, decode_played_cards),
+    Actions.RETURN_CARDS: (encode_played_cards, decode_played_cards),
+    Actions.SHOW_ROUND_RESULT: (encode_ints, decode_ints),  # wins
+    Actions.SHOW_RESULTS: (encode_ints, decode_ints),  # lives
+    Actions.DEAL_HANDS: (encode_hands, decode_hands),
+    # player, action of the turn, cards left in the hand
+    Actions.TURN_EXPIRED: (encode_ints, decode_ints),
+}
+
+# Indexed by action value, avoids building the enum on every hop
+ACTIONS_BY_VALUE = [None] * (max(action.value for action in Actions) + 1)
+for action in Actions:
+    ACTIONS_BY_VALUE[action.value] = action
+
+########################### FRAMES ###########################
+
+
+def encode_frame(
+    from_player_id,
+    to_player_id,
+    action,
+    seq,
+    data,
+    epoch=0,
+    table_id=0,
+    piggyback=b"",
+):
+    payload = PAYLOADS[action][0](data)
+    return encode_raw_frame(
+        from_player_id, to_player_id, action, seq, payload, epoch, table_id, piggyback
+    )
+
+
+def encode_raw_frame(
+    from_player_id,
+    to_player_id,
+    action,
+    seq,
+    payload,
+    epoch=0,
+    table_id=0,
+    piggyback=b"",
+):
+    header = HEADER.pack(
+        PROTOCOL_VERSION,
+        table_id,
+        epoch,
+        from_player_id,
+        to_player_id,
+        action.value,
+        seq,
+        len(payload),
+    )
+    return header + payload + piggyback
+
+
+def decode_header(frame):
+    if len(frame) < HEADER_SIZE:
+        raise ValueError(f"Frame too short: {len(frame)} bytes")
+
+    (
+        version,
+        table_id,
+        epoch,
+        from_player_id,
+        to_player_id,
+        action_value,
+        seq,
+        length,
+    ) = HEADER.unpack_from(frame)
+
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version: {version}")
+    if len(frame) - HEADER_SIZE < length:
+        raise ValueError(
+            f"Payload length mismatch: header says {length}, "
+            f"got {len(frame) - HEADER_SIZE}"
+        )
+    if action_value >= len(ACTIONS_BY_VALUE) or not ACTIONS_BY_VALUE[action_value]:
+        raise ValueError(f"Unknown action: {action_value}")
+
+    action = ACTIONS_BY_VALUE[action_value]
+    return from_player_id, to_player_id, action, seq, epoch, table_id, length
+
+
+def frame_table(frame):
+    return TABLE.unpack_from(frame, TABLE_OFFSET)[0]
+
+
+def frame_epoch(frame):
+    return EPOCH.unpack_from(frame, EPOCH_OFFSET)[0]
+
+
+def frame_seq(frame):
+    return SEQ.unpack_from(frame, SEQ_OFFSET)[0]
+
+
+def is_hop_ack(datagram):
+    return len(datagram) == HOP_ACK.size and datagram[0] == HOP_ACK_MARKER
+
+
+def is_fragment(datagram):
+    return len(datagram) > FRAGMENT.size and datagram[0] == FRAGMENT_MARKER
+
+
+def is_hello(datagram):
+    return len(datagram) >= HELLO.size and datagram[0] == HELLO_MARKER
+
+
+def encode_hello(kind, player_id, nonce, lap=None):
+    hello = HELLO.pack(HELLO_MARKER, PROTOCOL_VERSION, kind, player_id, nonce)
+    return hello + LAP.pack(*lap) if lap else hello
+
+
+# Returns version, kind, player id, nonce and the lap fields, None but for a LAP
+def decode_hello(datagram):
+    _, version, kind, player_id, nonce = HELLO.unpack_from(datagram)
+    lap = None
+    if kind == HELLO_LAP and len(datagram) >= HELLO.size + LAP.size:
+        lap = LAP.unpack_from(datagram, HELLO.size)
+    return version, kind, player_id, nonce, lap
+
+
+# Splits a frame into fragments of at most datagram_size bytes
+def fragment_frame(frame, datagram_size):
+    room = datagram_size - FRAGMENT.size
+    count = -(-len(frame) // room)
+    if count > MAX_FRAGMENTS:
+        raise ValueError(f"Frame too large to fragment: {len(frame)} bytes")
+
+    epoch = frame_epoch(frame)
+    seq = frame_seq(frame)
+    return [
+        FRAGMENT.pack(FRAGMENT_MARKER, epoch, seq, index, count)
+        + frame[index * room : (index + 1) * room]
+        for index in range(count)
+    ]
+
+
+def restamp_epoch(frame, epoch):
+    stamped = bytearray(frame)
+    EPOCH.pack_into(stamped, EPOCH_OFFSET, epoch)
+    return bytes(stamped)
+
+
+# Epochs wrap around, anything up to half the range behind is stale
+def is_stale_epoch(epoch, current_epoch):
+    return 0 < (current_epoch - epoch) & MAX_EPOCH <= MAX_EPOCH // 2
+
+
+def decode_payload(action, payload):
+    return PAYLOADS[action][1](payload)
+
+
+# Extra actions riding on a frame, so one lap can carry several phases
+def encode_sections(sections):
+    raw = bytearray()
+    for action, data in sections:
+        payload = PAYLOADS[action][0](data)
+        raw += SECTION.pack(action.value, len(payload))
+        raw += payload
+    return bytes(raw)
+
+
+# Returns (action, payload) pairs, payloads are left for decode_payload
+def decode_sections(raw):
+    sections = []
+    offset = 0
+    while offset < len(raw):
+        if len(raw) - offset < SECTION.size:
+            raise ValueError(f"Truncated piggyback section at byte {offset}")
+        action_value, length = SECTION.unpack_from(raw, offset)
+        offset += SECTION.size
+
+        if action_value >= len(ACTIONS_BY_VALUE) or not ACTIONS_BY_VALUE[action_value]:
+            raise ValueError(f"Unknown piggybacked action: {action_value}")
+        if len(raw) - offset < length:
+            raise ValueError(f"Truncated piggyback section at byte {offset}")
+
+        sections.append((ACTIONS_BY_VALUE[action_value], raw[offset : offset + length]))
+        offset += length
+    return sections
+
+
+# Forwarding nodes never look at the data, with_data=False leaves it to the
+# caller to decode_payload only when the frame is handled
+def decode_frame(frame, with_data=True):
+    from_player_id, to_player_id, action, seq, epoch, table_id, length = (
+        decode_header(frame)
+    )
+    payload = frame[HEADER_SIZE : HEADER_SIZE + length]
+
+    return {
+        "table_id": table_id,
+        "from_player_id": from_player_id,
+        "to_player_id": to_player_id,
+        "action": action,
+        "seq": seq,
+        "epoch": epoch,
+        "data": decode_payload(action, payload) if with_data else None,
+        "payload": payload,
+        "piggyback": frame[HEADER_SIZE + length :],
+    }
@@ -0,0 +1,158 @@
+import time
+
+from network import MIN_WAIT, Network
+from protocol import (
+    HOP_ACK,
+    HOP_ACK_MARKER,
+    frame_epoch,
+    frame_seq,
+    is_fragment,
+    is_hop_ack,
+)
+from settings import (
+    INITIAL_RETRANSMIT_TIMEOUT,
+    MAX_RETRANSMIT_TIMEOUT,
+    MAX_RETRANSMITS,
+    MIN_RETRANSMIT_TIMEOUT,
+)
+
+# Smoothing gains of the round trip estimate, RFC 6298
+RTT_WEIGHT = 0.125
+RTT_VARIANCE_WEIGHT = 0.25
+
+
+# Every hop is acknowledged by the successor, a frame without its
+# acknowledgement after the retransmission timeout is sent again. Frames are
+# told apart by the epoch and sequence number the sender stamped on them, so
+# a resent copy is acknowledged again but handed to the game only once.
+class ReliableNetwork(Network):
+    srtt = 0.0
+    rttvar = 0.0
+    rto = INITIAL_RETRANSMIT_TIMEOUT
+
+    # Frame sent and not acknowledged yet
+    pending = None
+    pending_key = None  # epoch, seq
+    pending_address = None
+    pending_sent_at = 0.0
+    pending_retransmits = 0
+    retransmit_at = 0.0
+
+    last_delivered = None  # address, epoch, seq
+
+    acknowledged = 0
+    retransmitted = 0
+    duplicates = 0
+    abandoned = 0
+
+    def transmit(self, message):
+        address = (self.next_player_ip, self.next_player_port)
+        self.send_frame(message, address)
+
+        now = time.monotonic()
+        self.pending = message
+        self.pending_key = (frame_epoch(message), frame_seq(message))
+        self.pending_address = address
+        self.pending_sent_at = now
+        self.pending_retransmits = 0
+        self.retransmit_at = now + self.rto
+
+    # Handles acknowledgements and retransmissions until a new frame arrives,
+    # TimeoutError once timeout seconds pass without one
+    def receive_frame(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            self.sock.settimeout(self.next_wait(deadline))
+            try:
+                datagram, address = self.receive_datagram()
+            except TimeoutError:
+                now = time.monotonic()
+                if self.pending and now >= self.retransmit_at:
+                    self.retransmit(now)
+                if deadline is not None and now >= deadline:
+                    raise
+                continue
+
+            if is_hop_ack(datagram):
+                self.receive_ack(datagram)
+                continue
+            if is_fragment(datagram):
+                # Acknowledged once whole, a lost fragment resends them all
+                datagram = self.reassemble(datagram, address)
+                if datagram is None:
+                    continue
+
+            epoch = frame_epoch(datagram)
+            seq = frame_seq(datagram)
+            self.sock.sendto(HOP_ACK.pack(HOP_ACK_MARKER, epoch, seq), address)
+
+            key = (address, epoch, seq)
+            if key == self.last_delivered:
+                # Our acknowledgement was lost, the sender tried again
+                self.duplicates += 1
+                continue
+            self.last_delivered = key
+            return datagram
+
+    def next_wait(self, deadline):
+        waits = []
+        if deadline is not None:
+            waits.append(deadline)
+        if self.pending:
+            waits.append(self.retransmit_at)
+        if not waits:
+            return None
+        return max(MIN_WAIT, min(waits) - time.monotonic())
+
+    def receive_ack(self, datagram):
+        _, epoch, seq = HOP_ACK.unpack(datagram)
+        if not self.pending or (epoch, seq) != self.pending_key:
+            # Late acknowledgement of a copy
+            return
+
+        # Round trips of resent frames are ambiguous, only first sends count
+        if not self.pending_retransmits:
+            self.observe_rtt(time.monotonic() - self.pending_sent_at)
+        self.pending = None
+        self.acknowledged += 1
+
+    def retransmit(self, now):
+        if self.pending_retransmits >= MAX_RETRANSMITS:
+            # Successor is gone, token recovery takes over
+            self.pending = None
+            self.abandoned += 1
+            return
+
+        self.send_frame(self.pending, self.pending_address)
+        self.pending_retransmits += 1
+        self.retransmitted += 1
+        self.rto = min(MAX_RETRANSMIT_TIMEOUT, self.rto * 2)
+        self.retransmit_at = now + self.rto
+
+    # The first frames are resent on the round trip the barrier measured
+    # instead of INITIAL_RETRANSMIT_TIMEOUT
+    def bootstrap(self, is_dealer):
+        lap = super().bootstrap(is_dealer)
+        self.observe_rtt(self.hop_rtt)
+        return lap
+
+    def observe_rtt(self, sample):
+        if not self.srtt:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar += RTT_VARIANCE_WEIGHT * (abs(self.srtt - sample) - self.rttvar)
+            self.srtt += RTT_WEIGHT * (sample - self.srtt)
+
+        self.rto = min(
+            MAX_RETRANSMIT_TIMEOUT,
+            max(MIN_RETRANSMIT_TIMEOUT, self.srtt + 4 * self.rttvar),
+        )
+
+    def flush(self):
+        while self.pending:
+            try:
+                self.receive_frame(self.retransmit_at - time.monotonic())
+            except TimeoutError:
+                pass
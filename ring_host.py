@@ -0,0 +1,171 @@
+import argparse
+import os
+import socketserver
+import tempfile
+import threading
+
+from launcher import (
+    GameResult,
+    loopback_ring,
+    play_processes,
+    play_threads,
+)
+from settings import RING_HOST_PORT, TOKEN_TIMEOUT_LAPS
+from strategies import STRATEGIES
+
+# host protocol - text lines over TCP. The host greets every connection with
+#   READY <slots>
+# and the coordinator sends one match at a time on it
+#   PLAY <match name> <seed> <strategy of seat 1> <strategy of seat 2> ...
+# answered once the ring is done, winner 0 with the reason when it failed
+#   RESULT <match name> <winning seat> <seconds> <frames> [reason]
+
+
+def format_play(match_name, seed, strategies):
+    return f"PLAY {match_name} {seed} {' '.join(strategies)}\n"
+
+
+def parse_play(line):
+    words = line.split()
+    if len(words) < 5 or words[0] != "PLAY":
+        raise ValueError(f"Expected PLAY with at least 2 seats, got {line!r}")
+    for strategy in words[3:]:
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy {strategy!r}")
+    return words[1], int(words[2]), words[3:]
+
+
+def format_result(match_name, result):
+    line = (
+        f"RESULT {match_name} {result.winner_id} {result.seconds:.6f} {result.frames}"
+    )
+    if result.detail:
+        line += f" {result.detail}"
+    return line + "\n"
+
+
+# Returns match name, winning seat, seconds, frames and the reason of a failure
+def parse_result(line):
+    words = line.split(" ", 5)
+    if len(words) < 5 or words[0] != "RESULT":
+        raise ValueError(f"Expected RESULT, got {line!r}")
+    detail = words[5].strip() if len(words) > 5 else ""
+    return words[1], int(words[2]), float(words[3]), int(words[4]), detail
+
+
+# Plays whole rings on loopback for a coordinator, one at a time per
+# connection. A ring on one host never waits on another host's network.
+class RingHost(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    args = None
+    slots: threading.Semaphore = None
+
+    def __init__(self, address, args):
+        self.args = args
+        self.slots = threading.Semaphore(args.slots)
+        super().__init__(address, RingHostHandler)
+
+    def play(self, seed, strategies):
+        with self.slots:
+            topology = loopback_ring(len(strategies))
+            if not self.args.processes:
+                return play_threads(self.args, topology, seed, strategies)
+            with tempfile.TemporaryDirectory(prefix="ring-") as workdir:
+                return play_processes(self.args, topology, seed, strategies, workdir)
+
+
+class RingHostHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        host = self.server
+        self.wfile.write(f"READY {host.args.slots}\n".encode())
+
+        for raw in self.rfile:
+            try:
+                match_name, seed, strategies = parse_play(raw.decode())
+            except ValueError as error:
+                self.wfile.write(f"ERROR {error}\n".encode())
+                return
+
+            try:
+                result = host.play(seed, strategies)
+            except OSError as error:
+                result = GameResult()
+                result.detail = str(error)
+            self.wfile.write(format_result(match_name, result).encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Play the rings a tournament coordinator sends to this host"
+    )
+    parser.add_argument(
+        "-i", "--ip", type=str, default="0.0.0.0", help="Address to listen on"
+    )
+    parser.add_argument("--port", type=int, default=RING_HOST_PORT)
+    parser.add_argument(
+        "--slots",
+        type=int,
+        default=os.cpu_count(),
+        help="Rings played at once, the coordinator keeps them all busy",
+    )
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="Run every node as a main.py process instead of a thread",
+    )
+    parser.add_argument(
+        "--token-timeout-laps",
+        type=float,
+        default=TOKEN_TIMEOUT_LAPS,
+        help="Regenerate a lost token after this many lap times, 0 disables",
+    )
+    parser.add_argument(
+        "--reliable", action="store_true", help="Acknowledge every hop"
+    )
+    parser.add_argument(
+        "--piggyback",
+        action="store_true",
+        help="Carry display phases on the frame of the next phase",
+    )
+    parser.add_argument(
+        "--spectators",
+        type=str,
+        metavar="HOST[:PORT]",
+        help="Every node publishes the great rounds it deals to this address",
+    )
+    parser.add_argument(
+        "--stall-timeout",
+        type=float,
+        default=60,
+        help="Seconds a ring may take before it counts as stalled",
+    )
+    parser.add_argument(
+        "--startup-timeout",
+        type=float,
+        default=10,
+        help="Seconds spawned nodes have to bind their ports and bring the ring up",
+    )
+    args = parser.parse_args()
+
+    if args.slots < 1:
+        parser.error("--slots must be at least 1")
+
+    try:
+        server = RingHost((args.ip, args.port), args)
+    except OSError as error:
+        print(f"Cannot listen on {args.ip}:{args.port}: {error}")
+        exit(1)
+
+    print(f"Playing up to {args.slots} rings at once on {args.ip}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,53 @@
 BASE_PORT = 7420
 BUFFER_SIZE = 1024
 
+# Token recovery - 0 disables it, otherwise a node that sees no frame for this
+# many lap times assumes the token is lost. The wait doubles with every
+# timeout in a row, so a ring that is only slow is not given up on.
+TOKEN_TIMEOUT_LAPS = 0
+INITIAL_TOKEN_TIMEOUT = 0.5  # seconds, until a lap is measured
+MIN_TOKEN_TIMEOUT = 0.02  # above the scheduling jitter of a loaded host
+MAX_TOKEN_TIMEOUT = 2.0
+# Seconds without a frame before a node gives the ring up
+TOKEN_RECOVERY_PATIENCE = 5.0
+
+# Hop acknowledgements (--reliable) - a frame is resent after the
+# retransmission timeout, estimated from the measured hop round trips
+INITIAL_RETRANSMIT_TIMEOUT = 0.05  # seconds, until a round trip is measured
+MIN_RETRANSMIT_TIMEOUT = 0.001
+MAX_RETRANSMIT_TIMEOUT = 1.0
+MAX_RETRANSMITS = 8  # then the frame is left to token recovery
+
+# Startup barrier (--startup-timeout) - every node measures the round trip to
+# its successor and the dealer deals once a readiness lap has come back, 0 deals
+# at once
+STARTUP_TIMEOUT = 30  # seconds
+BOOTSTRAP_PROBES = 5  # round trips measured per hop
+BOOTSTRAP_RETRY = 0.1  # seconds before an unanswered probe or lap is sent again
+
+# Spectator stream (--spectators) - the dealer repeats the whole game state
+# this often for spectators that joined late or lost a datagram
+SPECTATOR_PORT = 7410
+SNAPSHOT_INTERVAL = 1.0  # seconds
+
+# Tournaments - hosts listen for the coordinator on this port, a ring that
+# stalls or fails is played again with another seed up to MATCH_ATTEMPTS times
+RING_HOST_PORT = 7400
+MATCH_ATTEMPTS = 3
+
+# Metrics export
+METRICS_INTERVAL = 5  # seconds between metrics file rewrites
+
+# Bots
+DECISION_BUDGET = 0.002  # seconds the Monte Carlo bot spends per decision
+# Deals the Monte Carlo bot samples per card in tournaments, about what
+# DECISION_BUDGET buys on one core, so results depend on the seed and not on
+# the time each search got
+TOURNAMENT_DEALS = 48
+
+# Turn deadlines (--turn-timeout) - 0 waits for the player forever
+TURN_TIMEOUT = 0  # seconds per bet or card
+
 # Game settings
 NUM_PLAYERS = 4
 CARDS_PER_HAND = 3
@@ -0,0 +1,333 @@
+import argparse
+import socket
+import struct
+import time
+
+from game import Card
+from protocol import (
+    COUNT,
+    PLAYED_CARD,
+    PLAYER,
+    decode_ints,
+    decode_played_cards,
+    encode_ints,
+    encode_played_cards,
+)
+from settings import SNAPSHOT_INTERVAL, SPECTATOR_PORT
+
+# spectator protocol - MARKER KIND TABLE_ID PUBLISHER SEQ, then the payload of
+# the kind. Sent by the dealer of each great round, the sequence number counts
+# the datagrams of one publisher.
+SPECTATE = struct.Struct("!BBHHI")
+SPECTATE_MARKER = 0x5E
+ROUND = struct.Struct("!HH")  # round, then the dealer or who took the trick
+
+# Kinds
+DEALT = 0  # round, dealer, then lives, bets and wins per seat
+SNAPSHOT = 1  # same as DEALT, repeated for spectators that missed something
+BETS = 2  # bet per seat
+TRICK = 3  # round and trick winner, cards played, wins per seat
+RESULTS = 4  # lives per seat
+WINNER = 5  # player who won the game
+
+MAX_SPECTATE_SEQ = 0xFFFFFFFF
+
+
+def parse_address(text):
+    host, _, port = text.partition(":")
+    if not host:
+        raise ValueError(f"No host in spectator address {text!r}")
+    try:
+        return host, int(port) if port else SPECTATOR_PORT
+    except ValueError:
+        raise ValueError(f"Bad port in spectator address {text!r}") from None
+
+
+def is_multicast(host):
+    try:
+        return 224 <= int(host.split(".")[0]) <= 239
+    except ValueError:
+        return False
+
+
+# Read-only view of the game for anyone listening on the spectator address,
+# none of it travels the ring. Handlers only queue what happened, the
+# datagrams are encoded and sent by flush once the token is passed on.
+class Broadcaster:
+    game = None
+    sock: socket.socket = None
+    address = None
+    seq = 0
+    queued: list = None  # (kind, values) not sent yet
+    next_snapshot_at = 0.0
+    sent = 0
+    dropped = 0
+
+    def __init__(self, address, game):
+        self.address = address
+        self.game = game
+        self.queued = []
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        if is_multicast(address[0]):
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        # A full send buffer drops the datagram instead of holding up the ring
+        self.sock.setblocking(False)
+
+    def close(self):
+        self.sock.close()
+
+    ########################### EVENTS ###########################
+
+    def snapshot(self, kind=SNAPSHOT):
+        game = self.game
+        self.queued.append(
+            (
+                kind,
+                (
+                    game.dealer_id,
+                    game.curr_round,
+                    list(game.players_lives),
+                    list(game.players_bets),
+                    list(game.players_wins),
+                ),
+            )
+        )
+        self.next_snapshot_at = time.monotonic() + SNAPSHOT_INTERVAL
+
+    def dealt(self):
+        self.snapshot(DEALT)
+
+    def bets(self, bets):
+        self.queued.append((BETS, list(bets)))
+
+    def trick(self, curr_round, win_player_id, played_cards, wins):
+        self.queued.append(
+            (TRICK, (curr_round, win_player_id, played_cards, list(wins)))
+        )
+
+    def results(self, lives):
+        self.queued.append((RESULTS, list(lives)))
+
+    def winner(self, player_id):
+        self.queued.append((WINNER, player_id))
+
+    ########################### SENDING ###########################
+
+    # Spectators that joined late or lost a datagram catch up on the snapshot
+    # the dealer repeats every SNAPSHOT_INTERVAL
+    def flush(self):
+        if (
+            not self.queued
+            and self.game.is_dealer()
+            and self.next_snapshot_at
+            and time.monotonic() >= self.next_snapshot_at
+        ):
+            self.snapshot()
+
+        queued, self.queued = self.queued, []
+        for kind, values in queued:
+            self.seq = (self.seq + 1) & MAX_SPECTATE_SEQ
+            header = SPECTATE.pack(
+                SPECTATE_MARKER, kind, self.game.table_id, self.game.player_id, self.seq
+            )
+            datagram = header + encode_event(kind, values)
+            try:
+                self.sock.sendto(datagram, self.address)
+                self.sent += 1
+            except OSError:
+                self.dropped += 1
+
+    # Attaches the broadcaster to a game
+    @classmethod
+    def publish(cls, address, game):
+        broadcaster = cls(address, game)
+        game.spectators = broadcaster
+        return broadcaster
+
+
+def encode_event(kind, values):
+    if kind in (DEALT, SNAPSHOT):
+        dealer_id, curr_round, lives, bets, wins = values
+        return (
+            ROUND.pack(curr_round, dealer_id)
+            + encode_ints(lives)
+            + encode_ints(bets)
+            + encode_ints(wins)
+        )
+    if kind == TRICK:
+        curr_round, win_player_id, played_cards, wins = values
+        return (
+            ROUND.pack(curr_round, win_player_id)
+            + encode_played_cards(played_cards)
+            + encode_ints(wins)
+        )
+    if kind == WINNER:
+        return PLAYER.pack(values)
+    return encode_ints(values)
+
+
+########################### WATCHING ###########################
+
+
+def ints_size(count):
+    return COUNT.size + 2 * count
+
+
+# Game as the spectator knows it. Deltas are applied only right after the
+# datagram before them from the same publisher, anything else waits for the
+# next snapshot.
+class Spectator:
+    table_id = None  # None watches every table
+    last = None  # (table id, publisher, seq) of the last datagram applied
+    synced = False
+
+    dealer_id = 0
+    curr_round = 0
+    players_lives: list[int]
+    players_bets: list[int]
+    players_wins: list[int]
+    winner_id = 0
+    missed = 0
+
+    def __init__(self, table_id=None):
+        self.table_id = table_id
+        self.players_lives = []
+        self.players_bets = []
+        self.players_wins = []
+
+    # Returns the lines to show for the datagram
+    def receive(self, datagram):
+        if len(datagram) < SPECTATE.size or datagram[0] != SPECTATE_MARKER:
+            return []
+        _, kind, table_id, publisher, seq = SPECTATE.unpack_from(datagram)
+        if self.table_id is not None and table_id != self.table_id:
+            return []
+        payload = datagram[SPECTATE.size :]
+
+        follows = self.last == (table_id, publisher, (seq - 1) & MAX_SPECTATE_SEQ)
+        if kind not in (DEALT, SNAPSHOT) and not follows:
+            if self.synced:
+                self.synced = False
+                self.missed += 1
+                return ["Missed an update, waiting for the next snapshot"]
+            return []
+        self.last = (table_id, publisher, seq)
+
+        if kind in (DEALT, SNAPSHOT):
+            return self.apply_snapshot(kind, payload)
+        if kind == BETS:
+            self.players_bets = decode_ints(payload)
+            return [
+                "Bets: "
+                + ", ".join(
+                    f"player {player_id} {bet}"
+                    for player_id, bet in self.alive(self.players_bets)
+                )
+            ]
+        if kind == TRICK:
+            return self.apply_trick(payload)
+        if kind == RESULTS:
+            self.players_lives = decode_ints(payload)
+            return ["Lives: " + self.lives()]
+        if kind == WINNER:
+            self.winner_id = PLAYER.unpack_from(payload)[0]
+            return [f"Player {self.winner_id} won the game"]
+        return []
+
+    def apply_snapshot(self, kind, payload):
+        was_synced = self.synced
+        self.curr_round, self.dealer_id = ROUND.unpack_from(payload)
+        offset = ROUND.size
+        self.players_lives = decode_ints(payload[offset:])
+        offset += ints_size(len(self.players_lives))
+        self.players_bets = decode_ints(payload[offset:])
+        offset += ints_size(len(self.players_bets))
+        self.players_wins = decode_ints(payload[offset:])
+        self.synced = True
+
+        if kind == DEALT:
+            return [f"Player {self.dealer_id} dealt, lives: {self.lives()}"]
+        if not was_synced:
+            return [
+                f"Joined in round {self.curr_round} of player {self.dealer_id}'s "
+                f"deal, lives: {self.lives()}"
+            ]
+        return []
+
+    def apply_trick(self, payload):
+        self.curr_round, win_player_id = ROUND.unpack_from(payload)
+        played_cards = decode_played_cards(payload[ROUND.size :])
+        self.players_wins = decode_ints(
+            payload[ROUND.size + COUNT.size + PLAYED_CARD.size * len(played_cards) :]
+        )
+        cards = ", ".join(
+            f"player {player_id} {Card(rank, suit).to_string()}"
+            for player_id, rank, suit in played_cards
+        )
+        return [f"Round {self.curr_round}: {cards}, player {win_player_id} took it"]
+
+    def lives(self):
+        return ", ".join(
+            f"player {player_id + 1} {lives}"
+            for player_id, lives in enumerate(self.players_lives)
+        )
+
+    def alive(self, values):
+        return [
+            (player_id + 1, value)
+            for player_id, value in enumerate(values)
+            if player_id >= len(self.players_lives) or self.players_lives[player_id] > 0
+        ]
+
+
+def listen(port, group=None):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Any number of spectators may watch from one host
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("", port))
+    if group:
+        sock.setsockopt(
+            socket.IPPROTO_IP,
+            socket.IP_ADD_MEMBERSHIP,
+            socket.inet_aton(group) + socket.inet_aton("0.0.0.0"),
+        )
+    return sock
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Watch games published with main.py --spectators"
+    )
+    parser.add_argument("-p", "--port", type=int, default=SPECTATOR_PORT)
+    parser.add_argument(
+        "-g", "--group", type=str, help="Multicast group the games are sent to"
+    )
+    parser.add_argument("-t", "--table", type=int, help="Only watch this table")
+    parser.add_argument(
+        "--once", action="store_true", help="Exit once a game has a winner"
+    )
+    args = parser.parse_args()
+
+    try:
+        sock = listen(args.port, args.group)
+    except OSError as error:
+        parser.error(f"Cannot listen on port {args.port}: {error}")
+
+    spectator = Spectator(args.table)
+    try:
+        while True:
+            datagram = sock.recv(65535)
+            for line in spectator.receive(datagram):
+                print(line, flush=True)
+            if args.once and spectator.winner_id:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+
+
+if __name__ == "__main__":
+    main()
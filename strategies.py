@@ -0,0 +1,285 @@
+import math
+import random
+import select
+import sys
+import time
+
+from game import DECK_SIZE, Card, TurnExpired
+from settings import DECISION_BUDGET
+
+# Situations the Monte Carlo bot remembers its decision for
+MEMO_SIZE = 4096
+
+
+class Strategy:
+    rng = random  # bots that sample draw from this
+
+    # Returns how many rounds the player bets to win
+    def choose_bet(self, game, bets):
+        raise NotImplementedError
+
+    # Returns the index in game.player_hand of the card to play
+    def choose_card(self, game, played_cards):
+        raise NotImplementedError
+
+
+# Reads the decisions of a human player from the terminal, TurnExpired once
+# the turn deadline of the game passes without an answer
+class TerminalStrategy(Strategy):
+    def choose_bet(self, game, bets):
+        prompt = "Place your bet - how many rounds are you going to win?\n"
+        bet = int(read_line(game, prompt))
+        while bet < 0 or bet > game.cards_per_hand:
+            bet = int(read_line(game, prompt))
+        return bet
+
+    def choose_card(self, game, played_cards):
+        game.print_hand()
+
+        card_index = int(read_line(game, "\nPlay your card: \n")) - 1
+        while card_index < 0 or card_index > len(game.player_hand) - 1:
+            card_index = int(read_line(game, "\nPlay your card: \n")) - 1
+        return card_index
+
+
+def read_line(game, prompt):
+    if not game.turn_deadline:
+        return input(prompt)
+
+    print(prompt, end="", flush=True)
+    remaining = game.turn_deadline - time.monotonic()
+    if remaining <= 0 or not select.select([sys.stdin], [], [], remaining)[0]:
+        raise TurnExpired
+    line = sys.stdin.readline()
+    if not line:
+        raise EOFError
+    return line
+
+
+class RandomStrategy(Strategy):
+    rng = random
+
+    def __init__(self, rng=None):
+        if rng:
+            self.rng = rng
+
+    def choose_bet(self, game, bets):
+        return self.rng.randint(0, game.cards_per_hand)
+
+    def choose_card(self, game, played_cards):
+        return self.rng.randrange(len(game.player_hand))
+
+
+class HighCardStrategy(Strategy):
+    # Bets on every face card or ace and always plays its best card
+    def choose_bet(self, game, bets):
+        return sum(1 for card in game.player_hand if card.rank >= 9)
+
+    def choose_card(self, game, played_cards):
+        hand = game.player_hand
+        return max(range(len(hand)), key=hand.__getitem__)
+
+
+# Bets the tricks its hand is expected to take, then picks each card by
+# playing the rest of the great round out on random deals of the cards it has
+# not seen, opponents playing at random. Every decision stops sampling once
+# its budget is spent, or after a fixed number of deals when one is given.
+class MonteCarloStrategy(Strategy):
+    budget = DECISION_BUDGET
+    deals = 0  # deals sampled per search in place of the budget, 0 for none
+    bet = 0
+    seen: list = None  # cards this player saw played this great round
+    memo: dict = None  # situation -> decision, oldest evicted first
+
+    decisions = 0
+    playouts = 0
+    memo_hits = 0
+
+    def __init__(
+        self, rng=None, budget=DECISION_BUDGET, memo_size=MEMO_SIZE, deals=0
+    ):
+        if rng:
+            self.rng = rng
+        self.budget = budget
+        self.deals = deals
+        self.memo_size = memo_size
+        self.seen = []
+        self.memo = {}
+
+    def memoized(self, key, decide):
+        self.decisions += 1
+        if key in self.memo:
+            self.memo_hits += 1
+            return self.memo[key]
+
+        decision = decide()
+        if len(self.memo) >= self.memo_size:
+            del self.memo[next(iter(self.memo))]
+        self.memo[key] = decision
+        return decision
+
+    ########################### BETS ###########################
+
+    def choose_bet(self, game, bets):
+        self.seen = []
+        hand = tuple(sorted(game.player_hand))
+        opponents = game.number_players_alive() - 1
+        claimed = sum(bet for _, bet in bets)
+
+        self.bet = self.memoized(
+            ("bet", hand, opponents, game.num_decks, game.cards_per_hand, claimed),
+            lambda: estimate_bet(
+                hand, opponents, game.num_decks, game.cards_per_hand, claimed
+            ),
+        )
+        return self.bet
+
+    ########################### CARDS ##########################
+
+    def choose_card(self, game, played_cards):
+        hand = game.player_hand
+        played = [Card(rank, suit) for _, rank, suit in played_cards]
+        self.seen += played
+        if len(hand) == 1:
+            self.decisions += 1
+            return 0
+
+        need = self.bet - game.players_wins[game.player_id - 1]
+        seats = [game.player_id]
+        for _ in range(game.number_players_alive() - 1):
+            seats.append(game.next_alive_player(seats[-1]))
+
+        # Only the order of the cards still in play matters, situations are
+        # remembered by the places of the cards among them. Player ids only
+        # break ties between copies of a card.
+        unseen = self.unseen_cards(game.num_decks, hand)
+        places = {
+            card: place
+            for place, card in enumerate(sorted(set(hand + played + unseen)))
+        }
+        key = (
+            tuple(sorted(places[card] for card in hand)),
+            tuple(places[card] for card in played),
+            len(places),
+            need,
+            tuple(seats) if game.num_decks > 1 else len(seats),
+        )
+
+        # A turn deadline shorter than the budget cuts the search
+        deadline = math.inf if self.deals else time.monotonic() + self.budget
+        if game.turn_deadline:
+            deadline = min(deadline, game.turn_deadline)
+        place = self.memoized(
+            key,
+            lambda: places[self.search(hand, played, unseen, need, seats, deadline)],
+        )
+        for card_index, card in enumerate(hand):
+            if places[card] == place:
+                return card_index
+
+    # Candidates are played out on the same deals, so they are compared on
+    # equal luck
+    def search(self, hand, played, unseen, need, seats, deadline):
+        candidates = sorted(set(hand))
+        losses = [0] * len(candidates)
+
+        # Seat 0 is this player, the trick so far was played by the seats
+        # before it
+        num_seats = len(seats)
+        leader = (num_seats - len(played)) % num_seats
+        trick = [(card, (leader + i) % num_seats) for i, card in enumerate(played)]
+        sizes = [len(hand)] * num_seats
+        for _, seat in trick:
+            sizes[seat] -= 1
+        dealt = sum(sizes) - len(hand)
+
+        rng = self.rng
+        sampled = 0
+        while True:
+            deal = rng.sample(unseen, min(dealt, len(unseen)))
+            hands = [list(hand)]
+            offset = 0
+            for size in sizes[1:]:
+                hands.append(deal[offset : offset + size])
+                offset += size
+
+            for i, card in enumerate(candidates):
+                losses[i] += self.playout(
+                    card, [list(cards) for cards in hands], trick, leader, need, seats
+                )
+            self.playouts += 1
+            sampled += 1
+            if sampled == self.deals or time.monotonic() >= deadline:
+                break
+
+        return candidates[losses.index(min(losses))]
+
+    # Plays the great round out from this player's card and returns the lives
+    # it costs. Beyond the sampled card this player plays high while it still
+    # needs tricks and low once it has enough.
+    def playout(self, card, hands, trick, leader, need, seats):
+        rng = self.rng
+        num_seats = len(hands)
+        won = 0
+        trick = list(trick)
+
+        for trick_index in range(len(hands[0])):
+            if trick_index:
+                trick = []
+            for offset in range(len(trick), num_seats):
+                seat = (leader + offset) % num_seats
+                cards = hands[seat]
+                if not cards:
+                    continue
+                if seat:
+                    chosen = cards[int(rng.random() * len(cards))]
+                elif not trick_index:
+                    chosen = card
+                elif won < need:
+                    chosen = max(cards)
+                else:
+                    chosen = min(cards)
+                cards.remove(chosen)
+                trick.append((chosen, seat))
+
+            # Highest card wins, the lowest player id on a tie
+            best, leader = trick[0]
+            for chosen, seat in trick:
+                if chosen > best or (chosen == best and seats[seat] < seats[leader]):
+                    best, leader = chosen, seat
+            if not leader:
+                won += 1
+
+        return abs(need - won)
+
+    def unseen_cards(self, num_decks, hand):
+        counts = [num_decks] * DECK_SIZE
+        for card in hand:
+            counts[card] -= 1
+        for card in self.seen:
+            counts[card] -= 1
+        return [card for card, count in enumerate(counts) for _ in range(count)]
+
+
+# Each card takes its trick when every opponent plays below it, which with
+# cards as ints is a count of the lower cards left. Tricks already claimed by
+# earlier bets pull a larger estimate halfway down.
+def estimate_bet(hand, opponents, num_decks, cards_per_hand, claimed):
+    unseen = DECK_SIZE * num_decks - len(hand)
+    expected = 0.0
+    for card in hand:
+        lower = card * num_decks - sum(1 for other in hand if other < card)
+        expected += (lower / unseen) ** opponents
+
+    room = max(0, cards_per_hand - claimed)
+    if expected > room:
+        expected = (expected + room) / 2
+    return min(cards_per_hand, int(expected + 0.5))
+
+
+# Bots selectable on the command line
+STRATEGIES = {
+    "random": RandomStrategy,
+    "high": HighCardStrategy,
+    "mc": MonteCarloStrategy,
+}
@@ -0,0 +1,178 @@
+import argparse
+import random
+import time
+from collections import deque
+
+from game import Game
+from network import BootstrapError, Network
+from protocol import MAX_SEQ, frame_table, is_hello
+from settings import BASE_PORT, BUFFER_SIZE, NUM_PLAYERS, STARTUP_TIMEOUT
+from simulation import silent
+from strategies import STRATEGIES
+
+# Tables started at once by this node, each active table keeps one datagram in
+# flight so this bounds what the socket buffers must hold
+MAX_ACTIVE_TABLES = 64
+
+
+# Network seen by one table, the socket is shared by every table on the node
+class TableChannel:
+    has_token = 0
+    seq = 0
+    epoch = 0
+    last_sent = None
+    on_token_lost = None
+
+    def __init__(self, sock, next_address):
+        self.sock = sock
+        self.next_address = next_address
+
+    def next_seq(self):
+        self.seq = (self.seq + 1) & MAX_SEQ
+        return self.seq
+
+    # Every table shares the node's successor
+    def can_splice(self):
+        return False
+
+    def send_message(self, message):
+        if not self.has_token:
+            print("The player does not have the token to send the message")
+            exit(1)
+
+        self.sock.sendto(message, self.next_address)
+        self.last_sent = message
+        self.has_token = 0
+
+
+# Hosts the same seat of many tables behind one socket, datagrams are routed
+# to their table by the table id in the frame header
+class TableNode:
+    network: Network = {}
+    tables: dict[int, Game] = {}
+    pending: deque = None  # tables this node deals first, not started yet
+    finished = 0
+
+    def __init__(self, player_id, network, max_active=MAX_ACTIVE_TABLES):
+        self.player_id = player_id
+        self.network = network
+        self.next_address = (network.next_player_ip, network.next_player_port)
+        self.max_active = max_active
+        self.tables = {}
+        self.pending = deque()
+
+    def add_table(self, table_id, **game_options):
+        channel = TableChannel(self.network.sock, self.next_address)
+        game = Game(self.player_id, channel, table_id=table_id, **game_options)
+        self.tables[table_id] = game
+        if game.is_dealer():
+            self.pending.append(game)
+        return game
+
+    def start_next_table(self):
+        if self.pending:
+            self.pending.popleft().start_great_round()
+
+    # The node dealing the tables waits for the startup barrier, the others
+    # pass its lap on
+    def start(self):
+        if self.network.startup_timeout:
+            self.network.bootstrap(bool(self.pending))
+        for _ in range(self.max_active):
+            self.start_next_table()
+
+    def serve(self):
+        sock = self.network.sock
+        tables = self.tables
+
+        while tables:
+            data, address = sock.recvfrom(BUFFER_SIZE)
+            if is_hello(data):
+                # Probes and laps still going round after the barrier
+                self.network.answer_hello(data, address)
+                continue
+
+            game = tables.get(frame_table(data))
+            if game is None:
+                # Table already finished here
+                continue
+
+            game.network.has_token = 1
+            if not game.handle_message(game.decode_message(data)):
+                del tables[game.table_id]
+                self.finished += 1
+                self.start_next_table()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-table game node")
+    parser.add_argument(
+        "-n", "--player-id", type=int, required=True, help="Seat of this node"
+    )
+    parser.add_argument(
+        "-i", "--player-ip", type=str, required=True, help="IP address of this node"
+    )
+    parser.add_argument(
+        "-o",
+        "--next-player-ip",
+        type=str,
+        required=True,
+        help="IP address of the next node in the ring",
+    )
+    parser.add_argument("-t", "--tables", type=int, default=1000)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("--strategy", choices=list(STRATEGIES), default="random")
+    parser.add_argument(
+        "--max-active",
+        type=int,
+        default=MAX_ACTIVE_TABLES,
+        help="Tables this node starts at once",
+    )
+    parser.add_argument("--base-port", type=int, default=BASE_PORT)
+    parser.add_argument(
+        "--startup-timeout",
+        type=float,
+        default=STARTUP_TIMEOUT,
+        help="Seconds the ring has to come up before the first deal, 0 deals "
+        "at once, every node must agree",
+    )
+    args = parser.parse_args()
+
+    network = Network(
+        args.player_id,
+        args.player_ip,
+        args.next_player_ip,
+        NUM_PLAYERS,
+        args.base_port,
+        startup_timeout=args.startup_timeout,
+    )
+    node = TableNode(args.player_id, network, args.max_active)
+
+    rng = random.Random(f"{args.seed}:{args.player_id}")
+    for table_id in range(args.tables):
+        strategy = STRATEGIES[args.strategy]()
+        strategy.rng = random.Random(rng.getrandbits(64))
+        node.add_table(
+            table_id,
+            strategy=strategy,
+            rng=random.Random(rng.getrandbits(64)),
+            output=silent,
+        )
+
+    start = time.perf_counter()
+    try:
+        node.start()
+    except BootstrapError as error:
+        print(error)
+        exit(1)
+    node.serve()
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"Player {args.player_id} finished {node.finished} tables in {elapsed:.2f}s "
+        f"({node.finished / elapsed:.0f} tables/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+from settings import BASE_PORT
+
+
+# Ring of (player_id, host, port) entries. Player ids must be 1..N and the
+# token travels in id order, wrapping from N back to 1.
+class Topology:
+    nodes: dict[int, tuple[str, int]] = {}
+
+    def __init__(self, entries):
+        self.nodes = {}
+        for player_id, host, port in entries:
+            if player_id in self.nodes:
+                raise ValueError(f"Player {player_id} appears twice in the topology")
+            self.nodes[player_id] = (host, port)
+
+        expected = set(range(1, len(self.nodes) + 1))
+        if set(self.nodes) != expected:
+            missing = sorted(expected - set(self.nodes))
+            raise ValueError(
+                f"Topology player ids must be 1..{len(self.nodes)}, missing {missing}"
+            )
+        if len(self.nodes) < 2:
+            raise ValueError("A ring needs at least 2 players")
+
+    @property
+    def num_players(self):
+        return len(self.nodes)
+
+    def address(self, player_id):
+        return self.nodes[player_id]
+
+    def next_player(self, player_id):
+        return player_id % self.num_players + 1
+
+    @classmethod
+    def consecutive(cls, num_players, host="127.0.0.1", base_port=BASE_PORT):
+        return cls(
+            (player_id, host, base_port + player_id - 1)
+            for player_id in range(1, num_players + 1)
+        )
+
+    # Entry format - ID:HOST:PORT
+    @classmethod
+    def parse_entry(cls, entry):
+        try:
+            player_id, host, port = entry.rsplit(":", 2)
+            return int(player_id), host, int(port)
+        except ValueError:
+            raise ValueError(f"Invalid topology entry {entry!r}, expected ID:HOST:PORT")
+
+    @classmethod
+    def from_list(cls, entries):
+        return cls(cls.parse_entry(entry) for entry in entries)
+
+    # File format - one "ID HOST PORT" per line, # starts a comment
+    @classmethod
+    def load(cls, path):
+        entries = []
+        with open(path) as file:
+            for line_number, line in enumerate(file, start=1):
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+
+                fields = line.split()
+                if len(fields) != 3:
+                    raise ValueError(
+                        f"{path}:{line_number}: expected ID HOST PORT, got {line!r}"
+                    )
+                entries.append((int(fields[0]), fields[1], int(fields[2])))
+
+        return cls(entries)
@@ -0,0 +1,209 @@
+import argparse
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from settings import CARDS_PER_HAND, NUM_LIVES, NUM_PLAYERS, TOURNAMENT_DEALS
+from simulation import Simulation
+from strategies import STRATEGIES, MonteCarloStrategy
+
+
+# Aggregated results, cheap to pickle back from the workers and to merge
+class TournamentStats:
+    games = 0
+    unfinished = 0
+    great_rounds = 0
+    frames = 0
+    wins = []  # wins[player_id - 1]
+    eliminations = {}  # great round -> players eliminated in it
+    bet_errors = {}  # |bet - wins| -> occurrences
+
+    def __init__(self):
+        self.wins = [0] * NUM_PLAYERS
+        self.eliminations = {}
+        self.bet_errors = {}
+
+    def great_round_finished(self, game):
+        for i in range(NUM_PLAYERS):
+            if self.alive[i]:
+                error = abs(game.players_bets[i] - game.players_wins[i])
+                self.bet_errors[error] = self.bet_errors.get(error, 0) + 1
+
+        self.curr_great_round += 1
+        for i, life in enumerate(game.players_lives):
+            if life <= 0 and self.alive[i]:
+                self.alive[i] = 0
+                self.eliminations[self.curr_great_round] = (
+                    self.eliminations.get(self.curr_great_round, 0) + 1
+                )
+
+    def start_game(self):
+        self.alive = [1] * NUM_PLAYERS
+        self.curr_great_round = 0
+
+    def add_result(self, result):
+        self.games += 1
+        self.great_rounds += result["great_rounds"]
+        self.frames += result["frames"]
+        if result["winner"]:
+            self.wins[result["winner"] - 1] += 1
+        else:
+            self.unfinished += 1
+
+    def merge(self, other):
+        self.games += other.games
+        self.unfinished += other.unfinished
+        self.great_rounds += other.great_rounds
+        self.frames += other.frames
+        self.wins = [a + b for a, b in zip(self.wins, other.wins)]
+        for great_round, count in other.eliminations.items():
+            self.eliminations[great_round] = (
+                self.eliminations.get(great_round, 0) + count
+            )
+        for error, count in other.bet_errors.items():
+            self.bet_errors[error] = self.bet_errors.get(error, 0) + count
+
+    # Per-game scratch state does not need to travel between processes
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop("alive", None)
+        state.pop("curr_great_round", None)
+        return state
+
+
+def run_chunk(task):
+    strategy_name, cards_per_hand, num_lives, seed, games = task
+
+    rng = random.Random(seed)
+    stats = TournamentStats()
+    strategy_class = STRATEGIES[strategy_name]
+
+    for _ in range(games):
+        # Bots that sample draw from the chunk seed, never the global random
+        strategies = [strategy_class() for _ in range(NUM_PLAYERS)]
+        for strategy in strategies:
+            strategy.rng = random.Random(rng.getrandbits(64))
+            if isinstance(strategy, MonteCarloStrategy):
+                strategy.deals = TOURNAMENT_DEALS
+
+        stats.start_game()
+        simulation = Simulation(
+            strategies,
+            rng.getrandbits(64),
+            cards_per_hand=cards_per_hand,
+            num_lives=num_lives,
+            observer=stats,
+        )
+        stats.add_result(simulation.run())
+
+    return stats
+
+
+# Chunk seeds only depend on the base seed and the chunk index, so results do
+# not change with the number of workers
+def make_tasks(strategy_name, cards_per_hand, num_lives, games, chunk_size, seed):
+    tasks = []
+    for i, start in enumerate(range(0, games, chunk_size)):
+        chunk_seed = random.Random(f"{seed}:{i}").getrandbits(64)
+        tasks.append(
+            (
+                strategy_name,
+                cards_per_hand,
+                num_lives,
+                chunk_seed,
+                min(chunk_size, games - start),
+            )
+        )
+    return tasks
+
+
+def run_tournament(
+    games,
+    strategy_name="random",
+    cards_per_hand=CARDS_PER_HAND,
+    num_lives=NUM_LIVES,
+    workers=None,
+    chunk_size=1000,
+    seed=0,
+):
+    tasks = make_tasks(
+        strategy_name, cards_per_hand, num_lives, games, chunk_size, seed
+    )
+    stats = TournamentStats()
+
+    if workers == 1:
+        for task in tasks:
+            stats.merge(run_chunk(task))
+        return stats
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_stats in executor.map(run_chunk, tasks):
+            stats.merge(chunk_stats)
+
+    return stats
+
+
+def print_stats(cards_per_hand, num_lives, stats, elapsed):
+    print("=============================")
+    print(f"Cards per hand: {cards_per_hand}, lives: {num_lives}")
+    print(
+        f"{stats.games} games in {elapsed:.2f}s ({stats.games / elapsed:.0f} games/s), "
+        f"{stats.great_rounds / stats.games:.2f} great rounds per game"
+    )
+    for i, wins in enumerate(stats.wins):
+        print(f"Player {i + 1} won {wins / stats.games:.1%}")
+    if stats.unfinished:
+        print(f"{stats.unfinished} games hit the great round limit")
+
+    print("Eliminations by great round:")
+    for great_round in sorted(stats.eliminations):
+        print(f"  {great_round}: {stats.eliminations[great_round]}")
+
+    total_bets = sum(stats.bet_errors.values())
+    mean_error = sum(e * c for e, c in stats.bet_errors.items()) / total_bets
+    print(f"Mean |bet - wins|: {mean_error:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo tournament runner")
+    parser.add_argument("-g", "--games", type=int, default=100000)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument(
+        "-w", "--workers", type=int, default=os.cpu_count(), help="Worker processes"
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=1000, help="Games per worker task"
+    )
+    parser.add_argument("--strategy", choices=list(STRATEGIES), default="random")
+    parser.add_argument(
+        "--cards-per-hand",
+        type=int,
+        nargs="+",
+        default=[CARDS_PER_HAND],
+        help="Hand sizes to evaluate",
+    )
+    parser.add_argument(
+        "--lives", type=int, nargs="+", default=[NUM_LIVES], help="Lives to evaluate"
+    )
+    args = parser.parse_args()
+
+    for cards_per_hand, num_lives in itertools.product(
+        args.cards_per_hand, args.lives
+    ):
+        start = time.perf_counter()
+        stats = run_tournament(
+            args.games,
+            args.strategy,
+            cards_per_hand,
+            num_lives,
+            args.workers,
+            args.chunk_size,
+            args.seed,
+        )
+        print_stats(cards_per_hand, num_lives, stats, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()